@@ -1 +1,42 @@
-from .source_manipulation import *
+"""
+benchify: property-based analysis of python functions
+
+The package's names are imported when first used, so that importing a light
+module (e.g. for the CLI to talk to a running daemon) does not load them all.
+"""
+import importlib as _importlib
+
+_CLIENT_NAMES = ["AnalysisResult", "BenchifyClient"]
+
+# What `from .source_manipulation import *` used to export, plus the client
+__all__ = _CLIENT_NAMES + [
+    "PYPI_PROJECTS", "SCOPE_NODES", "SourceEditor", "build_full_import_map",
+    "build_import_text", "can_import_via_pip", "classify", "classify_wrap",
+    "classify_wrap_indented", "extract_pip_imports", "find_local_module",
+    "get_all_function_names", "get_bound_names", "get_docstring_nodes",
+    "get_first_line", "get_function_source", "get_function_source_from_source",
+    "get_function_spans", "get_import_info", "get_import_info_recursive",
+    "get_indentation_level", "get_local_import_bindings", "get_mutated_names",
+    "get_needed_aliases", "get_needed_import_nodes", "get_pip_imports_for_function",
+    "get_pip_imports_recursive", "get_reachable_statement_indices",
+    "get_reachable_statements", "get_referenced_names", "get_source_lines",
+    "get_top_level_function_names", "get_top_level_lambda_function_names",
+    "get_used_attributes", "is_pip_installed_package", "is_string_statement",
+    "is_system_package", "iter_import_time_nodes", "iter_same_scope_nodes",
+    "normalize_imported_modules_in_code", "remove_docstrings", "replace_block_comments",
+    "strip_docstrings",
+]
+
+def __getattr__(name):
+    if name in _CLIENT_NAMES:
+        return getattr(_importlib.import_module(".client", __name__), name)
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    source_manipulation = _importlib.import_module(".source_manipulation", __name__)
+    try:
+        return getattr(source_manipulation, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
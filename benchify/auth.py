@@ -0,0 +1,242 @@
+"""
+authentication against Auth0 via the device authorization flow
+"""
+import hashlib
+import os
+import pickle
+import time
+from typing import Any, Dict, Optional
+import webbrowser
+
+import appdirs
+from auth0.authentication.token_verifier \
+    import TokenVerifier, AsymmetricSignatureVerifier
+
+import jwt
+import requests
+from rich import print as rprint
+
+import typer
+
+from .storage import FileLock, atomic_write
+
+AUTH0_DOMAIN    = 'benchify.us.auth0.com'
+AUTH0_CLIENT_ID = 'VessO49JLtBhlVXvwbCDkeXZX4mHNLFs'
+ALGORITHMS      = ['RS256']
+
+def get_auth_base_url() -> str:
+    """
+    Where the device authorization flow runs: $BENCHIFY_AUTH_URL if it is
+    set (e.g. to a local `benchify mock-server`), else Auth0.
+    """
+    return (os.environ.get("BENCHIFY_AUTH_URL") or f"https://{AUTH0_DOMAIN}").rstrip("/")
+
+def get_token_file_path() -> str:
+    """
+    Determines where to save & load token.  Tokens from another auth server
+    than Auth0 are kept apart, so they never replace the real one.
+    """
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    token_file = "token.pickle"
+    if os.environ.get("BENCHIFY_AUTH_URL"):
+        auth_hash = hashlib.sha256(get_auth_base_url().encode("utf-8")).hexdigest()
+        token_file = f"token-{auth_hash[:8]}.pickle"
+    token_file_path = os.path.join(app_dirs.user_data_dir, token_file)
+    return token_file_path
+
+def get_token_lock_path() -> str:
+    """
+    The lock held while the token is renewed, so that concurrent processes
+    renew it only once.
+    """
+    return get_token_file_path() + ".lock"
+
+def save_token(token_data: Any) -> bool:
+    """
+    Saves the token_data to get_token_file_path(), atomically, so that
+    concurrent readers never see a partially written token.
+    """
+    try:
+        token_file_path = get_token_file_path()
+        os.makedirs(os.path.dirname(token_file_path), exist_ok=True)
+        atomic_write(token_file_path, pickle.dumps(token_data), mode=0o600)
+    #pylint:disable=broad-exception-caught
+    except Exception as e:
+        print("Encountered exception while attempting to save token: ", e)
+        return False
+    return True
+
+def load_token() -> Any:
+    """
+    Loads the token_data from get_token_file_path(), or returns None if
+    there is none (or it is unreadable, e.g. left truncated by an older
+    version).
+    """
+    token_file_path = get_token_file_path()
+    try:
+        with open(token_file_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def validate_token(id_token: str) -> Dict[str,Any]:
+    """
+    Verify the token and its precedence
+    """
+    jwks_url = f"{get_auth_base_url()}/.well-known/jwks.json"
+    issuer = f"{get_auth_base_url()}/"
+    sign_verifier = AsymmetricSignatureVerifier(jwks_url)
+    token_verifier = TokenVerifier(
+        signature_verifier=sign_verifier,
+        issuer=issuer,
+        audience=AUTH0_CLIENT_ID)
+    try:
+        decoded_payload = token_verifier.verify(id_token)
+        return decoded_payload
+    except Exception as e:
+        raise e
+
+#pylint:disable=too-few-public-methods
+class AuthTokens:
+    """
+    id and access tokens
+    """
+    id_token: str = ""
+    access_token: str = ""
+    user: Optional[Dict[str, Any]] = None
+    def __init__(self, my_id_token, access_token, user=None):
+        self.id_token = my_id_token
+        self.access_token = access_token
+        self.user = user
+
+def load_valid_tokens(report: bool = True) -> Optional[AuthTokens]:
+    """
+    The saved tokens, if there are any and they are still valid, along with
+    the (decoded) user they belong to.  With report, says which it is.
+    """
+    token_data = load_token()
+    # If token exists, check if it's valid
+    if token_data:
+        try:
+            _ = validate_token(token_data['id_token'])
+            if report:
+                rprint('✅ Using existing valid token')
+            user = jwt.decode(
+                token_data['id_token'],
+                algorithms=ALGORITHMS,
+                options={ "verify_signature": False })
+            return AuthTokens(
+                my_id_token=token_data['id_token'],
+                access_token=token_data['access_token'],
+                user=user
+            )
+        #pylint:disable=broad-exception-caught
+        except Exception:
+            if report:
+                rprint('❌ Existing token is invalid, requesting a new one.')
+    elif report:
+        print("No cached token found, requesting a new one.")
+    return None
+
+def login() -> AuthTokens:
+    """
+    Returns the tokens along with the (decoded) user they belong to: the
+    saved ones if they are still valid, or else new ones from the device
+    authorization flow.
+
+    Renewing is single-flight across processes: the process renewing the
+    token holds the token lock, and others needing a new token meanwhile
+    wait for it, then reuse the token it saved rather than each starting
+    its own device flow.  Checking a valid token takes no lock.
+    """
+    tokens = load_valid_tokens()
+    if tokens is not None:
+        return tokens
+    token_lock = FileLock(get_token_lock_path())
+    if not token_lock.acquire(blocking=False):
+        rprint('Waiting for another benchify process to log in...')
+        token_lock.acquire()
+    try:
+        # Another process may have renewed the token in the meantime
+        return load_valid_tokens(report=False) or renew_tokens()
+    finally:
+        token_lock.release()
+
+def renew_tokens() -> AuthTokens:
+    """
+    Runs the device authorization flow and saves the new token.  Only call
+    it while holding the token lock (see login).
+    """
+    device_code_payload = {
+        'client_id': AUTH0_CLIENT_ID,
+        'scope': 'openid profile'
+    }
+
+    login_timeout = 60
+    try:
+        device_code_response = requests.post(
+            f"{get_auth_base_url()}/oauth/device/code",
+            data=device_code_payload, timeout=login_timeout)
+    except requests.exceptions.Timeout:
+        rprint('Error generating the device code')
+        #pylint:disable=raise-missing-from
+        raise typer.Exit(code=1)
+
+    if device_code_response.status_code != 200:
+        rprint('Error generating the device code')
+        raise typer.Exit(code=1)
+
+    rprint('Device code successful')
+    device_code_data = device_code_response.json()
+
+    rprint(
+        '1. On your computer or mobile device navigate to: ',
+        device_code_data['verification_uri_complete'])
+    rprint('2. Enter the following code: ', device_code_data['user_code'])
+
+    try:
+        webbrowser.open(device_code_data['verification_uri_complete'], new=1)
+    except webbrowser.Error as _browser_exception:
+        pass
+
+    token_payload = {
+        'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
+        'device_code': device_code_data['device_code'],
+        'client_id': AUTH0_CLIENT_ID
+    }
+
+    authenticated = False
+
+    while not authenticated:
+        token_response = requests.post(
+            f"{get_auth_base_url()}/oauth/token",
+            data=token_payload,
+            timeout=None)
+
+        token_data = token_response.json()
+        if token_response.status_code == 200:
+            try:
+                _ = validate_token(token_data['id_token'])
+            except Exception as e:
+                rprint("Encountered exception validating token: ", e)
+                raise typer.Exit(code=1)
+            user = jwt.decode(
+                token_data['id_token'],
+                algorithms=ALGORITHMS,
+                options={ "verify_signature": False })
+            rprint('✅ Authenticated!')
+            authenticated = True
+        elif token_data['error'] not in ('authorization_pending', 'slow_down'):
+            rprint(token_data['error_description'])
+            raise typer.Exit(code=1)
+        else:
+            time.sleep(device_code_data['interval'])
+
+    # Save the new token to file
+    save_token(token_data)
+
+    return AuthTokens(
+        my_id_token=token_data['id_token'],
+        access_token=token_data['access_token'],
+        user=user
+    )
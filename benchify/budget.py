@@ -0,0 +1,176 @@
+"""
+spends a fixed time budget on the most valuable analyses first
+"""
+import ast
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .function_index import IndexedModule
+from .latency import estimate_batch, format_duration
+from .source_manipulation import get_bound_names
+
+DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$")
+
+DECISION_NODES = (
+    ast.If, ast.IfExp, ast.For, ast.AsyncFor, ast.While, ast.ExceptHandler,
+    ast.With, ast.AsyncWith, ast.Assert, ast.comprehension)
+
+def parse_duration(text: str) -> float:
+    """
+    Parses a duration such as "90", "90s", "10m" or "1.5h" into seconds.
+
+    Raises:
+        ValueError: If text is not a duration.
+    """
+    match = DURATION.match(text)
+    if match is None:
+        raise ValueError(f"Not a duration: {text!r} (try e.g. 10m)")
+    unit = {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return float(match.group(1)) * unit
+
+def get_complexity(node: ast.AST) -> int:
+    """
+    The cyclomatic complexity of node: one plus its branches, loops,
+    exception handlers and boolean operators.
+    """
+    complexity = 1
+    for child in ast.walk(node):
+        if isinstance(child, DECISION_NODES):
+            complexity += 1
+        elif isinstance(child, ast.BoolOp):
+            complexity += len(child.values) - 1
+    return complexity
+
+def get_churn(span: Tuple[int, int], ranges: List[Tuple[int, int]]) -> int:
+    """
+    How many lines of the inclusive line span are among the changed ranges.
+    """
+    return sum(
+        max(0, min(span[1], end) - max(span[0], start) + 1) for start, end in ranges)
+
+#pylint:disable=too-few-public-methods
+#pylint:disable=too-many-instance-attributes
+class Candidate:
+    """
+    A function which could be analyzed within the budget.  Its value grows
+    with how many of its lines changed (churn) and with its size and
+    complexity; its cost is how long its request is expected to take, which
+    is predicted from its size and pip imports.  Cached functions cost
+    nothing.
+    """
+    #pylint:disable=too-many-arguments
+    def __init__(
+        self,
+        file: str,
+        name: str,
+        params: Dict[str, Any],
+        expected: float,
+        lines: int = 1,
+        complexity: int = 1,
+        churn: int = 0,
+        cached: bool = False):
+        self.file = file
+        self.name = name
+        self.params = params
+        self.expected = expected
+        self.lines = lines
+        self.complexity = complexity
+        self.churn = churn
+        self.cached = cached
+        self.value = (1 + churn) * (complexity + math.log2(1 + lines))
+
+    @property
+    def density(self) -> float:
+        """
+        Value per second of analysis.
+        """
+        return self.value / max(self.expected, 1e-3)
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        A structured summary of the candidate, e.g. for a deferred function.
+        """
+        return {
+            "file": self.file,
+            "function": self.name,
+            "value": round(self.value, 2),
+            "predicted_cost": round(self.expected, 1),
+            "churn": self.churn,
+            "lines": self.lines,
+            "complexity": self.complexity,
+        }
+
+def make_candidate(
+    file: str,
+    name: str,
+    params: Dict[str, Any],
+    expected: float,
+    module: IndexedModule,
+    changed_ranges: Optional[List[Tuple[int, int]]] = None,
+    cached: bool = False) -> Candidate:
+    """
+    Measures the top-level function called name in module.
+    """
+    node = next((node for node in module.tree.body if name in get_bound_names(node)), None)
+    span = module.function_spans.get(name, (1, 1))
+    return Candidate(
+        file, name, params, expected,
+        lines=span[1] - span[0] + 1,
+        complexity=get_complexity(node) if node is not None else 1,
+        churn=get_churn(span, changed_ranges or []),
+        cached=cached)
+
+class BudgetPlan:
+    """
+    Which candidates fit in the budget, and which are deferred to a later
+    run.  Cached candidates always fit.
+    """
+    def __init__(
+        self,
+        selected: List[Candidate],
+        deferred: List[Candidate],
+        cached: List[Candidate],
+        budget: float,
+        expected: float):
+        self.selected = selected
+        self.deferred = deferred
+        self.cached = cached
+        self.budget = budget
+        self.expected = expected
+
+    def summary(self) -> str:
+        """
+        The plan, for humans.
+        """
+        text = f"Budget {format_duration(self.budget)}: analyzing " + \
+            f"{len(self.selected)} functions (about {format_duration(self.expected)})"
+        if self.cached:
+            text += f", {len(self.cached)} already analyzed"
+        if self.deferred:
+            text += f", deferring {len(self.deferred)}"
+        return text + "."
+
+def plan_budget(candidates: List[Candidate], budget: float, concurrency: int) -> BudgetPlan:
+    """
+    Picks the uncached candidates to analyze within budget seconds, with
+    concurrency requests in flight: greedily by value per expected second,
+    adding each candidate which still fits (see estimate_batch).  The rest
+    are deferred, most valuable first.
+    """
+    cached = [candidate for candidate in candidates if candidate.cached]
+    ranked = sorted(
+        (candidate for candidate in candidates if not candidate.cached),
+        key=lambda candidate: (-candidate.density, -candidate.value,
+            candidate.file, candidate.name))
+    selected: List[Candidate] = []
+    deferred: List[Candidate] = []
+    expected: List[float] = []
+    for candidate in ranked:
+        if estimate_batch(expected + [candidate.expected], concurrency) <= budget:
+            selected.append(candidate)
+            expected.append(candidate.expected)
+        else:
+            deferred.append(candidate)
+    deferred.sort(key=lambda candidate: -candidate.value)
+    return BudgetPlan(selected, deferred, cached, budget, estimate_batch(expected, concurrency))
@@ -0,0 +1,196 @@
+"""
+finds the functions changed since some git ref
+"""
+import os
+import re
+import subprocess
+from typing import Dict, List, Optional, Set, Tuple
+
+from .function_index import FunctionIndex
+from .module_graph import ModuleGraph
+from .source_manipulation import \
+    get_bound_names, \
+    get_local_import_bindings, \
+    get_first_line, \
+    get_referenced_names
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+def run_git(args: List[str], cwd: str) -> str:
+    """
+    Runs git with args in cwd and returns its stdout.  Raises
+    subprocess.CalledProcessError if git fails.
+    """
+    return subprocess.run(
+        ["git"] + args,
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+        text=True).stdout
+
+def parse_diff_hunks(diff_text: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Parses the output of `git diff -U0` into the changed line ranges of each
+    file, in terms of the new version of the file.
+
+    Args:
+        diff_text (str): The unified diff.
+
+    Returns:
+        Dict[str, List[Tuple[int, int]]]: Maps each (repo-relative) path to a
+        list of inclusive (first_line, last_line) ranges.  Pure deletions are
+        recorded as the two lines around the deletion.
+    """
+    hunks: Dict[str, List[Tuple[int, int]]] = {}
+    current_file = None
+    for line in diff_text.splitlines():
+        if line.startswith("+++ "):
+            target = line[4:].strip()
+            current_file = None if target == "/dev/null" else target[2:]
+            if current_file is not None:
+                hunks.setdefault(current_file, [])
+            continue
+        match = HUNK_HEADER.match(line)
+        if match and current_file is not None:
+            start = int(match.group(1))
+            count = 1 if match.group(2) is None else int(match.group(2))
+            if count == 0:
+                hunks[current_file].append((max(start, 1), start + 1))
+            else:
+                hunks[current_file].append((start, start + count - 1))
+    return hunks
+
+def get_diff_base(ref: str, repo_root: str) -> str:
+    """
+    Returns the merge base of ref and HEAD, so that only the changes made on
+    this branch count, or ref itself if there is no merge base.
+    """
+    try:
+        return run_git(["merge-base", ref, "HEAD"], repo_root).strip() or ref
+    except subprocess.CalledProcessError:
+        return ref
+
+def get_changed_line_ranges(ref: str, repo_root: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Returns the changed line ranges of every python file which differs
+    between ref and the working tree, keyed by absolute path.  Untracked
+    (but not ignored) files, which git diff leaves out, are new, so all of
+    their lines count as changed.
+    """
+    diff_text = run_git(
+        ["diff", "-U0", "--no-color", "--no-ext-diff",
+         get_diff_base(ref, repo_root), "--", "*.py"],
+        repo_root)
+    changed_ranges = {
+        os.path.normpath(os.path.join(repo_root, path)): ranges
+        for path, ranges in parse_diff_hunks(diff_text).items()
+    }
+    untracked = run_git(
+        ["ls-files", "--others", "--exclude-standard", "--", "*.py"], repo_root)
+    for path in untracked.splitlines():
+        path = os.path.normpath(os.path.join(repo_root, path))
+        try:
+            with open(path, "rb") as fr:
+                line_count = len(fr.read().splitlines())
+        except OSError:
+            continue
+        changed_ranges[path] = [(1, max(1, line_count))]
+    return changed_ranges
+
+def overlaps(span: Tuple[int, int], ranges: List[Tuple[int, int]]) -> bool:
+    """
+    Whether the inclusive line span intersects any of the inclusive ranges.
+    """
+    return any(start <= span[1] and span[0] <= end for start, end in ranges)
+
+def get_changed_functions(
+    ref: str,
+    repo_root: str,
+    python_files: List[str],
+    index: Optional[FunctionIndex] = None,
+    graph: Optional[ModuleGraph] = None) -> Dict[str, List[str]]:
+    """
+    Finds the top-level functions changed since ref, plus the functions that
+    use something imported from a local module which (transitively) changed.
+
+    Args:
+        ref (str): The git ref to compare against, e.g. "origin/main".
+        repo_root (str): The root of the git repository.
+        python_files (List[str]): Absolute paths of the files to consider.
+        index (FunctionIndex): Used to parse the files, if shared.
+        graph (ModuleGraph): The project's (up to date) module graph, if
+            already loaded.
+
+    Returns:
+        Dict[str, List[str]]: Maps each file to its changed function names.
+    """
+    index = index if index is not None else FunctionIndex()
+    changed_ranges = get_changed_line_ranges(ref, repo_root)
+
+    modules = {}
+    for path in python_files:
+        try:
+            module = index.get(path)
+        except SyntaxError:
+            continue
+        if module is not None:
+            modules[module.path] = module
+
+    # Any module which changed (even outside of a function) taints the
+    # modules which import it, transitively.
+    if graph is None:
+        graph = ModuleGraph(repo_root)
+        graph.refresh(python_files)
+    tainted_modules = set()
+    for path in changed_ranges:
+        if path in modules:
+            tainted_modules |= graph.dependents(path) & set(modules)
+    import_bindings = {
+        path: get_local_import_bindings(modules[path].tree, path)
+        for path in tainted_modules
+    }
+
+    changed: Dict[str, Set[str]] = {}
+    for path in sorted(tainted_modules):
+        module = modules[path]
+        # Names bound by edited top-level statements or imported from
+        # tainted modules, propagated through the module's own references.
+        tainted_names = set()
+        for node in module.tree.body:
+            span = (get_first_line(node), node.end_lineno)
+            if overlaps(span, changed_ranges.get(path, [])):
+                tainted_names |= get_bound_names(node)
+        for local_path, names in import_bindings[path].items():
+            if local_path in tainted_modules:
+                tainted_names |= names
+        grew = True
+        while grew:
+            grew = False
+            for node in module.tree.body:
+                bound_names = get_bound_names(node)
+                if not bound_names <= tainted_names and \
+                    get_referenced_names(node) & tainted_names:
+
+                    tainted_names |= bound_names
+                    grew = True
+        changed[path] = tainted_names & set(module.function_spans)
+
+    return {
+        path: sorted(names)
+        for path, names in sorted(changed.items())
+        if names
+    }
+
+def list_python_files(repo_root: str) -> List[str]:
+    """
+    Lists the python files git knows about (tracked or untracked but not
+    ignored) as absolute paths.
+    """
+    output = run_git(
+        ["ls-files", "--cached", "--others", "--exclude-standard", "--", "*.py"],
+        repo_root)
+    return [
+        os.path.normpath(os.path.join(repo_root, path))
+        for path in output.splitlines()
+        if path and os.path.exists(os.path.join(repo_root, path))
+    ]
@@ -0,0 +1,673 @@
+"""
+in-process client for the benchify analysis API
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from rich import print as rprint
+
+from .auth import AuthTokens, load_valid_tokens, login
+from .environment import build_environment_manifest, invalidate_caches
+from .function_index import FunctionIndex
+from .fingerprint import fingerprint_params
+from .latency import FALLBACK_EXPECTED, LatencyEstimate, LatencyStore, estimate_batch
+# Kept importable from here for existing callers
+#pylint:disable=unused-import
+from .results import \
+    AmbiguousFunctionError, \
+    AnalysisError, \
+    AnalysisResult, \
+    get_code_blocks, \
+    get_properties
+from .scheduler import BudgetExhaustedError, SubmissionScheduler
+from .source_manipulation import \
+    get_pip_imports_recursive, \
+    can_import_via_pip, \
+    replace_block_comments
+
+GCLOUD_URL = "https://benchify.cloud/analyze"
+AWS_URL = "https://api.benchify.com/analyze"
+LOCAL_URL = "http://localhost:9091/analyze"
+PROXY_URL = "http://localhost:9092/analyze"
+
+DEFAULT_TIMEOUT = 300
+
+# How long to wait for a connection, however long the analysis may take
+CONNECT_TIMEOUT = 10
+
+def get_default_url() -> str:
+    """
+    The /analyze endpoint to use: $BENCHIFY_URL if it is set (e.g. to
+    PROXY_URL, to go through a shared `benchify proxy`), else AWS_URL.
+    """
+    return os.environ.get("BENCHIFY_URL") or AWS_URL
+
+def get_batch_url(url: str) -> str:
+    """
+    The batched endpoint next to an /analyze endpoint, e.g.
+    https://api.benchify.com/analyze/batch.
+    """
+    return url.rstrip("/") + "/batch"
+
+def get_function_params(batch_params: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """
+    The /analyze request for the function called name in a batched request:
+    its test_func with the batch's shared context.
+    """
+    params = {key: value for key, value in batch_params.items() if key != "functions"}
+    for function in batch_params["functions"]:
+        if function["name"] == name:
+            params["test_func"] = function["test_func"]
+    return params
+
+def resolve_pip_imports(
+    file: str,
+    interactive: bool = True,
+    pip_imports: Optional[List[str]] = None) -> List[str]:
+    """
+    Computes the packages that must be pip-installed to run file (unless
+    pip_imports were already computed).  Imports that cannot be installed
+    under their own name are either asked about (interactive) or skipped.
+    """
+    if pip_imports is None:
+        pip_imports = []
+        try:
+            pip_imports = get_pip_imports_recursive(file)
+        #pylint:disable=broad-exception-caught
+        except Exception:
+            rprint("Error trying to resolve pip imports.")
+
+    # Make sure each import can be pip imported, asking PyPI about them all
+    # at once (its answers are cached) rather than one after the other
+    print("Computing pip imports.")
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(pip_imports)))) as executor:
+        list(executor.map(can_import_via_pip, pip_imports))
+    new_pip_imports = []
+    for pip_import in pip_imports:
+        package_name = pip_import
+        while not can_import_via_pip(package_name):
+            if not interactive:
+                print(f"Skipping {package_name}, which can't be installed " + \
+                    f"by running `pip install {package_name}`.")
+                package_name = None
+                break
+            print(f"It looks like we can't get {package_name} by just " + \
+                f"running `pip install {package_name}`. What package do we" + \
+                " need to install to get it?")
+            package_name = input("Package name: ")
+        if package_name is None:
+            continue
+        print(f"Adding {package_name} to pip_imports.")
+        new_pip_imports.append(package_name)
+    return new_pip_imports
+
+class BenchifyClient:
+    """
+    Analyzes functions without going through the CLI.  One client holds the
+    HTTP session, the auth tokens, the parsed-module, import and result
+    caches and the scheduler pacing its requests (at most rate per second,
+    if given), and may be shared between threads.  Given a latency_store,
+    it records how long each request takes and times requests out based on
+    how long similar ones took, rather than after timeout seconds.
+
+    Example:
+        client = BenchifyClient()
+        result = client.analyze_function("geom.py", "dist", patch=True)
+        print(result.status, result.text)
+    """
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        auth_tokens: Optional[AuthTokens] = None,
+        interactive: bool = False,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_workers: int = 4,
+        rate: Optional[float] = None,
+        latency_store: Optional[LatencyStore] = None):
+        self.url = url or get_default_url()
+        self.interactive = interactive
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.scheduler = SubmissionScheduler(rate=rate, max_concurrency=max_workers)
+        self.latency_store = latency_store
+        self.session = requests.Session()
+        self.index = FunctionIndex()
+        self.auth_tokens = auth_tokens
+        self.auth_lock = threading.Lock()
+        self.cache_lock = threading.Lock()
+        self.pip_imports: Dict[Tuple[str, ...], List[str]] = {}
+        self.manifests: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self.results: Dict[str, AnalysisResult] = {}
+
+    def get_auth_tokens(self) -> AuthTokens:
+        """
+        Logs in the first time it is called (from any thread), then reuses the
+        tokens.
+        """
+        with self.auth_lock:
+            if self.auth_tokens is None:
+                self.auth_tokens = login()
+            return self.auth_tokens
+
+    def refresh_auth_tokens(self, rejected: Optional[AuthTokens]) -> AuthTokens:
+        """
+        Logs in again after the server rejected the tokens rejected (e.g.
+        because they expired), unless another thread already did.
+        """
+        with self.auth_lock:
+            if self.auth_tokens is None or self.auth_tokens is rejected:
+                self.auth_tokens = login()
+            return self.auth_tokens
+
+    def select_function(self, file: str, name: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Finds the function to analyze in file: the one called name, or the
+        only one in the file if name is None.
+
+        Returns:
+            (name, source) of the selected function.
+
+        Raises:
+            OSError, SyntaxError: If the file cannot be read or parsed.
+            AnalysisError: If there is no such function, or several to choose
+                from and no name was given.
+        """
+        module = self.index.get(file)
+        if module is None:
+            raise OSError(f"No such file: {file}")
+        function_names = module.function_names
+        if name is None:
+            if len(function_names) > 1:
+                raise AmbiguousFunctionError(file, function_names)
+            if not function_names:
+                raise AnalysisError(f"There were no functions in {file}.")
+            name = function_names[0]
+        function_str = module.get_function_source(name)
+        if function_str is None:
+            raise AnalysisError(f"🔍 Function named {name} not found in {file}.")
+        return name, replace_block_comments(function_str)
+
+    def get_pip_imports(self, file: str, name: Optional[str] = None) -> List[str]:
+        """
+        The pip-installable packages needed to analyze the function called
+        name in file (or anything in file, if name is None).  Each distinct
+        set of imports is only checked against PyPI once.
+        """
+        try:
+            pip_imports = self.index.get_pip_imports(file, name)
+        #pylint:disable=broad-exception-caught
+        except Exception:
+            rprint("Error trying to resolve pip imports.")
+            pip_imports = []
+        key = tuple(pip_imports)
+        with self.cache_lock:
+            if key in self.pip_imports:
+                return self.pip_imports[key]
+        pip_imports = resolve_pip_imports(
+            file, interactive=self.interactive, pip_imports=pip_imports)
+        with self.cache_lock:
+            self.pip_imports[key] = pip_imports
+        return pip_imports
+
+    def invalidate_environment(self):
+        """
+        Forgets everything cached about the installed packages: the pip
+        imports, environment manifests, and the listings they came from.
+        """
+        invalidate_caches()
+        self.index.forget_imports()
+        with self.cache_lock:
+            self.pip_imports.clear()
+            self.manifests.clear()
+
+    def get_environment_manifest(self, pip_imports: List[str]) -> Dict[str, Any]:
+        """
+        The versions installed here of pip_imports (see
+        build_environment_manifest), computed once per distinct set.
+        """
+        key = tuple(sorted(pip_imports))
+        with self.cache_lock:
+            if key in self.manifests:
+                return self.manifests[key]
+        manifest = build_environment_manifest(pip_imports)
+        with self.cache_lock:
+            self.manifests[key] = manifest
+        return manifest
+
+    def build_params(
+        self,
+        file: str,
+        function_str: str,
+        patch: bool = False,
+        name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Builds the JSON body of an /analyze request for one function of file.
+        If the function's name is given, only the imports it can reach are
+        resolved.  The environment manifest pins the pip imports to the
+        locally installed versions, and its hash lets the server reuse
+        environments.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Normalizing the code only needs local files, so it runs while
+            # the imports are checked against PyPI
+            test_code = executor.submit(self.index.get_normalized_code, file)
+            pip_imports = self.get_pip_imports(file, name)
+            environment_manifest = self.get_environment_manifest(pip_imports)
+            return {
+                "test_func": function_str,
+                "patch_requested": patch,
+                "pip_imports": pip_imports,
+                "environment_manifest": environment_manifest,
+                "test_code": test_code.result(),
+                "file_name": Path(file).name,
+            }
+
+    def build_batch_params(
+        self,
+        file: str,
+        functions: List[Tuple[str, str]],
+        patch: bool = False) -> Dict[str, Any]:
+        """
+        Builds the JSON body of an /analyze/batch request for several
+        (name, source) functions of file.  The context they share (test
+        code, pip imports and environment) is sent once; pip_imports is the
+        union of what each function needs.
+        """
+        pip_imports: List[str] = []
+        for name, _ in functions:
+            for pip_import in self.get_pip_imports(file, name):
+                if pip_import not in pip_imports:
+                    pip_imports.append(pip_import)
+        return {
+            "functions": [
+                {"name": name, "test_func": function_str} for name, function_str in functions
+            ],
+            "patch_requested": patch,
+            "pip_imports": pip_imports,
+            "environment_manifest": self.get_environment_manifest(pip_imports),
+            "test_code": self.index.get_normalized_code(file),
+            "file_name": Path(file).name,
+        }
+
+    def prepare(
+        self,
+        file: str,
+        name: Optional[str] = None,
+        patch: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """
+        Selects the function (see select_function) and builds its request,
+        logging in meanwhile: login, import resolution and normalization
+        only meet once the request is sent, so they overlap rather than run
+        one after the other.  An interactive client without a valid saved
+        token logs in first instead, so that the device flow's instructions
+        come before any question about pip packages.
+
+        Returns:
+            (name, params) of the selected function.
+
+        Raises:
+            Like select_function; login errors are raised by the request
+            (or, for an interactive client, at once).
+        """
+        if self.auth_tokens is None and not self.interactive:
+            # Not waited for: a problem with the function is reported at once
+            threading.Thread(target=self.try_get_auth_tokens, daemon=True).start()
+        name, function_str = self.select_function(file, name)
+        if self.auth_tokens is None and self.interactive:
+            # Logging in may print instructions, which must not land in the
+            # middle of a question about pip packages
+            tokens = load_valid_tokens(report=False)
+            if tokens is None:
+                self.get_auth_tokens()
+            else:
+                with self.auth_lock:
+                    self.auth_tokens = self.auth_tokens or tokens
+        return name, self.build_params(file, function_str, patch, name)
+
+    def try_get_auth_tokens(self):
+        """
+        get_auth_tokens, ignoring errors (which the next call raises again).
+        """
+        try:
+            self.get_auth_tokens()
+        #pylint:disable=broad-exception-caught
+        except Exception:
+            pass
+
+    def estimate(self, params: Dict[str, Any]) -> LatencyEstimate:
+        """
+        How long an /analyze request should take, and when to give up on it.
+        """
+        if self.latency_store is None:
+            return LatencyEstimate(FALLBACK_EXPECTED, self.timeout, 0)
+        return self.latency_store.estimate(params)
+
+    def estimate_batch(self, params_list: List[Dict[str, Any]]) -> float:
+        """
+        How long sending every request of params_list should take, with
+        max_workers of them in flight at a time.
+        """
+        return estimate_batch(
+            [self.estimate(params).expected for params in params_list],
+            self.max_workers)
+
+    def estimate_function(
+        self,
+        file: str,
+        name: Optional[str] = None,
+        patch: bool = False) -> LatencyEstimate:
+        """
+        Like estimate, for the request analyze_function would send.
+        """
+        _, params = self.prepare(file, name, patch)
+        return self.estimate(params)
+
+    def post(
+        self,
+        params: Dict[str, Any],
+        timeout: Optional[float] = None,
+        url: Optional[str] = None,
+        stream: bool = False,
+        deadline: Optional[float] = None) -> Optional[requests.Response]:
+        """
+        Sends an /analyze request (or another request to url), returning None
+        if it timed out (after timeout seconds without an answer, by default
+        the client's).  Requests go through the client's scheduler, so they
+        are paced to the server's quota and retried when it answers 429.
+        With stream, the response is returned as soon as its headers are in.
+        Given a time.monotonic() deadline, no attempt waits past it (see
+        SubmissionScheduler.call, which raises BudgetExhaustedError).
+        """
+        headers = {'Authorization': f'Bearer {self.get_auth_tokens().id_token}'}
+        timeout = timeout or self.timeout
+
+        def send() -> requests.Response:
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            return self.session.post(
+                url or self.url, json=params, headers=headers,
+                timeout=(CONNECT_TIMEOUT, attempt_timeout), stream=stream)
+
+        try:
+            return self.scheduler.call(send, deadline)
+        except requests.exceptions.Timeout:
+            return None
+
+    def submit(
+        self,
+        file: str,
+        name: Optional[str],
+        params: Dict[str, Any],
+        timeout: Optional[float] = None) -> AnalysisResult:
+        """
+        Sends an already built request, answering from the result cache when
+        the exact same request was already analyzed by this client.  Given a
+        timeout, the request is given up after at most that long (e.g. to
+        stay within a time budget).
+        """
+        key = fingerprint_params(params)
+        patch_requested = bool(params.get("patch_requested"))
+        with self.cache_lock:
+            cached = self.results.get(key)
+        if cached is not None:
+            return AnalysisResult(
+                file, name, cached.status, text=cached.text,
+                status_code=cached.status_code, cache_hit=True,
+                patch_requested=patch_requested)
+
+        estimated_timeout = self.estimate(params).timeout
+        # A timeout cut short by the caller says nothing about the latency
+        cut_short = timeout is not None and timeout < estimated_timeout
+        start = time.monotonic()
+        # Retries, too, must end within the caller's timeout
+        deadline = start + timeout if timeout is not None else None
+        timeout = timeout if cut_short else estimated_timeout
+        try:
+            response = self.post(params, timeout, deadline=deadline)
+        except BudgetExhaustedError as e:
+            return AnalysisResult(
+                file, name, "timeout", error=str(e),
+                duration=time.monotonic() - start, patch_requested=patch_requested)
+        except requests.exceptions.RequestException as e:
+            return AnalysisResult(
+                file, name, "error", error=str(e),
+                duration=time.monotonic() - start, patch_requested=patch_requested)
+        duration = time.monotonic() - start
+        recordable = response.ok if response is not None else not cut_short
+        if self.latency_store is not None and recordable:
+            self.latency_store.record(
+                params, duration, "ok" if response is not None else "timeout")
+        if response is None:
+            return AnalysisResult(
+                file, name, "timeout", error="Timed out", duration=duration,
+                patch_requested=patch_requested)
+        if response.status_code >= 400:
+            return AnalysisResult(
+                file, name, "error", text=response.text,
+                error=f"Server responded with {response.status_code}",
+                status_code=response.status_code, duration=duration,
+                patch_requested=patch_requested)
+        result = AnalysisResult(
+            file, name, "ok", text=response.text,
+            status_code=response.status_code, duration=duration,
+            patch_requested=patch_requested)
+        with self.cache_lock:
+            self.results[key] = result
+        return result
+
+    def analyze_function(
+        self,
+        file: str,
+        name: Optional[str] = None,
+        patch: bool = False,
+        on_estimate: Optional[Callable[[LatencyEstimate], None]] = None) -> AnalysisResult:
+        """
+        Analyzes the function called name in file (or its only function),
+        passing how long it should take to on_estimate (if given) before
+        sending the request.  Problems finding or reading the function are
+        reported in the result's error rather than raised.
+        """
+        start = time.monotonic()
+        try:
+            name, params = self.prepare(file, name, patch)
+        except (OSError, SyntaxError, AnalysisError) as e:
+            return AnalysisResult(
+                file, name, "error", error=str(e), patch_requested=patch)
+        prepare_duration = time.monotonic() - start
+        if on_estimate is not None:
+            on_estimate(self.estimate(params))
+        result = self.submit(file, name, params)
+        result.prepare_duration = prepare_duration
+        return result
+
+    def submit_batch(
+        self,
+        file: str,
+        batch_params: Dict[str, Any]) -> Iterator[AnalysisResult]:
+        """
+        Sends an already built /analyze/batch request, yielding each
+        function's result as the server streams it back (one JSON object per
+        line: {"name", "status", "text"}).  Servers without the batched
+        endpoint get one /analyze request per function instead.
+        """
+        pending = {
+            function["name"]: get_function_params(batch_params, function["name"])
+            for function in batch_params["functions"]
+        }
+        patch_requested = bool(batch_params.get("patch_requested"))
+        # The timeout bounds the wait for each result, not for the whole batch
+        timeout = max(self.estimate(params).timeout for params in pending.values())
+        start = time.monotonic()
+        try:
+            response = self.post(batch_params, timeout, url=get_batch_url(self.url), stream=True)
+        except requests.exceptions.RequestException as e:
+            response, error = None, str(e)
+        else:
+            error = None if response is not None else "Timed out"
+        if response is not None and response.status_code in [404, 405]:
+            response.close()
+            for name, params in pending.items():
+                yield self.submit(file, name, params)
+            return
+        if response is not None and response.status_code >= 400:
+            error = f"Server responded with {response.status_code}"
+            for name in pending:
+                yield AnalysisResult(
+                    file, name, "error", text=response.text, error=error,
+                    status_code=response.status_code, duration=time.monotonic() - start,
+                    patch_requested=patch_requested)
+            return
+        if response is not None:
+            # Each function's latency is how long its result took to follow
+            # the previous one's, as if it had been sent alone.  A caller
+            # slower than the server lengthens it, erring towards longer
+            # timeouts rather than shorter ones.
+            previous = start
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    params = pending.pop(record.get("name"), None)
+                    if params is None:
+                        continue
+                    now = time.monotonic()
+                    latency, previous = now - previous, now
+                    yield self.make_batch_result(file, record, params, now - start, latency)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                error = f"Batch response interrupted: {e}"
+            finally:
+                response.close()
+        for name in pending:
+            yield AnalysisResult(
+                file, name, "timeout" if error == "Timed out" else "error",
+                error=error or "Missing from the batch response",
+                duration=time.monotonic() - start, patch_requested=patch_requested)
+
+    def make_batch_result(
+        self,
+        file: str,
+        record: Dict[str, Any],
+        params: Dict[str, Any],
+        duration: float,
+        latency: float) -> AnalysisResult:
+        """
+        The result of one function of a batch, from its record in the batch
+        response, cached and recorded as if it had been sent alone.
+
+        Args:
+            duration (float): How long since the batch was sent.
+            latency (float): How long the function itself took, recorded in
+                the latency store.
+        """
+        name = record["name"]
+        status_code = record.get("status", 200)
+        patch_requested = bool(params.get("patch_requested"))
+        text = record.get("text", "")
+        if status_code >= 400:
+            return AnalysisResult(
+                file, name, "error", text=text,
+                error=f"Server responded with {status_code}",
+                status_code=status_code, duration=duration,
+                patch_requested=patch_requested)
+        if self.latency_store is not None:
+            self.latency_store.record(params, latency, "ok")
+        result = AnalysisResult(
+            file, name, "ok", text=text, status_code=status_code,
+            duration=duration, patch_requested=patch_requested)
+        with self.cache_lock:
+            self.results[fingerprint_params(params)] = result
+        return result
+
+    def iter_analyze_file(
+        self,
+        file: str,
+        names: Optional[List[str]] = None,
+        patch: bool = False) -> Iterator[AnalysisResult]:
+        """
+        Analyzes the functions called names in file (by default, all of its
+        top-level functions) with a single batched request, yielding each
+        result as soon as it is ready.  Functions already analyzed in the
+        same state are answered from the result cache and left out of the
+        batch.
+        """
+        start = time.monotonic()
+        if names is None:
+            try:
+                module = self.index.get(file)
+            except SyntaxError as e:
+                yield AnalysisResult(file, None, "error", error=str(e), patch_requested=patch)
+                return
+            if module is None:
+                yield AnalysisResult(
+                    file, None, "error", error=f"No such file: {file}", patch_requested=patch)
+                return
+            names = module.function_names
+        functions = []
+        for name in names:
+            try:
+                functions.append(self.select_function(file, name))
+            except (OSError, SyntaxError, AnalysisError) as e:
+                yield AnalysisResult(file, name, "error", error=str(e), patch_requested=patch)
+        if not functions:
+            return
+        batch_params = self.build_batch_params(file, functions, patch)
+        prepare_duration = time.monotonic() - start
+
+        uncached = []
+        for function in batch_params["functions"]:
+            with self.cache_lock:
+                cached = self.results.get(
+                    fingerprint_params(get_function_params(batch_params, function["name"])))
+            if cached is None:
+                uncached.append(function)
+                continue
+            yield AnalysisResult(
+                file, function["name"], cached.status, text=cached.text,
+                status_code=cached.status_code, cache_hit=True,
+                patch_requested=patch)
+        if not uncached:
+            return
+        batch_params["functions"] = uncached
+        for result in self.submit_batch(file, batch_params):
+            result.prepare_duration = prepare_duration
+            yield result
+
+    def iter_analyze_many(
+        self,
+        targets: Iterable[Tuple[str, Optional[str]]],
+        patch: bool = False,
+        max_workers: Optional[int] = None) -> Iterator[AnalysisResult]:
+        """
+        Analyzes each (file, name) target concurrently, yielding each result
+        as soon as it is ready.
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            futures = [
+                executor.submit(self.analyze_function, file, name, patch)
+                for file, name in targets
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def analyze_many(
+        self,
+        targets: Iterable[Tuple[str, Optional[str]]],
+        patch: bool = False,
+        max_workers: Optional[int] = None) -> List[AnalysisResult]:
+        """
+        Analyzes each (file, name) target concurrently and returns the
+        results in the order of targets.
+        """
+        targets = list(targets)
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers) as executor:
+            return list(executor.map(
+                lambda target: self.analyze_function(target[0], target[1], patch),
+                targets))
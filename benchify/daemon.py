@@ -0,0 +1,175 @@
+"""
+resident process which keeps a warm BenchifyClient for the CLI to talk to
+"""
+import json
+import os
+import socketserver
+import sys
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from .client import \
+    AmbiguousFunctionError, \
+    AnalysisError, \
+    BenchifyClient
+# The CLI's side, kept importable from here for existing callers
+#pylint:disable=unused-import
+from .daemon_client import DaemonClient, get_daemon_socket_path
+from .environment import get_environment_signature
+from .function_index import FunctionIndex
+from .latency import LatencyStore
+
+# How many parsed modules the daemon keeps in memory
+DEFAULT_MAX_MODULES = 512
+
+def handle_request(
+    client: BenchifyClient,
+    request: Dict[str, Any],
+    send_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Answers one request from the CLI.  Errors selecting the function are
+    sent back (with their type) so that the CLI can re-raise them.  An
+    analysis asked for with "estimate" first sends its latency estimate to
+    send_progress, so that the CLI needs no separate round trip for it.
+    Anything else going wrong is sent back as an "internal" error, rather
+    than closing the connection without an answer.
+    """
+    try:
+        return answer_request(client, request, send_progress)
+    except KeyError as e:
+        return {"ok": False, "error_type": "request", "error": f"Missing {e} in the request"}
+    #pylint:disable=broad-exception-caught
+    except Exception as e:
+        return {"ok": False, "error_type": "internal", "error": f"{type(e).__name__}: {e}"}
+
+def answer_request(
+    client: BenchifyClient,
+    request: Dict[str, Any],
+    send_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Answers one request, for handle_request.
+    """
+    command = request.get("command")
+    if command in ["ping", "stop"]:
+        return {"ok": True, "pid": os.getpid(), "prefix": sys.prefix}
+    if command not in ["select", "estimate", "analyze"]:
+        return {"ok": False, "error_type": "request", "error": f"Unknown command {command}"}
+
+    file = request["file"]
+    try:
+        name, function_str = client.select_function(file, request.get("function"))
+    except AmbiguousFunctionError as ambiguous:
+        return {"ok": False, "error_type": "ambiguous", "error": str(ambiguous),
+                "function_names": ambiguous.function_names}
+    except AnalysisError as e:
+        return {"ok": False, "error_type": "analysis", "error": str(e)}
+    except OSError as e:
+        return {"ok": False, "error_type": "os", "error": str(e)}
+    except SyntaxError as e:
+        return {"ok": False, "error_type": "syntax", "error": str(e)}
+    if command == "select":
+        return {"ok": True, "function": name, "source": function_str}
+
+    params = client.build_params(
+        file, function_str, bool(request.get("patch")), name)
+    if command == "estimate":
+        estimate = client.estimate(params)
+        return {"ok": True, "expected": estimate.expected,
+                "timeout": estimate.timeout, "samples": estimate.samples}
+    if request.get("estimate") and send_progress is not None:
+        estimate = client.estimate(params)
+        send_progress({"expected": estimate.expected,
+                       "timeout": estimate.timeout, "samples": estimate.samples})
+    result = client.submit(file, name, params)
+    return {"ok": True, "result": result.to_json()}
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one JSON request per line and writes one JSON answer per line
+    (preceded by {"progress": ...} lines for requests which report some).
+    """
+    server: "DaemonServer"
+
+    def handle(self):
+        for line in self.rfile:
+            request = {}
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    request = {}
+                    raise ValueError("A request must be a JSON object")
+                self.server.refresh_environment()
+                answer = handle_request(
+                    self.server.client, request,
+                    lambda progress: self.send({"progress": progress}))
+            except ValueError as e:
+                answer = {"ok": False, "error_type": "request", "error": str(e)}
+            self.send(answer)
+            if request.get("command") == "stop":
+                # shutdown waits for serve_forever, so it can't run on its thread
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+    def send(self, answer: Dict[str, Any]):
+        """
+        Writes one line to the CLI.
+        """
+        self.wfile.write(json.dumps(answer).encode("utf-8") + b"\n")
+        self.wfile.flush()
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves each CLI connection on its own thread, sharing one client (and so
+    its auth session, parsed modules and caches) between all of them.  What
+    the client cached about the installed packages is dropped whenever
+    they change.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, client: BenchifyClient):
+        self.client = client
+        self.environment_signature = get_environment_signature()
+        self.environment_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        if os.path.exists(socket_path):
+            if DaemonClient(socket_path).ping():
+                raise OSError(f"A daemon is already listening on {socket_path}")
+            os.unlink(socket_path)
+        # The daemon acts with the user's credentials, so only they may use it
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, DaemonHandler)
+        finally:
+            os.umask(old_umask)
+
+    def refresh_environment(self):
+        """
+        Invalidates the client's environment caches if packages were
+        installed or removed since the previous request.
+        """
+        signature = get_environment_signature()
+        with self.environment_lock:
+            if signature == self.environment_signature:
+                return
+            self.environment_signature = signature
+            self.client.invalidate_environment()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+def make_daemon_server(
+    socket_path: Optional[str] = None,
+    client: Optional[BenchifyClient] = None,
+    max_modules: int = DEFAULT_MAX_MODULES) -> DaemonServer:
+    """
+    Creates (but does not start) the daemon server.  The client's parsed
+    modules are kept in an index bounded to max_modules.
+    """
+    if client is None:
+        client = BenchifyClient(latency_store=LatencyStore())
+        client.index = FunctionIndex(max_modules=max_modules)
+    return DaemonServer(socket_path or get_daemon_socket_path(), client)
@@ -0,0 +1,177 @@
+"""
+talks to a running `benchify daemon`, without loading what the daemon does
+"""
+import json
+import os
+import socket
+import sys
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import appdirs
+
+from .latency import FALLBACK_TIMEOUT, LatencyEstimate
+from .results import AmbiguousFunctionError, AnalysisError, AnalysisResult
+
+# How long the CLI waits for the daemon to answer anything but an analysis
+CONNECT_TIMEOUT = 0.5
+
+def get_daemon_socket_path() -> str:
+    """
+    The Unix socket the daemon listens on ($BENCHIFY_SOCKET if it is set).
+    """
+    socket_path = os.environ.get("BENCHIFY_SOCKET")
+    if socket_path:
+        return socket_path
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    return os.path.join(app_dirs.user_cache_dir, "daemon.sock")
+
+class DaemonClient:
+    """
+    Talks to a running daemon.  Offers the parts of BenchifyClient that the
+    CLI uses, so either can be used to analyze a single function.
+    """
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = FALLBACK_TIMEOUT):
+        self.socket_path = socket_path or get_daemon_socket_path()
+        self.timeout = timeout
+
+    @classmethod
+    def connect(cls, socket_path: Optional[str] = None) -> Optional["DaemonClient"]:
+        """
+        Returns a client for the running daemon, or None if there is none,
+        or if it runs in another python environment (whose packages it
+        would describe instead of this one's).
+        """
+        if not hasattr(socket, "AF_UNIX"):
+            return None
+        daemon_client = cls(socket_path)
+        try:
+            answer = daemon_client.request({"command": "ping"}, CONNECT_TIMEOUT)
+        except (OSError, ValueError):
+            return None
+        if not answer.get("ok") or answer.get("prefix") != sys.prefix:
+            return None
+        return daemon_client
+
+    def request(
+        self,
+        request: Dict[str, Any],
+        timeout: Optional[float],
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Sends one request and waits for its answer, passing whatever
+        progress the daemon reports meanwhile to on_progress.  Raises
+        OSError if the daemon cannot be reached.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(self.socket_path)
+            connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with connection.makefile("rb") as fr:
+                while True:
+                    line = fr.readline()
+                    if not line:
+                        raise OSError("The daemon closed the connection")
+                    answer = json.loads(line)
+                    if "progress" not in answer:
+                        return answer
+                    if on_progress is not None:
+                        on_progress(answer["progress"])
+
+    def stop(self) -> bool:
+        """
+        Asks the daemon to exit.  Returns whether one was running.
+        """
+        try:
+            return self.request({"command": "stop"}, CONNECT_TIMEOUT).get("ok", False)
+        except (OSError, ValueError):
+            return False
+
+    def ping(self) -> bool:
+        """
+        Whether a daemon is listening.
+        """
+        try:
+            return self.request({"command": "ping"}, CONNECT_TIMEOUT).get("ok", False)
+        except (OSError, ValueError):
+            return False
+
+    #pylint:disable=no-self-use
+    def get_auth_tokens(self):
+        """
+        The daemon logged in when it started, so there is nothing to do.
+        """
+
+    def select_function(self, file: str, name: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Like BenchifyClient.select_function, but using the daemon's index.
+        """
+        answer = self.request(
+            {"command": "select", "file": os.path.abspath(file), "function": name},
+            self.timeout)
+        raise_error(file, answer)
+        return answer["function"], answer["source"]
+
+    def estimate_function(
+        self,
+        file: str,
+        name: Optional[str] = None,
+        patch: bool = False) -> LatencyEstimate:
+        """
+        Like BenchifyClient.estimate_function, but using the daemon's history.
+        """
+        answer = self.request(
+            {"command": "estimate", "file": os.path.abspath(file),
+             "function": name, "patch": patch},
+            self.timeout)
+        raise_error(file, answer)
+        return LatencyEstimate(answer["expected"], answer["timeout"], answer["samples"])
+
+    def analyze_function(
+        self,
+        file: str,
+        name: Optional[str] = None,
+        patch: bool = False,
+        on_estimate: Optional[Callable[[LatencyEstimate], None]] = None) -> AnalysisResult:
+        """
+        Like BenchifyClient.analyze_function, but run by the daemon, which
+        sends the estimate for on_estimate ahead of the result.
+        """
+        request = {
+            "command": "analyze",
+            "file": os.path.abspath(file),
+            "function": name,
+            "patch": patch,
+            "estimate": on_estimate is not None,
+        }
+
+        def on_progress(progress: Dict[str, Any]):
+            if on_estimate is not None:
+                on_estimate(LatencyEstimate(
+                    progress["expected"], progress["timeout"], progress["samples"]))
+
+        try:
+            # The daemon times the request out itself (based on its latency
+            # history), and if it dies the connection closes
+            answer = self.request(request, None, on_progress)
+        except (OSError, ValueError) as e:
+            return AnalysisResult(file, name, "error", error=str(e))
+        if not answer.get("ok"):
+            return AnalysisResult(file, name, "error", error=answer.get("error"))
+        result = AnalysisResult.from_json(answer["result"])
+        result.file = file
+        return result
+
+def raise_error(file: str, answer: Dict[str, Any]):
+    """
+    Re-raises an error the daemon reported selecting a function in file.
+    """
+    if answer.get("ok"):
+        return
+    error_type, error = answer.get("error_type"), answer.get("error", "")
+    if error_type == "ambiguous":
+        raise AmbiguousFunctionError(file, answer["function_names"])
+    if error_type == "os":
+        raise OSError(error)
+    if error_type == "syntax":
+        raise SyntaxError(error)
+    raise AnalysisError(error)
@@ -0,0 +1,218 @@
+"""
+describes the local python environment, so the server can reuse one it built
+"""
+import functools
+import hashlib
+import json
+import os
+import platform
+import re
+import sys
+import zipfile
+from importlib import machinery, metadata
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+MANIFEST_FORMAT_VERSION = 1
+
+@functools.lru_cache(maxsize=None)
+def get_import_distributions() -> Mapping[str, List[str]]:
+    """
+    Maps top-level import names to the installed distributions providing
+    them, e.g. "yaml" to ["PyYAML"].
+    """
+    packages_distributions = getattr(metadata, "packages_distributions", None)
+    if packages_distributions is not None:
+        return packages_distributions()
+    # Python 3.9 lacks packages_distributions
+    import_distributions: Dict[str, List[str]] = {}
+    for distribution in metadata.distributions():
+        name = distribution.metadata["Name"]
+        top_level = (distribution.read_text("top_level.txt") or "").split()
+        if not top_level:
+            top_level = [
+                file.parts[0].split(".")[0] for file in distribution.files or []
+                if (file.suffix == ".py" or len(file.parts) > 1) and \
+                    not file.parts[0].endswith((".dist-info", ".egg-info", ".data"))
+            ]
+        for import_name in set(top_level):
+            import_distributions.setdefault(import_name, []).append(name)
+    return import_distributions
+
+def canonicalize_name(name: str) -> str:
+    """
+    Normalizes a distribution name as PyPI does (PEP 503).
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+@functools.lru_cache(maxsize=None)
+def get_distribution_names() -> FrozenSet[str]:
+    """
+    The canonicalized names of the installed distributions.
+    """
+    return frozenset(
+        canonicalize_name(distribution.metadata["Name"] or "")
+        for distribution in metadata.distributions())
+
+def get_module_name(filename: str, is_directory: bool) -> Optional[str]:
+    """
+    The name of the module a file or directory in a package or sys.path
+    entry would be imported as, e.g. "numpy" for the directory "numpy", or
+    for the files "numpy.py" or "numpy.cpython-311-x86_64-linux-gnu.so", or
+    None if it is not importable.
+    """
+    name = filename
+    if not is_directory:
+        suffix = next(
+            (suffix for suffix in machinery.all_suffixes() if filename.endswith(suffix)), None)
+        if suffix is None:
+            return None
+        name = filename[:-len(suffix)]
+    return name if name.isidentifier() else None
+
+@functools.lru_cache(maxsize=None)
+def list_modules(directory: str) -> FrozenSet[str]:
+    """
+    The names of the modules and packages (including namespace packages)
+    that can be imported from directory, or from a zip archive on sys.path,
+    found by listing it rather than by importing anything.  Cached for the
+    rest of the run.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            listing = [(entry.name, entry.is_dir()) for entry in entries]
+    except NotADirectoryError:
+        if not zipfile.is_zipfile(directory):
+            return frozenset()
+        with zipfile.ZipFile(directory) as archive:
+            listing = [(name.split("/")[0], "/" in name) for name in archive.namelist()]
+    except OSError:
+        return frozenset()
+    names = (get_module_name(filename, is_directory) for filename, is_directory in listing)
+    return frozenset(name for name in names if name is not None)
+
+def find_module_directory(module_name: str) -> Optional[str]:
+    """
+    The sys.path entry from which module_name (e.g. "numpy.linalg") would be
+    imported, judging from the files there, or None if there is none.
+    Unlike importlib.util.find_spec, this runs none of the module's
+    (or its parent packages') code.
+
+    Raises:
+        ValueError: If module_name is empty.
+    """
+    if not module_name:
+        raise ValueError("Empty module name")
+    parts = module_name.split(".")
+    for entry in sys.path:
+        directory = os.path.abspath(entry or os.curdir)
+        package = directory
+        for part in parts[:-1]:
+            if part not in list_modules(package):
+                break
+            package = os.path.join(package, part)
+        else:
+            if parts[-1] in list_modules(package):
+                return directory
+    return None
+
+def is_installed_module(module_name: str) -> bool:
+    """
+    Whether module_name can be imported here, or is provided by an installed
+    distribution, or is itself the name of one (e.g. "PyJWT"), found from
+    sys.path listings and distribution metadata without importing anything.
+    Submodules a package only creates when imported (e.g. six.moves) count
+    as installed if the package's distribution is.
+
+    Raises:
+        ValueError: If module_name is empty.
+    """
+    if find_module_directory(module_name) is not None:
+        return True
+    if canonicalize_name(module_name) in get_distribution_names():
+        return True
+    return module_name.split(".")[0] in get_import_distributions()
+
+def invalidate_caches():
+    """
+    Forgets the cached sys.path listings and distribution metadata (e.g.
+    after packages were installed).
+    """
+    list_modules.cache_clear()
+    get_distribution_names.cache_clear()
+    get_import_distributions.cache_clear()
+
+def get_environment_signature() -> Tuple[Tuple[str, Optional[int]], ...]:
+    """
+    Each sys.path entry with its modification time, which changes when
+    packages are installed into or removed from it: a long-running process
+    should invalidate_caches when the signature changes.
+    """
+    signature = []
+    for entry in sys.path:
+        try:
+            mtime: Optional[int] = os.stat(entry or os.curdir).st_mtime_ns
+        except OSError:
+            mtime = None
+        signature.append((entry, mtime))
+    return tuple(signature)
+
+def get_distribution_version(name: str) -> Optional[str]:
+    """
+    The installed version of the distribution called name, if any.
+    """
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+def hash_manifest(manifest: Dict[str, Any]) -> str:
+    """
+    A stable hash of a manifest's contents (ignoring any hash it holds).
+    """
+    contents = {key: value for key, value in manifest.items() if key != "hash"}
+    return hashlib.sha256(
+        json.dumps(contents, sort_keys=True).encode("utf-8")).hexdigest()
+
+def build_environment_manifest(
+    pip_imports: List[str],
+    import_distributions: Optional[Mapping[str, List[str]]] = None) -> Dict[str, Any]:
+    """
+    Pins each of pip_imports to the distribution version installed here.
+    Each pip import is looked up as a distribution name first, then as an
+    import name.  Those which are not installed are listed as unresolved, so
+    that they still count towards the hash.
+
+    Returns:
+        {"version", "python", "implementation", "distributions": [{"name",
+        "version"}, ...], "unresolved": [...], "hash"}, with distributions
+        and unresolved sorted so that the hash only depends on the set.
+    """
+    distributions: Dict[str, str] = {}
+    unresolved = set()
+    for pip_import in pip_imports:
+        version = get_distribution_version(pip_import)
+        if version is not None:
+            distributions[canonicalize_name(pip_import)] = version
+            continue
+        if import_distributions is None:
+            import_distributions = get_import_distributions()
+        names = import_distributions.get(pip_import, [])
+        for name in names:
+            version = get_distribution_version(name)
+            if version is not None:
+                distributions[canonicalize_name(name)] = version
+        if not names:
+            unresolved.add(pip_import)
+
+    manifest = {
+        "version": MANIFEST_FORMAT_VERSION,
+        "python": platform.python_version(),
+        "implementation": sys.implementation.name,
+        "distributions": [
+            {"name": name, "version": version}
+            for name, version in sorted(distributions.items())
+        ],
+        "unresolved": sorted(unresolved),
+    }
+    manifest["hash"] = hash_manifest(manifest)
+    return manifest
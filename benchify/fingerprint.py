@@ -0,0 +1,77 @@
+"""
+fingerprints of functions which ignore formatting, comments and docstrings
+"""
+import ast
+import functools
+import hashlib
+import json
+import textwrap
+from typing import Any, Dict, Optional
+
+from .source_manipulation import \
+    get_reachable_statements, \
+    get_referenced_names, \
+    strip_docstrings
+
+# Request fields which do not change what is analyzed
+IGNORED_FIELDS = ["test_func", "test_code", "file_name", "functions"]
+
+@functools.lru_cache(maxsize=16)
+def parse_without_docstrings(code: str) -> Optional[ast.Module]:
+    """
+    Parses code (dedented, e.g. a method's source) and strips its docstrings,
+    or returns None if it does not parse.  The tree is cached, so it must
+    not be modified.
+    """
+    try:
+        return strip_docstrings(ast.parse(textwrap.dedent(code)))
+    except SyntaxError:
+        return None
+
+def dump_nodes(nodes) -> str:
+    """
+    A canonical dump of a list of nodes, without positions, so that only
+    the code's structure counts.
+    """
+    return json.dumps([ast.dump(node, include_attributes=False) for node in nodes])
+
+def fingerprint_code(code: str) -> str:
+    """
+    A hash of code which does not change when only its formatting, comments
+    or docstrings do.  Code which does not parse is hashed as it is.
+    """
+    tree = parse_without_docstrings(code)
+    text = dump_nodes(tree.body) if tree is not None else code
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def fingerprint_slice(test_code: str, test_func: str) -> str:
+    """
+    Fingerprints the part of test_code which test_func depends on: the
+    top-level statements defining the names it uses (transitively), the
+    rest of the module being irrelevant to its analysis.
+    """
+    code_tree = parse_without_docstrings(test_code)
+    func_tree = parse_without_docstrings(test_func)
+    if code_tree is None or func_tree is None:
+        return fingerprint_code(test_code)
+    used_names = set()
+    for node in func_tree.body:
+        used_names |= get_referenced_names(node)
+    text = dump_nodes(get_reachable_statements(code_tree, used_names))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def fingerprint_params(params: Dict[str, Any]) -> str:
+    """
+    The cache and dedupe key of an /analyze request: the fingerprints of its
+    function and of the slice of its code the function depends on, plus the
+    request's other settings (pip imports, environment, patch...).  Requests
+    differing only in formatting, comments, docstrings, code the function
+    does not use, or the file they come from share a fingerprint.
+    """
+    test_func = params.get("test_func", "")
+    key = {
+        field: value for field, value in params.items() if field not in IGNORED_FIELDS
+    }
+    key["test_func"] = fingerprint_code(test_func)
+    key["test_code"] = fingerprint_slice(params.get("test_code", ""), test_func)
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
@@ -0,0 +1,245 @@
+"""
+keeps parsed modules and per-function hashes warm between analyses
+"""
+import ast
+import hashlib
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from .source_manipulation import \
+    find_local_module, \
+    get_function_source, \
+    get_function_spans, \
+    get_pip_imports_for_function, \
+    get_pip_imports_recursive, \
+    get_top_level_function_names, \
+    normalize_imported_modules_in_code
+from .source_file import SourceFile
+
+def hash_source(source: str) -> str:
+    """
+    Hashes a chunk of source code, e.g. the source of a single function.
+    """
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+class IndexedModule:
+    """
+    A parsed python file together with the hash and line span of each of its
+    top-level functions.  The source itself is not kept: functions are read
+    back from the file by line span when needed, so a large module costs
+    its tree and one array of line offsets rather than copies of its text.
+    """
+    path: str = ""
+    mtime: float = 0.0
+    tree: Optional[ast.Module] = None
+    function_names: List[str] = []
+    function_hashes: Dict[str, str] = {}
+    function_spans: Dict[str, Tuple[int, int]] = {}
+    line_offsets: "array[int]" = array("Q")
+    local_imports: Set[str] = set()
+
+    def __init__(self, path: str, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        with SourceFile(path) as source_file:
+            self.tree = ast.parse(source_file.text())
+            self.line_offsets = source_file.line_offsets
+            self.function_names = get_top_level_function_names(self.tree)
+            self.function_spans = get_function_spans(self.tree)
+            self.function_hashes = {}
+            for name in self.function_names:
+                function_source = get_function_source(self.tree, name, source_file)
+                if function_source is not None:
+                    self.function_hashes[name] = hash_source(function_source)
+        self.local_imports = set()
+        for node in ast.walk(self.tree):
+            module_names = []
+            if isinstance(node, ast.Import):
+                module_names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                module_names = [node.module]
+            for module_name in module_names:
+                local_path = find_local_module(module_name, path)
+                if local_path is not None:
+                    self.local_imports.add(os.path.normpath(local_path))
+
+    def get_function_source(self, function_name: str) -> Optional[str]:
+        """
+        Reads back the source of the function called function_name (as
+        get_function_source does), decoding only its lines.
+        """
+        with SourceFile(self.path, self.line_offsets, self.mtime) as source_file:
+            return get_function_source(self.tree, function_name, source_file)
+
+class FunctionIndex:
+    """
+    Caches parsed modules, their local import graph, their pip imports and
+    their normalized code, so that when a file changes only that file is
+    re-parsed and only the functions whose source actually changed are
+    reported.  Safe to share between threads.
+
+    Args:
+        max_modules (int): If set, at most this many parsed modules are kept,
+            the least recently used ones being dropped (with their cached
+            results) first.
+    """
+    def __init__(self, max_modules: Optional[int] = None):
+        self.max_modules = max_modules
+        self.modules: "OrderedDict[str, IndexedModule]" = OrderedDict()
+        # Keyed by path, then by function (None for the whole file)
+        self.pip_imports: Dict[str, Dict[Optional[str], List[str]]] = {}
+        self.import_classifications: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self.normalized_code: Dict[str, str] = {}
+        self.lock = threading.RLock()
+
+    def get(self, path: str) -> Optional[IndexedModule]:
+        """
+        Returns the indexed module at path, (re-)parsing it if it is new or
+        has been modified since it was last indexed.
+        """
+        path = os.path.normpath(path)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            self.forget(path)
+            return None
+        with self.lock:
+            module = self.modules.get(path)
+            if module is not None:
+                self.modules.move_to_end(path)
+        if module is None or module.mtime != mtime:
+            module = IndexedModule(path, mtime)
+            with self.lock:
+                self.modules[path] = module
+                self.modules.move_to_end(path)
+                self.evict()
+        return module
+
+    def forget_imports(self):
+        """
+        Drops the cached pip imports and import classifications, which
+        depend on what is installed (e.g. after packages were installed).
+        """
+        with self.lock:
+            self.pip_imports.clear()
+            self.import_classifications.clear()
+
+    def evict(self):
+        """
+        Drops the least recently used modules beyond max_modules.  Their
+        importers' cached results stay valid: re-reading an evicted module
+        later invalidates them as if it had changed.  Call with lock held.
+        """
+        while self.max_modules is not None and len(self.modules) > self.max_modules:
+            evicted, _ = self.modules.popitem(last=False)
+            self.pip_imports.pop(evicted, None)
+            self.normalized_code.pop(evicted, None)
+
+    def update(self, path: str) -> List[str]:
+        """
+        Re-indexes path and returns the names of the functions which are new
+        or whose source changed since the previous time it was indexed.
+        Raises SyntaxError if the file does not currently parse.
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            old_module = self.modules.get(path)
+        old_hashes = old_module.function_hashes if old_module else {}
+        module = self.get(path)
+        if module is None:
+            return []
+        if module is not old_module:
+            self.invalidate(path)
+        return [
+            name for name, function_hash in module.function_hashes.items()
+            if old_hashes.get(name) != function_hash
+        ]
+
+    def forget(self, path: str):
+        """
+        Drops path (e.g. because it was deleted) from the index.
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            self.modules.pop(path, None)
+        self.invalidate(path)
+
+    def invalidate(self, path: str):
+        """
+        Drops the cached pip imports and normalized code of path and of every
+        indexed module that (transitively) imports it locally.
+        """
+        with self.lock:
+            stale = {path}
+            changed = True
+            while changed:
+                changed = False
+                for module in self.modules.values():
+                    if module.path not in stale and module.local_imports & stale:
+                        stale.add(module.path)
+                        changed = True
+            for stale_path in stale:
+                self.pip_imports.pop(stale_path, None)
+                self.normalized_code.pop(stale_path, None)
+
+    def refresh(self, path: str):
+        """
+        Re-indexes path and its local dependencies (transitively) wherever
+        they changed on disk, dropping the cached results they invalidate.
+        """
+        seen = set()
+        worklist = [os.path.normpath(path)]
+        while worklist:
+            current = worklist.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            with self.lock:
+                old_module = self.modules.get(current)
+            try:
+                module = self.get(current)
+            except SyntaxError:
+                continue
+            if module is None:
+                continue
+            if module is not old_module:
+                self.invalidate(current)
+            worklist.extend(module.local_imports)
+
+    def get_pip_imports(self, path: str, function_name: Optional[str] = None) -> List[str]:
+        """
+        Returns get_pip_imports_for_function(path, function_name) (or
+        get_pip_imports_recursive(path) if function_name is None), computing
+        it at most once until path or one of its local dependencies changes.
+        """
+        path = os.path.normpath(path)
+        self.refresh(path)
+        with self.lock:
+            if function_name in self.pip_imports.get(path, {}):
+                return self.pip_imports[path][function_name]
+        if function_name is None:
+            pip_imports = get_pip_imports_recursive(path)
+        else:
+            pip_imports = get_pip_imports_for_function(
+                path, function_name, self.import_classifications)
+        with self.lock:
+            self.pip_imports.setdefault(path, {})[function_name] = pip_imports
+        return pip_imports
+
+    def get_normalized_code(self, path: str) -> str:
+        """
+        Returns normalize_imported_modules_in_code(path), computing it at
+        most once until path or one of its local dependencies changes.
+        """
+        path = os.path.normpath(path)
+        self.refresh(path)
+        with self.lock:
+            if path in self.normalized_code:
+                return self.normalized_code[path]
+        normalized_code = normalize_imported_modules_in_code(path)
+        with self.lock:
+            self.normalized_code[path] = normalized_code
+        return normalized_code
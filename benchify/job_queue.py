@@ -0,0 +1,353 @@
+"""
+persistent local queue of analysis jobs, so long runs survive crashes
+"""
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import appdirs
+
+from .fingerprint import fingerprint_params
+
+PENDING = "pending"
+RUNNING = "running"
+DONE    = "done"
+FAILED  = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file TEXT NOT NULL,
+    function TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    retry_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_target ON jobs (file, function, hash);
+CREATE INDEX IF NOT EXISTS jobs_by_hash ON jobs (hash);
+CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, id);
+"""
+
+def get_job_queue_path() -> str:
+    """
+    Determines where to keep the job queue database.
+    """
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    return os.path.join(app_dirs.user_data_dir, "jobs.sqlite")
+
+def get_job_filter(job_ids: Optional[Iterable[int]]) -> Tuple[str, tuple]:
+    """
+    The SQL condition (to append to a WHERE clause) and its arguments
+    restricting a query to job_ids, or nothing if job_ids is None.
+    """
+    if job_ids is None:
+        return "", ()
+    return " AND id IN (SELECT value FROM json_each(?))", (json.dumps(list(job_ids)),)
+
+def get_owner() -> str:
+    """
+    Identifies this process, so that jobs left running by a dead process can
+    be told apart from jobs another live process is still working on.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def is_owner_alive(owner: Optional[str]) -> bool:
+    """
+    Whether the process that claimed a job might still be working on it.
+    Processes on other hosts are assumed alive.
+    """
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+#pylint:disable=too-few-public-methods
+class Job:
+    """
+    One queued request to analyze a single function.
+    """
+    def __init__(self, row: sqlite3.Row):
+        self.id: int = row["id"]
+        self.file: str = row["file"]
+        self.function: str = row["function"]
+        self.hash: str = row["hash"]
+        self.params: Dict[str, Any] = json.loads(row["params"])
+        self.status: str = row["status"]
+        self.attempts: int = row["attempts"]
+        self.result: Optional[str] = row["result"]
+        self.error: Optional[str] = row["error"]
+
+class PermanentJobError(Exception):
+    """
+    Raised by a JobQueue worker when retrying the job cannot help (e.g. the
+    server rejected its request), so that it is marked failed at once.
+    """
+
+class JobQueue:
+    """
+    A SQLite-backed queue of analysis jobs.  Jobs are identified by their
+    file, function and request fingerprint (see fingerprint_params), so
+    resubmitting an equivalent request reuses the existing job (and its
+    result, once it has one).  Safe to use from several threads and several
+    processes.
+
+    A job whose attempt failed is only retried after an exponential backoff
+    (retry_backoff seconds, doubling with each attempt, less up to half at
+    random so that jobs failed together are not retried together), so that
+    a network blip does not use up its attempts at once.
+    """
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_attempts: int = 3,
+        retry_backoff: float = 2.0):
+        self.db_path = db_path or get_job_queue_path()
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.db_path,
+            timeout=30,
+            isolation_level=None,
+            check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+            self.add_missing_columns()
+
+    def add_missing_columns(self):
+        """
+        Adds the columns newer versions use to a queue made by an older one.
+        Call with lock held.
+        """
+        columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        if "retry_at" not in columns:
+            try:
+                self.connection.execute(
+                    "ALTER TABLE jobs ADD COLUMN retry_at REAL NOT NULL DEFAULT 0")
+            except sqlite3.OperationalError:
+                # Another process added it first
+                pass
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+    def execute(self, sql: str, args: tuple = ()) -> List[sqlite3.Row]:
+        """
+        Runs one statement in its own transaction and returns the rows.
+        """
+        with self.lock:
+            return self.connection.execute(sql, args).fetchall()
+
+    def submit(self, file: str, function: str, params: Dict[str, Any]) -> int:
+        """
+        Queues a job, unless an identical one is already queued, running or
+        done, in which case that job's id is returned instead.  Failed jobs
+        are requeued.
+        """
+        params_hash = fingerprint_params(params)
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute(
+                    "SELECT id, status FROM jobs "
+                    "WHERE file = ? AND function = ? AND hash = ? "
+                    "ORDER BY id DESC LIMIT 1",
+                    (file, function, params_hash)).fetchall()
+                if rows and rows[0]["status"] != FAILED:
+                    job_id = rows[0]["id"]
+                elif rows:
+                    job_id = rows[0]["id"]
+                    self.connection.execute(
+                        "UPDATE jobs SET status = ?, attempts = 0, error = NULL, "
+                        "retry_at = 0, updated_at = ? WHERE id = ?",
+                        (PENDING, now, job_id))
+                else:
+                    job_id = self.connection.execute(
+                        "INSERT INTO jobs (file, function, hash, params, status, "
+                        "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (file, function, params_hash, json.dumps(params),
+                         PENDING, now, now)).lastrowid
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def find(self, file: str, function: str, params: Dict[str, Any]) -> Optional[Job]:
+        """
+        The latest job for exactly this request, if any was ever submitted.
+        """
+        rows = self.execute(
+            "SELECT * FROM jobs WHERE file = ? AND function = ? AND hash = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (file, function, fingerprint_params(params)))
+        return Job(rows[0]) if rows else None
+
+    def claim(self, job_ids: Optional[Iterable[int]] = None) -> Optional[Job]:
+        """
+        Marks the oldest pending job (of job_ids, if given) which is not
+        waiting out a retry backoff as running and returns it, or returns
+        None if there is none (see get_next_retry_at).
+        """
+        where, args = get_job_filter(job_ids)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute(
+                    f"SELECT * FROM jobs WHERE status = ? AND retry_at <= ?{where} "
+                    "ORDER BY id LIMIT 1",
+                    (PENDING, time.time()) + args).fetchall()
+                if rows:
+                    self.connection.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, "
+                        "owner = ?, updated_at = ? WHERE id = ?",
+                        (RUNNING, get_owner(), time.time(), rows[0]["id"]))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        if not rows:
+            return None
+        return self.get(rows[0]["id"])
+
+    def get_next_retry_at(self, job_ids: Optional[Iterable[int]] = None) -> Optional[float]:
+        """
+        The time.time() at which the next pending job (of job_ids, if given)
+        can be claimed, or None if nothing is pending.
+        """
+        where, args = get_job_filter(job_ids)
+        rows = self.execute(
+            f"SELECT MIN(retry_at) AS retry_at FROM jobs WHERE status = ?{where}",
+            (PENDING,) + args)
+        return rows[0]["retry_at"]
+
+    def complete(self, job_id: int, result: str):
+        """
+        Records the result of a job.
+        """
+        self.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, "
+            "updated_at = ? WHERE id = ?",
+            (DONE, result, time.time(), job_id))
+
+    def fail(self, job_id: int, error: str, retry: bool = True):
+        """
+        Records a failed attempt.  The job goes back to pending (to be
+        retried after its backoff) if retry is set and it has attempts left,
+        and is marked failed otherwise.
+        """
+        now = time.time()
+        backoff = self.retry_backoff * random.uniform(0.5, 1.0)
+        self.execute(
+            "UPDATE jobs SET status = CASE WHEN ? AND attempts < ? "
+            "THEN ? ELSE ? END, error = ?, "
+            "retry_at = ? + ? * (1 << MAX(attempts - 1, 0)), updated_at = ? WHERE id = ?",
+            (retry, self.max_attempts, PENDING, FAILED, error, now, backoff, now, job_id))
+
+    def recover(self) -> int:
+        """
+        Requeues the jobs left running by processes which no longer exist,
+        e.g. because they crashed or were interrupted.  Returns how many.
+        """
+        rows = self.execute(
+            "SELECT id, owner FROM jobs WHERE status = ?", (RUNNING,))
+        dead = [row["id"] for row in rows if not is_owner_alive(row["owner"])]
+        for job_id in dead:
+            self.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (PENDING, time.time(), job_id, RUNNING))
+        return len(dead)
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """
+        Looks up a job by id.
+        """
+        rows = self.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return Job(rows[0]) if rows else None
+
+    def counts(self, job_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+        """
+        How many jobs (of job_ids, if given) are in each status.
+        """
+        where, args = get_job_filter(job_ids)
+        rows = self.execute(
+            f"SELECT status, COUNT(*) AS n FROM jobs WHERE 1{where} GROUP BY status", args)
+        return {row["status"]: row["n"] for row in rows}
+
+    def drain(
+        self,
+        worker: Callable[[Job], str],
+        concurrency: int = 4,
+        on_finished: Optional[Callable[[Job], None]] = None,
+        deadline: Optional[float] = None,
+        job_ids: Optional[Iterable[int]] = None):
+        """
+        Runs worker on pending jobs (only those of job_ids, e.g. the current
+        run's, if given; else any) with at most concurrency jobs in flight,
+        until nothing is pending (or, if given, the time.monotonic() deadline
+        has passed, leaving the rest pending).  The string worker returns is
+        recorded as the job's result; if it raises, the attempt is recorded
+        as failed (and retried after its backoff while attempts remain,
+        unless it raised PermanentJobError).  on_finished is called with the
+        updated job after each attempt.
+        """
+        if job_ids is not None:
+            job_ids = list(job_ids)
+
+        def work():
+            while True:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                job = self.claim(job_ids)
+                if job is None:
+                    retry_at = self.get_next_retry_at(job_ids)
+                    if retry_at is None:
+                        return
+                    wait = retry_at - time.time()
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.monotonic())
+                    time.sleep(max(0.0, wait))
+                    continue
+                try:
+                    self.complete(job.id, worker(job))
+                except PermanentJobError as e:
+                    self.fail(job.id, str(e), retry=False)
+                #pylint:disable=broad-exception-caught
+                except Exception as e:
+                    self.fail(job.id, f"{type(e).__name__}: {e}")
+                if on_finished is not None:
+                    on_finished(self.get(job.id))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(work) for _ in range(concurrency)]:
+                future.result()
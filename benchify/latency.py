@@ -0,0 +1,186 @@
+"""
+local history of analysis latencies, used to pick timeouts and estimate ETAs
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import appdirs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    function_lines INTEGER NOT NULL,
+    test_code_bytes INTEGER NOT NULL,
+    pip_imports INTEGER NOT NULL,
+    patch INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+"""
+
+# What to assume before there is enough history
+FALLBACK_EXPECTED = 60.0
+FALLBACK_TIMEOUT = 300.0
+# The longest a client waits for an analysis, however slow similar ones were
+MAX_TIMEOUT = 3 * FALLBACK_TIMEOUT
+
+def get_latency_store_path() -> str:
+    """
+    Determines where to keep the latency history.
+    """
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    return os.path.join(app_dirs.user_data_dir, "latency.sqlite")
+
+def get_request_features(params: Dict[str, Any]) -> Dict[str, int]:
+    """
+    The features of an /analyze request that its latency is assumed to
+    depend on.
+    """
+    return {
+        "function_lines": params.get("test_func", "").count("\n") + 1,
+        "test_code_bytes": len(params.get("test_code", "").encode("utf-8")),
+        "pip_imports": len(params.get("pip_imports", [])),
+        "patch": int(bool(params.get("patch_requested"))),
+    }
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    The nearest-rank percentile of values (which must not be empty).
+    """
+    ordered = sorted(values)
+    rank = max(0, math.ceil(fraction * len(ordered)) - 1)
+    return ordered[min(rank, len(ordered) - 1)]
+
+def format_duration(seconds: float) -> str:
+    """
+    Describes a duration for humans, e.g. "40 seconds" or "3 minutes".
+    """
+    if seconds < 90:
+        seconds = max(1, round(seconds))
+        return f"{seconds} second{'s' if seconds != 1 else ''}"
+    minutes = round(seconds / 60)
+    if minutes < 90:
+        return f"{minutes} minutes"
+    return f"{seconds / 3600:.1f} hours"
+
+def estimate_batch(expected: List[float], concurrency: int) -> float:
+    """
+    Estimates how long a batch of requests, each expected to take the given
+    time, takes with concurrency requests in flight at a time.
+    """
+    if not expected:
+        return 0.0
+    return max(max(expected), sum(expected) / max(1, concurrency))
+
+#pylint:disable=too-few-public-methods
+class LatencyEstimate:
+    """
+    How long a request is expected to take (the median of similar past
+    requests), and how long to wait before giving up on it.
+    """
+    def __init__(self, expected: float, timeout: float, samples: int):
+        self.expected = expected
+        self.timeout = timeout
+        self.samples = samples
+
+class LatencyStore:
+    """
+    A small SQLite table of past request latencies and their features.
+    Estimates for a new request come from its nearest past requests
+    (comparing sizes on a log scale, and never mixing patch and non-patch
+    requests).  Safe to use from several threads.
+
+    Args:
+        db_path (str): Where to keep the history (by default, in the user
+            data directory).
+        neighbors (int): How many similar past requests to base estimates on.
+        min_samples (int): Below this many similar requests, the defaults
+            are used instead.
+        timeout_margin (float): The timeout is the 99th percentile of similar
+            latencies times this.
+        min_timeout, max_timeout (float): Bounds on the timeout.
+        max_samples (int): Older samples are dropped beyond this many.
+    """
+    #pylint:disable=too-many-arguments
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        neighbors: int = 50,
+        min_samples: int = 5,
+        timeout_margin: float = 2.0,
+        min_timeout: float = 30.0,
+        max_timeout: float = MAX_TIMEOUT,
+        max_samples: int = 5000):
+        self.db_path = db_path or get_latency_store_path()
+        self.neighbors = neighbors
+        self.min_samples = min_samples
+        self.timeout_margin = timeout_margin
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.max_samples = max_samples
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        """
+        Closes the database connection.
+        """
+        with self.lock:
+            self.connection.close()
+
+    def record(self, params: Dict[str, Any], duration: float, status: str):
+        """
+        Records how long a request took, and whether it succeeded ("ok") or
+        e.g. timed out.
+        """
+        features = get_request_features(params)
+        with self.lock:
+            row_id = self.connection.execute(
+                "INSERT INTO samples (function_lines, test_code_bytes, pip_imports, "
+                "patch, status, duration, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (features["function_lines"], features["test_code_bytes"],
+                 features["pip_imports"], features["patch"], status, duration,
+                 time.time())).lastrowid
+            if row_id % 100 == 0:
+                self.connection.execute(
+                    "DELETE FROM samples WHERE id <= ?", (row_id - self.max_samples,))
+
+    def estimate(self, params: Dict[str, Any]) -> LatencyEstimate:
+        """
+        Estimates the latency of a request from the most similar past
+        requests.  Those which timed out count with the time they were given,
+        so a request which keeps timing out gets more time on each attempt.
+        """
+        features = get_request_features(params)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT function_lines, test_code_bytes, pip_imports, duration "
+                "FROM samples WHERE status IN ('ok', 'timeout') AND patch = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (features["patch"], self.max_samples)).fetchall()
+
+        def distance(row: sqlite3.Row) -> float:
+            return sum(
+                (math.log1p(row[name]) - math.log1p(features[name])) ** 2
+                for name in ["function_lines", "test_code_bytes", "pip_imports"])
+
+        nearest = sorted(rows, key=distance)[:self.neighbors]
+        if len(nearest) < self.min_samples:
+            return LatencyEstimate(FALLBACK_EXPECTED, FALLBACK_TIMEOUT, len(nearest))
+        durations = [row["duration"] for row in nearest]
+        timeout = percentile(durations, 0.99) * self.timeout_margin
+        return LatencyEstimate(
+            percentile(durations, 0.5),
+            min(self.max_timeout, max(self.min_timeout, timeout)),
+            len(nearest))
@@ -0,0 +1,90 @@
+"""
+drives a BenchifyClient with many concurrent requests and measures it
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from .client import AnalysisResult, BenchifyClient
+from .latency import percentile
+
+def make_load_params(index: int, function_lines: int = 10) -> Dict[str, Any]:
+    """
+    A synthetic /analyze request, distinct for each index so that neither
+    the client nor the server can answer it from a cache.
+    """
+    body = "\n".join(f"    x = x + {line}" for line in range(function_lines))
+    test_func = f"def load_{index}(x):\n{body}\n    return x"
+    return {
+        "test_func": test_func,
+        "patch_requested": False,
+        "pip_imports": [],
+        "test_code": test_func + "\n",
+        "file_name": "load_test.py",
+    }
+
+#pylint:disable=too-few-public-methods
+class LoadTestReport:
+    """
+    Throughput and latency percentiles of a load test.
+    """
+    def __init__(self, results: List[AnalysisResult], elapsed: float, concurrency: int):
+        self.requests = len(results)
+        self.concurrency = concurrency
+        self.elapsed = elapsed
+        self.throughput = self.requests / elapsed if elapsed > 0 else 0.0
+        self.statuses: Dict[str, int] = {}
+        for result in results:
+            key = result.status if result.status_code is None else \
+                f"{result.status} ({result.status_code})"
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+        durations = [result.duration for result in results] or [0.0]
+        self.latencies = {
+            "p50": percentile(durations, 0.5),
+            "p90": percentile(durations, 0.9),
+            "p99": percentile(durations, 0.99),
+            "max": max(durations),
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        The report as a JSON-serializable dict.
+        """
+        return {
+            "requests": self.requests,
+            "concurrency": self.concurrency,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+            "statuses": self.statuses,
+            "latencies": self.latencies,
+        }
+
+    def summary(self) -> str:
+        """
+        The report, for humans.
+        """
+        latencies = ", ".join(
+            f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.latencies.items())
+        statuses = ", ".join(f"{count} {status}" for status, count in sorted(self.statuses.items()))
+        return f"{self.requests} requests in {self.elapsed:.2f} s " + \
+            f"({self.throughput:.1f}/s at concurrency {self.concurrency}): {statuses}\n" + \
+            f"Latency: {latencies}"
+
+def run_load_test(
+    client: BenchifyClient,
+    requests: int = 100,
+    concurrency: int = 8,
+    function_lines: int = 10) -> LoadTestReport:
+    """
+    Sends requests synthetic analyses through client, concurrency at a time,
+    and reports how it went.  Requests go through client.submit, so the
+    client's scheduler, session and latency history are exercised as usual.
+    """
+    def send(index: int) -> AnalysisResult:
+        params = make_load_params(index, function_lines)
+        return client.submit("load_test.py", f"load_{index}", params)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    return LoadTestReport(results, time.monotonic() - start, concurrency)
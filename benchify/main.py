@@ -1,228 +1,711 @@
 """
 exposes the API for benchify
 """
+from __future__ import annotations
+
+import contextlib
+import copy
+import json
 import os
-import pickle
 import sys
+import threading
 import time
-from typing import Any, Dict
-import webbrowser
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+# Only what talking to a running daemon needs is imported up front, so that
+# `benchify <file>` answers quickly when the daemon is running; the rest is
+# imported by the commands which use it.
+#pylint:disable=import-outside-toplevel
+from .daemon_client import DaemonClient
+from .results import AmbiguousFunctionError, AnalysisError, AnalysisResult
+
+if TYPE_CHECKING:
+    from .budget import BudgetPlan, Candidate
+    from .client import BenchifyClient
+    from .job_queue import Job, JobQueue
+
+def __getattr__(name):
+    # The URLs are kept importable from here for existing callers
+    if name in ["GCLOUD_URL", "AWS_URL", "LOCAL_URL", "PROXY_URL"]:
+        from . import client
+        return getattr(client, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def rprint(*args, **kwargs):
+    """
+    rich's print, imported when first used.
+    """
+    from rich import print as rich_print
+    rich_print(*args, **kwargs)
 
-from pathlib import Path
+# Receives one structured record per analyzed function, in --format jsonl mode
+RecordWriter = Callable[[Dict[str, Any]], None]
 
-import appdirs
-from auth0.authentication.token_verifier \
-    import TokenVerifier, AsymmetricSignatureVerifier
+def make_record_writer(stream: TextIO) -> RecordWriter:
+    """
+    Returns a RecordWriter writing each record to stream as one JSON line,
+    as soon as it is written, even from several threads at once.
+    """
+    lock = threading.Lock()
+    def write_record(record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False)
+        with lock:
+            stream.write(line + "\n")
+            stream.flush()
+    return write_record
+
+def print_response(response_text: str):
+    """
+    Prints the analysis results, rendering python code blocks as markdown.
+    """
+    from rich.console import Console
+    from rich.markdown import Markdown
+    console = Console()
+    # Split the text into lines
+    lines = response_text.split('\n')
+
+    in_code_block = False
+    code_block = []
+
+    for line in lines:
+        if line.strip() == '```python':
+            in_code_block = True
+            code_block = []
+        elif line.strip() == '```' and in_code_block:
+            in_code_block = False
+            # Print the collected code block
+            console.print(Markdown('```python\n' + '\n'.join(code_block) + '\n```'))
+        elif in_code_block:
+            code_block.append(line)
+        else:
+            # Print non-code lines
+            console.print(line)
 
-import jwt
-import requests
-from rich import print as rprint
-from rich.console import Console
-from rich.markdown import Markdown
+def print_result(result: AnalysisResult, write_record: Optional[RecordWriter] = None):
+    """
+    Prints an AnalysisResult (or writes its record, in jsonl mode).
+    """
+    if write_record is not None:
+        write_record(result.to_record())
+    elif result.status == "timeout":
+        rprint("Timed out")
+    elif result.status == "error" and not result.text:
+        rprint(f"❌ {result.error}")
+    else:
+        print_response(result.text)
 
-import typer
+def watch_command(args: List[str], write_record: Optional[RecordWriter] = None):
+    """
+    benchify watch <path> [-p]
 
-from .source_manipulation import \
-    get_function_source_from_source, \
-    get_all_function_names, \
-    get_pip_imports_recursive, \
-    normalize_imported_modules_in_code, \
-    can_import_via_pip, \
-    replace_block_comments
+    Watches path (a file or a project directory) and re-analyzes each
+    function whose source changes when a file is saved.
+    """
+    from .client import BenchifyClient
+    from .latency import LatencyStore
+    from .watch import watch_project
+    path = args[0] if args and args[0][0] != "-" else "."
+    patch = any(arg.strip() in ["-p", "--patch"] for arg in args)
+    client = BenchifyClient(latency_store=LatencyStore())
+    client.get_auth_tokens()
+
+    def on_change(file: str, names: List[str]):
+        # The changed functions of a file share one batched request
+        rprint(f"Analyzing {', '.join(names)} in {file} ...")
+        for result in client.iter_analyze_file(file, names, patch):
+            if write_record is None:
+                rprint(f"[bold]{os.path.relpath(file)}::{result.function}[/bold]")
+            print_result(result, write_record)
+
+    rprint(f"Watching {path} for changes (Ctrl+C to stop) ...")
+    try:
+        watch_project(path, on_change, index=client.index)
+    except KeyboardInterrupt:
+        pass
 
-app = typer.Typer()
+def get_option_value(args: List[str], option: str) -> Optional[str]:
+    """
+    Returns the value following option in args (e.g. "origin/main" for
+    "--changed-since origin/main"), or None if the option is absent.
+    """
+    if option in args:
+        position = args.index(option)
+        if position + 1 < len(args):
+            return args[position + 1]
+    return None
 
-GCLOUD_URL = "https://benchify.cloud/analyze"
-AWS_URL = "https://api.benchify.com/analyze"
-LOCAL_URL = "http://localhost:9091/analyze"
+def changed_since_command(args: List[str], write_record: Optional[RecordWriter] = None):
+    """
+    benchify --changed-since <ref> [-p] [--jobs N] [--rate R] [--budget T]
+        [--shard I/N]
+
+    Analyzes, in parallel, every function changed since ref, plus every
+    function which uses something from a changed local module.  Requests
+    go through the persistent JobQueue, so functions already analyzed in
+    the same state are not resubmitted and `benchify resume` can finish an
+    interrupted run.  At most --rate requests are sent per second (if
+    given), and fewer while the server is throttling or slowing down.
+    With --budget (e.g. 10m), the run finishes within that time: the most
+    valuable functions that fit are analyzed and the rest are deferred.
+    With --shard (e.g. 2/4), only this node's share of the functions is
+    analyzed: every node of a CI run computes the same split, balanced by
+    predicted cost, and `benchify merge-reports` merges their jsonl records.
+    """
+    import subprocess
+    from .budget import parse_duration
+    from .changes import \
+        get_changed_functions, \
+        get_changed_line_ranges, \
+        list_python_files, \
+        run_git
+    from .client import BenchifyClient
+    from .job_queue import DONE, PENDING, JobQueue
+    from .latency import LatencyStore, format_duration
+    from .module_graph import load_module_graph
+    from .sharding import parse_shard, shard_requests
+    start = time.monotonic()
+    ref = get_option_value(args, "--changed-since")
+    if ref is None:
+        rprint("Please pass a git ref, e.g. \n$ benchify --changed-since origin/main")
+        return
+    patch = any(arg.strip() in ["-p", "--patch"] for arg in args)
+    jobs = int(get_option_value(args, "--jobs") or 4)
+    rate = get_option_value(args, "--rate")
+    rate = float(rate) if rate else None
+    budget = get_option_value(args, "--budget")
+    try:
+        budget = parse_duration(budget) if budget else None
+    except ValueError as budget_exception:
+        rprint(str(budget_exception))
+        return
+    shard = get_option_value(args, "--shard")
+    try:
+        shard = parse_shard(shard) if shard else None
+    except ValueError as shard_exception:
+        rprint(str(shard_exception))
+        return
 
-AUTH0_DOMAIN    = 'benchify.us.auth0.com'
-AUTH0_CLIENT_ID = 'VessO49JLtBhlVXvwbCDkeXZX4mHNLFs'
-ALGORITHMS      = ['RS256']
+    try:
+        repo_root = run_git(["rev-parse", "--show-toplevel"], os.getcwd()).strip()
+        python_files = list_python_files(repo_root)
+        graph = load_module_graph(repo_root, python_files)
+        targets = get_changed_functions(ref, repo_root, python_files, graph=graph)
+        changed_ranges = get_changed_line_ranges(ref, repo_root) if budget else {}
+    except (OSError, subprocess.CalledProcessError) as git_exception:
+        rprint(f"Could not compute the changes since {ref}: {git_exception}")
+        return
+    if not targets:
+        rprint(f"No functions changed since {ref}.")
+        return
+    for file, names in targets.items():
+        rprint(f"{os.path.relpath(file)}: {', '.join(names)}")
+    if shard is not None and write_record is not None:
+        write_record = make_shard_record_writer(write_record, shard, repo_root)
 
-#pylint:disable=invalid-name
-#pylint:disable=redefined-outer-name
-current_user    = None
+    client = BenchifyClient(max_workers=jobs, rate=rate, latency_store=LatencyStore())
+    queue = JobQueue()
+    queue.recover()
 
-def get_token_file_path() -> str:
+    def prepare(target: Tuple[str, str]) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+        file, name = target
+        try:
+            name, params = client.prepare(file, name, patch)
+        except (OSError, SyntaxError, AnalysisError) as e:
+            rprint(f"Skipping {name} in {file}: {e}")
+            return None
+        return file, name, params
+
+    # Requests are built concurrently, while logging in
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        requests_to_send = [
+            request for request in executor.map(
+                prepare, [(file, name) for file, names in targets.items() for name in names])
+            if request is not None
+        ]
+    client.get_auth_tokens()
+    requests_to_send, duplicates = dedupe_requests(requests_to_send)
+    if shard is not None:
+        total = len(requests_to_send)
+        requests_to_send = shard_requests(requests_to_send, shard, repo_root)
+        rprint(f"Shard {shard[0]}/{shard[1]}: {len(requests_to_send)} of {total} functions.")
+
+    def report(job: Job, cache_hit: bool = False):
+        print_job(job, write_record, cache_hit)
+        for file, name in duplicates.get((job.file, job.function), []):
+            duplicate = copy.copy(job)
+            duplicate.file, duplicate.function = file, name
+            print_job(duplicate, write_record, cache_hit=True)
+
+    deadline = None
+    plan = None
+    if budget is not None:
+        deadline = start + budget
+        plan = make_budget_plan(
+            client, queue, requests_to_send, changed_ranges, deadline - time.monotonic())
+        requests_to_send = [
+            (candidate.file, candidate.name, candidate.params)
+            for candidate in plan.cached + plan.selected
+        ]
+        rprint(plan.summary())
+    job_ids = [queue.submit(file, name, params) for file, name, params in requests_to_send]
+
+    pending_params = []
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        if job.status == DONE:
+            report(job, cache_hit=True)
+        elif job.status == PENDING:
+            pending_params.append(job.params)
+    eta = format_duration(client.estimate_batch(pending_params))
+    rprint(f"Analyzing {queue.counts(job_ids).get(PENDING, 0)} functions, " + \
+        f"should take about {eta} ...")
+    queue.drain(
+        make_job_worker(client, deadline),
+        concurrency=jobs,
+        on_finished=report,
+        deadline=deadline,
+        job_ids=job_ids)
+    if plan is not None:
+        out_of_time = [
+            job for job in map(queue.get, job_ids) if job.status == PENDING
+        ]
+        print_deferred(plan.deferred, out_of_time, write_record)
+
+def make_shard_record_writer(
+    write_record: RecordWriter,
+    shard: Tuple[int, int],
+    repo_root: str) -> RecordWriter:
+    """
+    Wraps write_record so that each record names the shard it comes from
+    and its file relative to repo_root, so that the records of nodes with
+    checkouts in different places can be merged.
     """
-    Determines where to save & load token.
+    def write_shard_record(record: Dict[str, Any]):
+        write_record(dict(
+            record,
+            file=os.path.relpath(record["file"], repo_root),
+            shard=f"{shard[0]}/{shard[1]}"))
+    return write_shard_record
+
+def dedupe_requests(
+    requests_to_send: List[Tuple[str, str, Dict[str, Any]]]) -> Tuple[
+        List[Tuple[str, str, Dict[str, Any]]], Dict[Tuple[str, str], List[Tuple[str, str]]]]:
     """
-    app_dirs = appdirs.AppDirs("benchify", "benchify")
-    token_file = "token.pickle"
-    token_file_path = os.path.join(app_dirs.user_data_dir, token_file)
-    return token_file_path
+    Keeps only the first of the (file, name, params) requests sharing a
+    fingerprint (e.g. a helper copied into several files), so that it is
+    analyzed once.
 
-def save_token(token_data: Any) -> bool:
+    Returns:
+        The requests to send, and a map from the (file, name) of each of
+        them to the (file, name) of its duplicates, which share its result.
     """
-    Saves the token_data to get_token_file_path().
+    from .fingerprint import fingerprint_params
+    unique: Dict[str, Tuple[str, str, Dict[str, Any]]] = {}
+    duplicates: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+    for file, name, params in requests_to_send:
+        original = unique.setdefault(fingerprint_params(params), (file, name, params))
+        if original[:2] != (file, name):
+            duplicates.setdefault(original[:2], []).append((file, name))
+    return list(unique.values()), duplicates
+
+def make_budget_plan(
+    client: BenchifyClient,
+    queue: JobQueue,
+    requests_to_send: List[Tuple[str, str, Dict[str, Any]]],
+    changed_ranges: Dict[str, List[Tuple[int, int]]],
+    budget: float) -> BudgetPlan:
     """
-    try:
-        token_file_path = get_token_file_path()
-        os.makedirs(os.path.dirname(token_file_path), exist_ok=True)
-        with open(token_file_path, "wb") as f:
-            pickle.dump(token_data, f)
-    #pylint:disable=broad-exception-caught
-    except Exception as e:
-        print("Encountered exception while attempting to save token: ", e)
-        return False
-    return True
-
-def load_token() -> Any:
-    """
-    Loads the token_data from get_token_file_path().
-    """
-    token_file_path = get_token_file_path()
-    if os.path.exists(token_file_path):
-        with open(token_file_path, "rb") as f:
-            return pickle.load(f)
-    return None
+    Ranks the (file, name, params) requests by value and predicted cost,
+    counting those the JobQueue already has results for as free, and picks
+    those to send within budget seconds.
+    """
+    from .budget import make_candidate, plan_budget
+    from .job_queue import DONE
+    candidates = []
+    for file, name, params in requests_to_send:
+        job = queue.find(file, name, params)
+        candidates.append(make_candidate(
+            file, name, params, client.estimate(params).expected,
+            client.index.get(file), changed_ranges.get(file),
+            cached=job is not None and job.status == DONE))
+    return plan_budget(candidates, budget, client.max_workers)
+
+def print_deferred(
+    deferred: List[Candidate],
+    out_of_time: List[Job],
+    write_record: Optional[RecordWriter] = None):
+    """
+    Reports the functions a time-budgeted run left unanalyzed: those deferred
+    up front, most valuable first, and those still queued when time ran out
+    (which `benchify resume` finishes).
+    """
+    from .latency import format_duration
+    if write_record is not None:
+        for candidate in deferred:
+            write_record(dict(candidate.to_record(), status="deferred"))
+        for job in out_of_time:
+            write_record({"file": job.file, "function": job.function, "status": "queued"})
+        return
+    if deferred:
+        rprint(f"[bold]Deferred {len(deferred)} functions to stay within the budget:[/bold]")
+        for candidate in deferred:
+            rprint(f"  {os.path.relpath(candidate.file)}::{candidate.name} " + \
+                f"(value {candidate.value:.1f}, about {format_duration(candidate.expected)}, " + \
+                f"{candidate.churn} changed lines)")
+    if out_of_time:
+        rprint(f"Ran out of time with {len(out_of_time)} functions still queued; " + \
+            "run `benchify resume` to finish them.")
+
+def make_job_worker(
+    client: BenchifyClient,
+    deadline: Optional[float] = None) -> Callable[[Job], str]:
+    """
+    Returns a JobQueue worker which submits each job's request through
+    client, raising (so the job is retried) on timeouts, server errors and
+    throttling the scheduler gave up waiting out.  Requests the server
+    rejects fail the job for good (see PermanentJobError), except that after
+    a 401 the worker logs in again and resubmits once.  Given a
+    time.monotonic() deadline, requests are given up when it passes.
+    """
+    from .job_queue import PermanentJobError
+    def submit(job: Job) -> AnalysisResult:
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                raise RuntimeError("Out of time")
+        return client.submit(job.file, job.function, job.params, timeout)
+
+    def worker(job: Job) -> str:
+        auth_tokens = client.auth_tokens
+        result = submit(job)
+        if result.status == "error" and result.status_code == 401:
+            client.refresh_auth_tokens(auth_tokens)
+            result = submit(job)
+        if result.status == "timeout" or (result.status == "error" and (
+            (result.status_code or 500) >= 500 or result.status_code == 429)):
+
+            raise RuntimeError(result.error)
+        if result.status != "ok":
+            raise PermanentJobError(result.error)
+        return result.text
+    return worker
+
+def job_to_record(job: Job, cache_hit: bool = False) -> Dict[str, Any]:
+    """
+    The structured record of a finished job (see AnalysisResult.to_record).
+    """
+    from .job_queue import DONE
+    result = AnalysisResult(
+        job.file,
+        job.function,
+        "ok" if job.status == DONE else "error",
+        text=job.result or "",
+        error=job.error if job.status != DONE else None,
+        cache_hit=cache_hit,
+        patch_requested=bool(job.params.get("patch_requested")))
+    record = result.to_record()
+    record["attempts"] = job.attempts
+    return record
+
+def print_job(
+    job: Job,
+    write_record: Optional[RecordWriter] = None,
+    cache_hit: bool = False):
+    """
+    Prints the outcome of a finished job attempt (or, in jsonl mode, writes
+    the record of a job that is done or gave up).
+    """
+    from .job_queue import DONE, FAILED
+    if write_record is not None:
+        if job.status in [DONE, FAILED]:
+            write_record(job_to_record(job, cache_hit))
+        return
+    rprint(f"[bold]{os.path.relpath(job.file)}::{job.function}[/bold]")
+    if job.status == DONE:
+        print_response(job.result)
+    elif job.status == FAILED:
+        rprint(f"❌ Giving up after {job.attempts} attempts: {job.error}")
+    else:
+        rprint(f"Attempt {job.attempts} failed ({job.error}), will retry.")
 
-def validate_token(id_token: str) -> Dict[str,Any]:
+def resume_command(args: List[str], write_record: Optional[RecordWriter] = None):
     """
-    Verify the token and its precedence
+    benchify resume [--jobs N] [--rate R]
+
+    Finishes the jobs an interrupted run left queued.
     """
-    jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
-    issuer = f"https://{AUTH0_DOMAIN}/"
-    sign_verifier = AsymmetricSignatureVerifier(jwks_url)
-    token_verifier = TokenVerifier(
-        signature_verifier=sign_verifier,
-        issuer=issuer,
-        audience=AUTH0_CLIENT_ID)
-    try:
-        decoded_payload = token_verifier.verify(id_token)
-        return decoded_payload
-    except Exception as e:
-        raise e
-
-#pylint:disable=too-few-public-methods
-class AuthTokens:
-    """
-    id and access tokens
-    """
-    id_token: str = ""
-    access_token: str = ""
-    def __init__(self, my_id_token, access_token):
-        self.id_token = my_id_token
-        self.access_token = access_token
-
-def login() -> AuthTokens:
-    """
-    Runs the device authorization flow and stores the user object in memory
-    """
-    #pylint:disable=global-statement
-    global current_user
-    device_code_payload = {
-        'client_id': AUTH0_CLIENT_ID,
-        'scope': 'openid profile'
-    }
-    token_data = load_token()
-    # If token exists, check if it's valid
-    if token_data:
-        try:
-            _ = validate_token(token_data['id_token'])
-            rprint('✅ Using existing valid token')
-            current_user = jwt.decode(
-                token_data['id_token'],
-                algorithms=ALGORITHMS,
-                options={ "verify_signature": False })
-            return AuthTokens(
-                my_id_token=token_data['id_token'],
-                access_token=token_data['access_token']
-            )
-        #pylint:disable=broad-exception-caught
-        except Exception:
-            rprint('❌ Existing token is invalid, requesting a new one.')
+    from .client import BenchifyClient
+    from .job_queue import PENDING, JobQueue
+    from .latency import LatencyStore
+    jobs = int(get_option_value(args, "--jobs") or 4)
+    rate = get_option_value(args, "--rate")
+    rate = float(rate) if rate else None
+    queue = JobQueue()
+    recovered = queue.recover()
+    pending = queue.counts().get(PENDING, 0)
+    if pending == 0:
+        rprint("Nothing left to analyze.")
+        return
+    rprint(f"Resuming {pending} queued functions ({recovered} were interrupted) ...")
+    client = BenchifyClient(max_workers=jobs, rate=rate, latency_store=LatencyStore())
+    queue.drain(
+        make_job_worker(client),
+        concurrency=jobs,
+        on_finished=lambda job: print_job(job, write_record))
+
+def graph_command(args: List[str]):
+    """
+    benchify graph [root] [--format json|dot] [--impacted FILE]
+
+    Prints the local import graph of the project at root (by default, the
+    current directory), or, with --impacted, the modules and functions that
+    a change to FILE impacts.  The graph is persisted between runs and only
+    the modules modified since the previous run are re-read.
+    """
+    from .module_graph import load_module_graph
+    from .watch import iter_python_files
+    output_format = get_option_value(args, "--format") or "json"
+    impacted = get_option_value(args, "--impacted")
+    option_values = {output_format, impacted}
+    positional = [
+        arg for arg in args if arg[0] != "-" and arg not in option_values]
+    root = positional[0] if positional else os.getcwd()
+    graph = load_module_graph(root, iter_python_files(root))
+
+    if impacted is not None:
+        functions = graph.impacted_functions(impacted)
+        for path in sorted(graph.dependents(impacted)):
+            names = functions.get(path, [])
+            print(f"{os.path.relpath(path)}: {', '.join(names)}")
+    elif output_format == "dot":
+        print(graph.to_dot(), end="")
+    elif output_format == "json":
+        print(json.dumps(graph.to_json(), indent=2))
     else:
-        print("No cached token found, requesting a new one.")
+        rprint(f"Unknown format {output_format}, expected json or dot.")
 
-    login_timeout = 60
+def merge_reports_command(args: List[str]):
+    """
+    benchify merge-reports REPORT... [--output FILE]
+
+    Merges the jsonl records of several (e.g. --shard) runs, or earlier
+    merged reports, into one JSON report, written to FILE or printed.
+    """
+    from .sharding import merge_reports, read_report
+    output = get_option_value(args, "--output")
+    paths = [
+        arg for position, arg in enumerate(args)
+        if not arg.startswith("--") and (position == 0 or args[position - 1] != "--output")
+    ]
+    if not paths:
+        rprint("Please pass the reports to merge, e.g. \n" + \
+            "$ benchify merge-reports shard-*.jsonl --output report.json")
+        return
     try:
-        device_code_response = requests.post(
-            f"https://{AUTH0_DOMAIN}/oauth/device/code",
-            data=device_code_payload, timeout=login_timeout)
-    except requests.exceptions.Timeout:
-        rprint('Error generating the device code')
-        #pylint:disable=raise-missing-from
-        raise typer.Exit(code=1)
-
-    if device_code_response.status_code != 200:
-        rprint('Error generating the device code')
-        raise typer.Exit(code=1)
-
-    rprint('Device code successful')
-    device_code_data = device_code_response.json()
-
-    rprint(
-        '1. On your computer or mobile device navigate to: ',
-        device_code_data['verification_uri_complete'])
-    rprint('2. Enter the following code: ', device_code_data['user_code'])
+        report = merge_reports([read_report(path) for path in paths])
+    except (OSError, ValueError, KeyError) as report_exception:
+        rprint(f"Could not merge the reports: {report_exception!r}")
+        return
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if output is None:
+        print(text)
+        return
+    with open(output, "w", encoding="utf-8") as fw:
+        fw.write(text + "\n")
+    summary = report["summary"]
+    rprint(f"Merged {summary['functions']} functions from {len(paths)} reports " + \
+        f"({summary['found_problems']} with problems) into {output}.")
 
+def proxy_command(args: List[str]):
+    """
+    benchify proxy [--port N] [--upstream URL] [--max-upstream N] [--timeout SECONDS]
+
+    Runs a local proxy which the clients on this host can share by setting
+    BENCHIFY_URL (e.g. to PROXY_URL).  Identical concurrent requests are
+    sent upstream once, answers are cached, and at most --max-upstream
+    requests are sent upstream at a time, each given --timeout seconds (by
+    default, as long as the clients wait).
+    """
+    from .client import AWS_URL
+    from .latency import MAX_TIMEOUT
+    from .proxy import DEFAULT_PROXY_PORT, AnalysisProxy, make_proxy_server
+    port = int(get_option_value(args, "--port") or DEFAULT_PROXY_PORT)
+    upstream = get_option_value(args, "--upstream") or AWS_URL
+    max_upstream = int(get_option_value(args, "--max-upstream") or 8)
+    timeout = float(get_option_value(args, "--timeout") or MAX_TIMEOUT)
+    server = make_proxy_server(
+        port=port,
+        proxy=AnalysisProxy(upstream=upstream, max_upstream=max_upstream, timeout=timeout))
+    rprint(f"Proxying http://127.0.0.1:{port}/analyze to {upstream} " + \
+        f"(export BENCHIFY_URL=http://127.0.0.1:{port}/analyze to use it).")
     try:
-        webbrowser.open(device_code_data['verification_uri_complete'], new=1)
-    except webbrowser.Error as _browser_exception:
+        server.serve_forever()
+    except KeyboardInterrupt:
         pass
+    finally:
+        server.server_close()
+
+def daemon_command(args: List[str]):
+    """
+    benchify daemon [--stop]
 
-    token_payload = {
-        'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
-        'device_code': device_code_data['device_code'],
-        'client_id': AUTH0_CLIENT_ID
-    }
-
-    authenticated = False
-
-    while not authenticated:
-        token_response = requests.post(
-            f"https://{AUTH0_DOMAIN}/oauth/token",
-            data=token_payload,
-            timeout=None)
-
-        token_data = token_response.json()
-        if token_response.status_code == 200:
-            try:
-                _ = validate_token(token_data['id_token'])
-            except Exception as e:
-                rprint("Encountered exception validating token: ", e)
-                raise typer.Exit(code=1)
-            #pylint:disable=global-statement
-            current_user = jwt.decode(
-                token_data['id_token'],
-                algorithms=ALGORITHMS,
-                options={ "verify_signature": False })
-            rprint('✅ Authenticated!')
-            authenticated = True
-        elif token_data['error'] not in ('authorization_pending', 'slow_down'):
-            rprint(token_data['error_description'])
-            raise typer.Exit(code=1)
+    Runs a resident process which stays logged in and keeps parsed modules,
+    pip imports and results warm, so that later `benchify <file>` calls
+    (which use it automatically when it is running) start instantly.
+    """
+    from .daemon import make_daemon_server
+    if "--stop" in args:
+        if DaemonClient().stop():
+            rprint("Stopped the daemon.")
         else:
-            time.sleep(device_code_data['interval'])
+            rprint("No daemon is running.")
+        return
+    try:
+        server = make_daemon_server()
+    except OSError as e:
+        rprint(f"Could not start the daemon: {e}")
+        return
+    server.client.get_auth_tokens()
+    rprint(f"Listening on {server.server_address} (Ctrl+C to stop) ...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
 
-    # Save the new token to file
-    save_token(token_data)
+def mock_server_command(args: List[str]):
+    """
+    benchify mock-server [--port N] [--latency S] [--jitter F] [--error-rate F]
+        [--throttle-rate F] [--failure-rate F] [--stream]
+
+    Serves a stand-in for /analyze and for the Auth0 endpoints the login
+    uses, with the given latency and rates of errors, throttling and failing
+    properties, so the client can be tried and measured offline.
+    """
+    from .mock_server import DEFAULT_MOCK_PORT, MockServer
+    port = int(get_option_value(args, "--port") or DEFAULT_MOCK_PORT)
+    def rate(option: str) -> float:
+        return float(get_option_value(args, option) or 0)
+    server = MockServer(
+        ("127.0.0.1", port),
+        latency=rate("--latency"),
+        jitter=rate("--jitter"),
+        error_rate=rate("--error-rate"),
+        throttle_rate=rate("--throttle-rate"),
+        failure_rate=rate("--failure-rate"),
+        stream="--stream" in args)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    rprint(f"Serving a mock analysis API on {base_url} (Ctrl+C to stop).  Use it with:\n" + \
+        f"export BENCHIFY_URL={base_url}/analyze BENCHIFY_AUTH_URL={base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        rprint(f"Answered: {server.stats}")
+
+def load_test_command(args: List[str]):
+    """
+    benchify load-test [--url URL] [--requests N] [--concurrency C] [--login]
 
-    return AuthTokens(
-        my_id_token=token_data['id_token'],
-        access_token=token_data['access_token']
-    )
+    Sends N synthetic analyses, C at a time (by default to a local
+    mock-server), and reports throughput and latency percentiles.  Unless
+    --login is given, a placeholder token is sent, which the mock server
+    accepts.
+    """
+    from .auth import AuthTokens
+    from .client import BenchifyClient, LOCAL_URL
+    from .load_test import run_load_test
+    requests_count = int(get_option_value(args, "--requests") or 100)
+    concurrency = int(get_option_value(args, "--concurrency") or 8)
+    url = get_option_value(args, "--url") or LOCAL_URL
+    auth_tokens = None if "--login" in args else AuthTokens("load-test", "load-test")
+    client = BenchifyClient(url=url, auth_tokens=auth_tokens, max_workers=concurrency)
+    rprint(f"Sending {requests_count} requests to {url}, {concurrency} at a time ...")
+    report = run_load_test(client, requests_count, concurrency)
+    rprint(report.summary())
 
-@app.command()
 def authenticate():
     """
     login if not already
     """
-    if current_user is None:
-        login()
-    rprint("✅ Logged in " + str(current_user))
+    from .auth import login
+    auth_tokens = login()
+    rprint("✅ Logged in " + str(auth_tokens.user))
 
-#pylint:disable = too-many-return-statements
-@app.command()
 def analyze():
     help_info_opts = ["-h", "--h", "-help", "--help", "-i", "--i", "-info", "--info"]
     if len(sys.argv) == 1 or (len(sys.argv) == 2 and sys.argv[1] in help_info_opts):
         print("What would you like Benchify to analyze? For example: \n" + \
                 "\n\n$ benchify isort.py -p # Analyze the single function in isort.py and suggest a patch." + \
                 "\n\n$ benchify budget.py add_debts # Analyze the add_debts function in budget.py, but don't patch." + \
-                "\n\n$ benchify geom.py dist -p # Analyze the dist function in geom.py and suggest a patch.")
+                "\n\n$ benchify geom.py dist -p # Analyze the dist function in geom.py and suggest a patch." + \
+                "\n\n$ benchify watch src/ # Re-analyze functions in src/ as they change." + \
+                "\n\n$ benchify --changed-since origin/main # Analyze the functions changed on this branch." + \
+                "\n\n$ benchify --changed-since origin/main --budget 10m # Analyze what matters most within 10 minutes." + \
+                "\n\n$ benchify resume # Finish the analyses an interrupted run left queued." + \
+                "\n\n$ benchify --changed-since origin/main --format jsonl --shard 2/4 # This CI node's share of the work." + \
+                "\n$ benchify merge-reports shard-*.jsonl --output report.json # Merge the nodes' records." + \
+                "\n\n$ benchify graph --impacted src/util.py # Show what a change to util.py impacts." + \
+                "\n\n$ benchify proxy # Share and deduplicate requests between the processes on this host." + \
+                "\n\n$ benchify daemon # Keep a warm process around so that later calls start instantly." + \
+                "\n\n$ benchify --changed-since origin/main --format jsonl # One JSON record per function, as each finishes." + \
+                "\n\n$ benchify mock-server --latency 0.5 # Serve a stand-in analysis API, e.g. for load tests." + \
+                "\n$ benchify load-test --requests 500 --concurrency 32 # Measure the client's throughput.")
+        return
+
+    output_format = None
+    if sys.argv[1] != "graph":
+        output_format = get_option_value(sys.argv, "--format")
+    if output_format is None:
+        run_command()
+        return
+    if output_format != "jsonl":
+        rprint(f"Unknown format {output_format}, expected jsonl.")
+        return
+    position = sys.argv.index("--format")
+    del sys.argv[position:position + 2]
+    write_record = make_record_writer(sys.stdout)
+    # Keep stdout for the records; progress messages go to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        run_command(write_record)
+
+#pylint:disable = too-many-return-statements
+def run_command(write_record: Optional[RecordWriter] = None):
+    """
+    Runs the command given by sys.argv, writing one record per analyzed
+    function to write_record in jsonl mode.
+    """
+    if sys.argv[1] == "watch":
+        watch_command(sys.argv[2:], write_record)
+        return
+    if sys.argv[1] == "resume":
+        resume_command(sys.argv[2:], write_record)
+        return
+    if sys.argv[1] == "graph":
+        graph_command(sys.argv[2:])
+        return
+    if sys.argv[1] == "merge-reports":
+        merge_reports_command(sys.argv[2:])
+        return
+    if sys.argv[1] == "proxy":
+        proxy_command(sys.argv[2:])
+        return
+    if sys.argv[1] == "daemon":
+        daemon_command(sys.argv[2:])
+        return
+    if sys.argv[1] == "mock-server":
+        mock_server_command(sys.argv[2:])
+        return
+    if sys.argv[1] == "load-test":
+        load_test_command(sys.argv[2:])
+        return
+    if "--changed-since" in sys.argv:
+        changed_since_command(sys.argv[1:], write_record)
         return
 
     """
@@ -244,8 +727,6 @@ def analyze():
     patch = False 
     name = None
 
-    file_name = Path(file).name
-
     if len(sys.argv) > 2 and sys.argv[2].strip() in ["-p", "--patch"]:
         patch = True 
     if len(sys.argv) > 3 and sys.argv[3].strip() in ["-p", "--patch"]:
@@ -257,39 +738,30 @@ def analyze():
         name = sys.argv[3]
 
 
-    auth_tokens = login()
-    function_str = None
+    # Use the warm daemon if one is running.  Logging in overlaps with
+    # preparing the request (see BenchifyClient.prepare).
+    client = DaemonClient.connect()
+    if client is None:
+        from .client import BenchifyClient
+        from .latency import LatencyStore
+        client = BenchifyClient(interactive=True, latency_store=LatencyStore())
+
+    if write_record is not None:
+        # Problems selecting the function are reported in the record
+        print_result(client.analyze_function(file, name, patch), write_record)
+        return
 
     try:
         rprint("Scanning " + file + " ...")
-        # platform dependent encoding used
-        #pylint:disable=unspecified-encoding
-        with open(file, "r", encoding=None) as file_reading:
-            # Perhaps not the best name here, since it might have multiple functions?
-            function_str = replace_block_comments(file_reading.read())
-            # is there more than one function in the file?
-            function_names = get_all_function_names(function_str)
-            if len(function_names) > 1:
-                if name == None:
-                    rprint("Since there is more than one function in the " + \
-                        "file, please specify which one you want to " + \
-                        "analyze, e.g., \n$ benchify " + file + " " + function_names[0])
-                    return
-
-                function_str = get_function_source_from_source(function_str, name)
-                if function_str:
-                    pass
-                else:
-                    rprint(f"🔍 Function named {name} not " + \
-                        f"found in {file}.")
-                    return
-            elif len(function_names) == 1:
-                function_str = get_function_source_from_source(function_str, function_names[0])
-                name = function_names[0]
-            else:
-                rprint(f"There were no functions in {file}." + \
-                    " Cannot continue 😢.")
-                return
+        name, _ = client.select_function(file, name)
+    except AmbiguousFunctionError as ambiguous:
+        rprint("Since there is more than one function in the " + \
+            "file, please specify which one you want to " + \
+            "analyze, e.g., \n$ benchify " + file + " " + ambiguous.function_names[0])
+        return
+    except AnalysisError as selection_exception:
+        rprint(f"{selection_exception} Cannot continue 😢.")
+        return
     except OSError as reading_exception:
         rprint(f"Encountered exception trying to read {file}: {reading_exception}." + \
             " Cannot continue 😢.")
@@ -298,79 +770,33 @@ def analyze():
         rprint(f"Encountered exception trying to parse into ast {file}: {reading_exception}." + \
             " Cannot continue 😢.")
         return
-    if function_str is None:
-        rprint(f"Error attempting to read {file}." + \
-            " Cannot continue 😢.")
-        return
 
-    pip_imports = []
-    try:
-        pip_imports = get_pip_imports_recursive(file)
-    except Exception as e:
-        rprint(f"Error trying to resolve pip imports.")
-
-    # Make sure each import can be pip imported
-    print("Computing pip imports.")
-    new_pip_imports = []
-    for pip_import in pip_imports:
-        package_name = pip_import
-        while not can_import_via_pip(package_name):
-            print(f"It looks like we can't get {package_name} by just " + \
-                f"running `pip install {package_name}`. What package do we" + \
-                " need to install to get it?")
-            package_name = input("Package name: ")
-        print(f"Adding {package_name} to pip_imports.")
-        new_pip_imports.append(package_name)
-    pip_imports = new_pip_imports
+    # The timeout, too, is based on how long similar functions took; the
+    # estimate arrives once the request is prepared, before the analysis
+    def show_estimate(estimate):
+        from .latency import format_duration
+        rprint(f"Analyzing.  Should take about {format_duration(estimate.expected)} ...")
 
-    console = Console()
-    url = AWS_URL
-    normalized_code = str(normalize_imported_modules_in_code(file))
-
-    params = {
-        "test_func": function_str,
-        "patch_requested": patch,
-        "pip_imports": pip_imports,
-        "test_code": normalized_code,
-        "file_name": file_name,
-    }
-    headers = {'Authorization': f'Bearer {auth_tokens.id_token}'}
-    expected_time = ("1 minute", 60)
-    rprint(f"Analyzing.  Should take about {expected_time[0]} ...")
-    try:
-        response = requests.post(url, json=params, headers=headers, timeout=expected_time[1]*5)
-    except requests.exceptions.Timeout:
-        rprint("Timed out")
-        return
+    result = client.analyze_function(file, name, patch, on_estimate=show_estimate)
+    print_result(result, write_record)
 
-    def print_response(response_text: str):
-        # Split the text into lines
-        lines = response_text.split('\n')
-        
-        in_code_block = False
-        code_block = []
-
-        for line in lines:
-            if line.strip() == '```python':
-                in_code_block = True
-                code_block = []
-            elif line.strip() == '```' and in_code_block:
-                in_code_block = False
-                # Print the collected code block
-                console.print(Markdown('```python\n' + '\n'.join(code_block) + '\n```'))
-            elif in_code_block:
-                code_block.append(line)
-            else:
-                # Print non-code lines
-                console.print(line)
-
-    print_response(response.text)
-
-    if "❌" in response.text and patch == False:
-        console.print(
+    if result.found_problems and patch == False and write_record is None:
+        from rich.console import Console
+        from rich.markdown import Markdown
+        Console().print(
             Markdown(
                 "\nWant Benchify to generate a patch for you?  " + \
                 "Try:\n\n\tbenchify " + file + " " + name + " -p\n"))
 
+def make_app():
+    """
+    The typer app offering analyze and authenticate as commands.
+    """
+    import typer
+    app = typer.Typer()
+    app.command()(authenticate)
+    app.command()(analyze)
+    return app
+
 if __name__ == "__main__":
-    app()
+    make_app()()
@@ -0,0 +1,317 @@
+"""
+stand-in for the analysis API and its Auth0 endpoints, for offline testing
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from .auth import AUTH0_CLIENT_ID
+
+DEFAULT_MOCK_PORT = 9091
+
+MOCK_KEY_ID = "benchify-mock"
+
+def build_report(
+    params: Dict[str, Any],
+    failed: bool,
+    name: Optional[str] = None) -> List[str]:
+    """
+    The lines of a plausible analysis report for an /analyze request, about
+    the function called name (by default, the one test_func defines).
+    """
+    if name is None:
+        match = re.search(r"def\s+(\w+)", params.get("test_func", ""))
+        name = match.group(1) if match else "function"
+    lines = [
+        f"Analyzed {name} from {params.get('file_name', 'unknown.py')}.",
+        f"✅ {name} does not crash on valid inputs",
+        f"✅ {name} is deterministic",
+        f"❌ {name} preserves its input" if failed else f"✅ {name} preserves its input",
+    ]
+    if failed and params.get("patch_requested"):
+        lines += ["Suggested patch:", "```python", params.get("test_func", ""), "```"]
+    return lines
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Serves /analyze and /analyze/batch, the device authorization endpoints
+    and the JWKS.
+    """
+    server: "MockServer"
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, data: Any, headers: Optional[Dict[str, str]] = None):
+        """
+        Sends data as a JSON response.
+        """
+        self.send_body(status, json.dumps(data).encode("utf-8"), "application/json", headers)
+
+    def send_body(
+        self,
+        status: int,
+        body: bytes,
+        content_type: str = "text/plain; charset=utf-8",
+        headers: Optional[Dict[str, str]] = None):
+        """
+        Sends a complete response.
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_chunked(self, status: int, content_type: str):
+        """
+        Starts a response whose body is sent in chunks (see write_chunk).
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, chunk: bytes):
+        """
+        Sends one chunk of a chunked response; an empty chunk ends it.
+        """
+        self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def read_body(self) -> bytes:
+        """
+        Reads the request body.
+        """
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    #pylint:disable=invalid-name
+    def do_GET(self):
+        if self.path == "/.well-known/jwks.json":
+            self.send_json(200, {"keys": [self.server.get_jwk()]})
+        else:
+            self.send_json(404, {"error": "not_found"})
+
+    #pylint:disable=invalid-name
+    def do_POST(self):
+        body = self.read_body()
+        if self.path == "/oauth/device/code":
+            self.send_json(200, {
+                "device_code": uuid.uuid4().hex,
+                "user_code": "MOCK-CODE",
+                "verification_uri": f"http://{self.headers['Host']}/activate",
+                "verification_uri_complete":
+                    f"http://{self.headers['Host']}/activate?user_code=MOCK-CODE",
+                "expires_in": 900,
+                "interval": 0,
+            })
+        elif self.path == "/oauth/token":
+            id_token = self.server.issue_token(f"http://{self.headers['Host']}/")
+            self.send_json(200, {
+                "id_token": id_token,
+                "access_token": uuid.uuid4().hex,
+                "token_type": "Bearer",
+                "expires_in": 86400,
+            })
+        elif self.path.rstrip("/") == "/analyze":
+            self.analyze(body)
+        elif self.path.rstrip("/") == "/analyze/batch":
+            self.analyze_batch(body)
+        else:
+            self.send_json(404, {"error": "not_found"})
+
+    def read_params(self, body: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Checks the request's bearer token and parses its JSON body, or
+        answers with an error and returns None.
+        """
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            self.server.count(401)
+            self.send_body(401, b"Missing bearer token")
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            self.server.count(400)
+            self.send_body(400, b"Invalid JSON")
+            return None
+
+    def analyze(self, body: bytes):
+        """
+        Answers an /analyze request after the configured latency, failing or
+        throttling at the configured rates.
+        """
+        params = self.read_params(body)
+        if params is None:
+            return
+        outcome, delay = self.server.draw()
+        if outcome == "throttle":
+            self.server.count(429)
+            self.send_body(429, b"Too many requests", headers={"Retry-After": "1"})
+            return
+        if outcome == "error":
+            time.sleep(delay)
+            self.server.count(500)
+            self.send_body(500, b"Internal server error")
+            return
+
+        lines = build_report(params, failed=outcome == "failed")
+        self.server.count(200)
+        if not self.server.stream:
+            time.sleep(delay)
+            self.send_body(200, "\n".join(lines).encode("utf-8"))
+            return
+        # Stream the report line by line, spreading the latency over it
+        self.start_chunked(200, "text/plain; charset=utf-8")
+        for line in lines:
+            time.sleep(delay / len(lines))
+            self.write_chunk((line + "\n").encode("utf-8"))
+        self.write_chunk(b"")
+
+    def analyze_batch(self, body: bytes):
+        """
+        Answers an /analyze/batch request: the whole batch may be throttled,
+        and otherwise each function is analyzed as by /analyze, concurrently,
+        its result streamed as one JSON line ({"name", "status", "text"})
+        as soon as it is ready.
+        """
+        params = self.read_params(body)
+        if params is None:
+            return
+        functions = params.get("functions")
+        if not isinstance(functions, list) or not functions:
+            self.server.count(400)
+            self.send_body(400, b"Expected a list of functions")
+            return
+        if self.server.throttled():
+            self.server.count(429)
+            self.send_body(429, b"Too many requests", headers={"Retry-After": "1"})
+            return
+
+        outcomes = []
+        for function in functions:
+            outcome, delay = self.server.draw(throttle=False)
+            outcomes.append((delay, outcome, function))
+        self.start_chunked(200, "application/x-ndjson")
+        elapsed = 0.0
+        for delay, outcome, function in sorted(outcomes, key=lambda outcome: outcome[0]):
+            time.sleep(delay - elapsed)
+            elapsed = delay
+            if outcome == "error":
+                self.server.count(500)
+                record = {"name": function.get("name"), "status": 500,
+                    "text": "Internal server error"}
+            else:
+                self.server.count(200)
+                function_params = dict(params, test_func=function.get("test_func", ""))
+                lines = build_report(
+                    function_params, failed=outcome == "failed", name=function.get("name"))
+                record = {"name": function.get("name"), "status": 200, "text": "\n".join(lines)}
+            self.write_chunk((json.dumps(record) + "\n").encode("utf-8"))
+        self.write_chunk(b"")
+
+    def log_message(self, *args):
+        pass
+
+#pylint:disable=too-many-instance-attributes
+class MockServer(ThreadingHTTPServer):
+    """
+    A local stand-in for the analysis API and Auth0.  Point the client at it
+    with BENCHIFY_URL=http://HOST:PORT/analyze and
+    BENCHIFY_AUTH_URL=http://HOST:PORT.
+
+    Args:
+        latency (float): Mean seconds before answering an analysis.
+        jitter (float): Latencies vary uniformly by this fraction of latency.
+        error_rate (float): Fraction of analyses answered with a 500.
+        throttle_rate (float): Fraction of analyses answered with a 429.
+        failure_rate (float): Fraction of analyses reporting a failing property.
+        stream (bool): Whether to stream reports line by line.
+        seed (int): Seeds the random outcomes, for reproducible runs.
+    """
+    daemon_threads = True
+
+    #pylint:disable=too-many-arguments
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        stream: bool = False,
+        seed: Optional[int] = None):
+        super().__init__(address, MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.failure_rate = failure_rate
+        self.stream = stream
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats: Dict[int, int] = {}
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def draw(self, throttle: bool = True) -> Tuple[str, float]:
+        """
+        Picks the outcome ("throttle" unless not throttle, "error", "failed"
+        or "ok") and latency of the next analysis.
+        """
+        throttle_rate = self.throttle_rate if throttle else 0.0
+        with self.lock:
+            roll = self.random.random()
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+            failed = self.random.random() < self.failure_rate
+        if roll < throttle_rate:
+            return "throttle", 0.0
+        if roll < throttle_rate + self.error_rate:
+            return "error", max(0.0, delay)
+        return ("failed" if failed else "ok"), max(0.0, delay)
+
+    def throttled(self) -> bool:
+        """
+        Whether to throttle the next batch.
+        """
+        with self.lock:
+            return self.random.random() < self.throttle_rate
+
+    def count(self, status: int):
+        """
+        Counts an answered analysis by status code.
+        """
+        with self.lock:
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def get_jwk(self) -> Dict[str, Any]:
+        """
+        The public signing key, as a JSON web key.
+        """
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.private_key.public_key()))
+        jwk.update({"kid": MOCK_KEY_ID, "use": "sig", "alg": "RS256"})
+        return jwk
+
+    def issue_token(self, issuer: str) -> str:
+        """
+        Signs an id token for a mock user, as Auth0 would.
+        """
+        now = int(time.time())
+        payload = {
+            "iss": issuer,
+            "sub": "mock|user",
+            "aud": AUTH0_CLIENT_ID,
+            "iat": now,
+            "exp": now + 86400,
+            "name": "Mock User",
+        }
+        return jwt.encode(
+            payload, self.private_key, algorithm="RS256", headers={"kid": MOCK_KEY_ID})
@@ -0,0 +1,254 @@
+"""
+persisted graph of the local imports between the modules of a project
+"""
+import ast
+import hashlib
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, Optional, Set
+
+import appdirs
+
+from .source_manipulation import \
+    get_bound_names, \
+    get_local_import_bindings, \
+    get_referenced_names
+from .storage import FileLock, atomic_write
+
+GRAPH_FORMAT_VERSION = 1
+
+# Recorded as the modification time of modules which do not exist (mtimes
+# of None are for modules which have not been looked at yet)
+MISSING = -1.0
+
+def get_module_graph_path(root: str) -> str:
+    """
+    Determines where to persist the module graph of the project at root.
+    """
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    root_hash = hashlib.sha256(os.path.abspath(root).encode("utf-8")).hexdigest()
+    return os.path.join(app_dirs.user_cache_dir, "graphs", root_hash[:16] + ".json")
+
+class ModuleGraph:
+    """
+    The local import graph of a project.  Modules get compact integer ids
+    (their paths are interned once), and both forward (imports) and reverse
+    (imported by) adjacency are kept, so the set of modules and functions a
+    change impacts can be looked up without rebuilding anything.  Each
+    module's edges are only recomputed when its modification time changes.
+    """
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.paths: List[str] = []
+        self.ids: Dict[str, int] = {}
+        self.mtimes: List[Optional[float]] = []
+        self.forward: List[Set[int]] = []
+        self.reverse: List[Set[int]] = []
+        # For each module, which local modules each of its functions uses
+        self.function_deps: List[Dict[str, Set[int]]] = []
+
+    def intern(self, path: str) -> int:
+        """
+        Returns the id of the module at path, allocating one if it is new.
+        """
+        path = sys.intern(os.path.normpath(os.path.abspath(path)))
+        module_id = self.ids.get(path)
+        if module_id is None:
+            module_id = len(self.paths)
+            self.ids[path] = module_id
+            self.paths.append(path)
+            self.mtimes.append(None)
+            self.forward.append(set())
+            self.reverse.append(set())
+            self.function_deps.append({})
+        return module_id
+
+    def set_imports(self, module_id: int, imported_ids: Set[int]):
+        """
+        Replaces the forward edges of module_id, keeping reverse edges in sync.
+        """
+        for old in self.forward[module_id] - imported_ids:
+            self.reverse[old].discard(module_id)
+        for new in imported_ids - self.forward[module_id]:
+            self.reverse[new].add(module_id)
+        self.forward[module_id] = set(imported_ids)
+
+    def update_file(self, path: str) -> bool:
+        """
+        Recomputes the edges of the module at path if it changed on disk (or
+        disappeared).  Returns whether anything was recomputed.
+        """
+        module_id = self.intern(path)
+        path = self.paths[module_id]
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            mtime = MISSING
+        if mtime == self.mtimes[module_id]:
+            return False
+        self.mtimes[module_id] = mtime
+        tree = None
+        if mtime != MISSING:
+            try:
+                #pylint:disable=unspecified-encoding
+                with open(path, "r") as fr:
+                    tree = ast.parse(fr.read())
+            except (OSError, SyntaxError, ValueError):
+                tree = None
+        if tree is None:
+            self.set_imports(module_id, set())
+            self.function_deps[module_id] = {}
+            return True
+
+        name_sources: Dict[str, Set[int]] = {}
+        for local_path, names in get_local_import_bindings(tree, path).items():
+            local_id = self.intern(local_path)
+            for name in names:
+                name_sources.setdefault(name, set()).add(local_id)
+        self.set_imports(module_id, {
+            module for modules in name_sources.values() for module in modules})
+        function_deps = {}
+        for node in tree.body:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) or \
+                (isinstance(node, ast.Assign) and isinstance(node.value, ast.Lambda)):
+
+                deps = set()
+                for name in get_referenced_names(node):
+                    deps |= name_sources.get(name, set())
+                for name in get_bound_names(node):
+                    function_deps[name] = deps
+        self.function_deps[module_id] = function_deps
+        return True
+
+    def refresh(self, python_files: Iterable[str]) -> Set[str]:
+        """
+        Brings the graph up to date with python_files (the project's modules),
+        re-reading only modified files.  Modules which were deleted lose their
+        edges.  Returns the paths that were recomputed.
+        """
+        for path in python_files:
+            self.intern(path)
+        changed = set()
+        module_id = 0
+        # update_file may intern newly imported modules, which get visited too
+        while module_id < len(self.paths):
+            if self.update_file(self.paths[module_id]):
+                changed.add(self.paths[module_id])
+            module_id += 1
+        return changed
+
+    def dependents(self, path: str) -> Set[str]:
+        """
+        The modules which import path, directly or transitively, plus path
+        itself.
+        """
+        start = self.intern(path)
+        seen = {start}
+        worklist = [start]
+        while worklist:
+            for importer in self.reverse[worklist.pop()]:
+                if importer not in seen:
+                    seen.add(importer)
+                    worklist.append(importer)
+        return {self.paths[module_id] for module_id in seen}
+
+    def impacted_functions(self, path: str) -> Dict[str, List[str]]:
+        """
+        The functions which use something from path, directly or through a
+        chain of local imports, keyed by the file defining them.  Every
+        function of path itself is included.
+        """
+        impacted_ids = {self.ids[p] for p in self.dependents(path)}
+        path_id = self.intern(path)
+        result = {}
+        for module_id in sorted(impacted_ids):
+            names = sorted(
+                name for name, deps in self.function_deps[module_id].items()
+                if module_id == path_id or deps & impacted_ids)
+            if names:
+                result[self.paths[module_id]] = names
+        return result
+
+    def to_json(self) -> Dict:
+        """
+        The graph as a JSON-serializable dict, with paths relative to root.
+        """
+        return {
+            "version": GRAPH_FORMAT_VERSION,
+            "root": self.root,
+            "paths": [os.path.relpath(path, self.root) for path in self.paths],
+            "mtimes": self.mtimes,
+            "imports": [sorted(edges) for edges in self.forward],
+            "functions": [
+                {name: sorted(deps) for name, deps in sorted(function_deps.items())}
+                for function_deps in self.function_deps
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict) -> "ModuleGraph":
+        """
+        Rebuilds a graph saved with to_json.  Raises ValueError for data
+        written by an incompatible version.
+        """
+        if data.get("version") != GRAPH_FORMAT_VERSION:
+            raise ValueError("Unsupported module graph version")
+        graph = cls(data["root"])
+        for path in data["paths"]:
+            graph.intern(os.path.join(graph.root, path))
+        graph.mtimes = list(data["mtimes"])
+        for module_id, edges in enumerate(data["imports"]):
+            graph.set_imports(module_id, set(edges))
+        graph.function_deps = [
+            {name: set(deps) for name, deps in function_deps.items()}
+            for function_deps in data["functions"]
+        ]
+        return graph
+
+    def to_dot(self) -> str:
+        """
+        The graph in Graphviz DOT format (edges point from importer to
+        imported module).
+        """
+        lines = ["digraph modules {"]
+        for module_id, path in enumerate(self.paths):
+            label = os.path.relpath(path, self.root).replace('"', '\\"')
+            lines.append(f'    m{module_id} [label="{label}"];')
+        for module_id, edges in enumerate(self.forward):
+            for imported in sorted(edges):
+                lines.append(f"    m{module_id} -> m{imported};")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, graph_path: Optional[str] = None):
+        """
+        Persists the graph (by default, to get_module_graph_path(root)).
+        """
+        graph_path = graph_path or get_module_graph_path(self.root)
+        os.makedirs(os.path.dirname(graph_path), exist_ok=True)
+        atomic_write(graph_path, json.dumps(self.to_json()).encode("utf-8"))
+
+def load_module_graph(
+    root: str,
+    python_files: Iterable[str],
+    graph_path: Optional[str] = None) -> ModuleGraph:
+    """
+    Loads the persisted graph of the project at root (if any), brings it up
+    to date with python_files, and persists it again if anything changed.
+    Concurrent processes take turns, so that only the first one to find the
+    graph out of date rebuilds it, and the others load its result.
+    """
+    graph_path = graph_path or get_module_graph_path(root)
+    with FileLock(graph_path + ".lock"):
+        graph = None
+        try:
+            with open(graph_path, "r", encoding="utf-8") as fr:
+                graph = ModuleGraph.from_json(json.load(fr))
+        except (OSError, ValueError, KeyError, TypeError):
+            graph = None
+        if graph is None or graph.root != os.path.abspath(root):
+            graph = ModuleGraph(root)
+        if graph.refresh(python_files):
+            graph.save(graph_path)
+    return graph
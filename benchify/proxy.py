@@ -0,0 +1,212 @@
+"""
+local proxy that collapses identical /analyze requests from many processes
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from .client import AWS_URL
+from .latency import MAX_TIMEOUT
+
+DEFAULT_PROXY_PORT = 9092
+
+# Headers worth passing back from the upstream response (Retry-After so
+# that clients back off as long as the upstream asked them to)
+FORWARDED_HEADERS = ["Content-Type", "Retry-After"]
+
+#pylint:disable=too-few-public-methods
+class ProxyResponse:
+    """
+    A response from the upstream (or made up by the proxy when the upstream
+    could not be reached).
+    """
+    def __init__(self, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+#pylint:disable=too-few-public-methods
+class InFlight:
+    """
+    An upstream request which other callers with the same key can wait on.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[ProxyResponse] = None
+
+#pylint:disable=too-many-instance-attributes
+class AnalysisProxy:
+    """
+    Forwards /analyze requests upstream.  Byte-identical requests (same body
+    and same Authorization header) which arrive while one is already in
+    flight wait for that one's response instead of being sent again, and
+    successful responses are cached for cache_ttl seconds.  At most
+    max_upstream requests are sent upstream at once.  The upstream is given
+    timeout seconds to answer, by default as long as any client waits.
+    """
+    def __init__(
+        self,
+        upstream: str = AWS_URL,
+        max_upstream: int = 8,
+        cache_size: int = 1024,
+        cache_ttl: float = 3600.0,
+        timeout: float = MAX_TIMEOUT):
+        self.upstream = upstream
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.upstream_slots = threading.BoundedSemaphore(max_upstream)
+        self.lock = threading.Lock()
+        self.in_flight: Dict[str, InFlight] = {}
+        self.cache: "OrderedDict[str, Tuple[float, ProxyResponse]]" = OrderedDict()
+        self.stats = {"upstream": 0, "cache_hits": 0, "coalesced": 0}
+
+    @staticmethod
+    def get_key(body: bytes, authorization: str) -> str:
+        """
+        Identifies a request.  The Authorization header is part of the key so
+        that responses are never shared between users.
+        """
+        digest = hashlib.sha256(authorization.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(body)
+        return digest.hexdigest()
+
+    def get_cached(self, key: str) -> Optional[ProxyResponse]:
+        """
+        Looks up a response in the cache, dropping it if it has expired.
+        """
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            stored_at, response = entry
+            if time.monotonic() - stored_at > self.cache_ttl:
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return response
+
+    def store(self, key: str, response: ProxyResponse):
+        """
+        Caches a response, evicting the least recently used ones beyond
+        cache_size.
+        """
+        with self.lock:
+            self.cache[key] = (time.monotonic(), response)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def send_upstream(self, body: bytes, authorization: str) -> ProxyResponse:
+        """
+        Sends one request upstream, waiting for a free slot first.
+        """
+        headers = {"Content-Type": "application/json"}
+        if authorization:
+            headers["Authorization"] = authorization
+        with self.upstream_slots:
+            with self.lock:
+                self.stats["upstream"] += 1
+            try:
+                response = self.session.post(
+                    self.upstream, data=body, headers=headers, timeout=self.timeout)
+            except requests.exceptions.Timeout:
+                return ProxyResponse(504, b"Upstream timed out")
+            except requests.exceptions.RequestException as e:
+                return ProxyResponse(502, f"Upstream unreachable: {e}".encode("utf-8"))
+        return ProxyResponse(
+            response.status_code,
+            response.content,
+            {name: response.headers[name]
+             for name in FORWARDED_HEADERS if name in response.headers})
+
+    def forward(self, body: bytes, authorization: str = "") -> Tuple[ProxyResponse, str]:
+        """
+        Answers one request, from the cache, by waiting for an identical
+        in-flight request, or by sending it upstream.
+
+        Returns:
+            (response, how), with how one of "hit", "coalesced" or "miss".
+        """
+        key = self.get_key(body, authorization)
+        cached = self.get_cached(key)
+        if cached is not None:
+            with self.lock:
+                self.stats["cache_hits"] += 1
+            return cached, "hit"
+
+        with self.lock:
+            in_flight = self.in_flight.get(key)
+            leader = in_flight is None
+            if leader:
+                in_flight = InFlight()
+                self.in_flight[key] = in_flight
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            in_flight.done.wait()
+            return in_flight.response, "coalesced"
+
+        # Waiters get this if sending upstream raises unexpectedly
+        response = ProxyResponse(502, b"Proxy error")
+        try:
+            response = self.send_upstream(body, authorization)
+            if response.status < 400:
+                self.store(key, response)
+        finally:
+            in_flight.response = response
+            with self.lock:
+                del self.in_flight[key]
+            in_flight.done.set()
+        return response, "miss"
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """
+    Serves POST /analyze through the server's AnalysisProxy.
+    """
+    server: "ProxyServer"
+
+    #pylint:disable=invalid-name
+    def do_POST(self):
+        if self.path.rstrip("/") != "/analyze":
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        response, how = self.server.proxy.forward(
+            body, self.headers.get("Authorization", ""))
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
+        self.send_header("X-Benchify-Proxy", how)
+        self.end_headers()
+        self.wfile.write(response.body)
+
+    def log_message(self, *args):
+        pass
+
+class ProxyServer(ThreadingHTTPServer):
+    """
+    An HTTP server answering each connection on its own thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], proxy: AnalysisProxy):
+        super().__init__(address, ProxyHandler)
+        self.proxy = proxy
+
+def make_proxy_server(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PROXY_PORT,
+    proxy: Optional[AnalysisProxy] = None) -> ProxyServer:
+    """
+    Creates (but does not start) a proxy server listening on host:port.
+    """
+    return ProxyServer((host, port), proxy or AnalysisProxy())
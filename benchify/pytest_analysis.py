@@ -0,0 +1,241 @@
+"""
+the --benchify session of the pytest plugin (see pytest_plugin), which
+analyzes the functions the selected tests exercise
+"""
+import inspect
+import json
+import os
+import shutil
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Set, Tuple
+
+import appdirs
+import pytest
+
+from .client import AnalysisError, AnalysisResult, BenchifyClient
+from .fingerprint import fingerprint_params
+from .latency import LatencyStore
+from .storage import atomic_write
+
+def get_default_cache_dir() -> str:
+    """
+    Where analysis results are kept between test runs (and shared between
+    the pytest-xdist workers of one run).
+    """
+    app_dirs = appdirs.AppDirs("benchify", "benchify")
+    return os.path.join(app_dirs.user_cache_dir, "pytest")
+
+def is_test_file(path: str) -> bool:
+    """
+    Whether path holds tests (or fixtures) rather than code under test.
+    """
+    name = os.path.basename(path)
+    return name.startswith("test_") or name.endswith("_test.py") or name == "conftest.py"
+
+def claim(path: str) -> bool:
+    """
+    Atomically creates the file at path, returning False if it already
+    exists, so that of several processes claiming the same path exactly one
+    succeeds, without any lock.
+    """
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+    except FileExistsError:
+        return False
+    return True
+
+def write_result(path: str, result: AnalysisResult):
+    """
+    Writes result to path, so that readers only ever see a complete file.
+    """
+    atomic_write(path, json.dumps(result.to_json()).encode("utf-8"))
+
+def read_result(path: str) -> Optional[AnalysisResult]:
+    """
+    Reads a result written by write_result, or returns None if there is none.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as fr:
+            return AnalysisResult.from_json(json.load(fr))
+    except (OSError, ValueError):
+        return None
+
+def get_marker_targets(item: pytest.Item) -> List[Tuple[str, str]]:
+    """
+    The (file, name) functions a test asks for with
+    @pytest.mark.benchify(function, "path/to/file.py::name", ...).
+    """
+    targets = []
+    for marker in item.iter_markers("benchify"):
+        for target in marker.args:
+            if isinstance(target, str):
+                file, _, name = target.rpartition("::")
+                targets.append((str(item.config.rootpath / file), name))
+            else:
+                target = inspect.unwrap(target)
+                targets.append((inspect.getsourcefile(target), target.__name__))
+    return targets
+
+class BenchifyPlugin:
+    """
+    Records which functions of the project each test calls (plus those its
+    benchify markers name), then analyzes them when the session ends.
+
+    Under pytest-xdist each worker analyzes what its own tests exercised.
+    Results are kept in a cache directory shared by all workers (and runs),
+    keyed by the request's fingerprint, and a worker only submits a request
+    after claiming it with an exclusively created claim file, so that a
+    function exercised on several workers is analyzed once.  The controller
+    then reports every worker's results.
+    """
+    def __init__(self, config: pytest.Config):
+        self.config = config
+        self.patch = config.getoption("benchify_patch")
+        self.cache_dir = config.getoption("benchify_cache_dir") or get_default_cache_dir()
+        self.is_worker = hasattr(config, "workerinput")
+        if self.is_worker:
+            self.run_id = config.workerinput["benchify_run_id"]
+        else:
+            self.run_id = uuid.uuid4().hex
+        self.client: Optional[BenchifyClient] = None
+        self.called: Set[Any] = set()
+        self.marked: Set[Tuple[str, str]] = set()
+        # [file, name, key] of each analyzed function, from every worker
+        self.targets: List[List[str]] = []
+
+    def get_client(self) -> BenchifyClient:
+        """
+        The client shared by the session's analyses.
+        """
+        if self.client is None:
+            self.client = BenchifyClient(latency_store=LatencyStore())
+        return self.client
+
+    def get_result_path(self, key: str) -> str:
+        """
+        Where the result of the request with hash key is cached.
+        """
+        return os.path.join(self.cache_dir, "results", f"{key}.json")
+
+    def get_claim_path(self, key: str) -> str:
+        """
+        The file claiming the request with hash key for this run.
+        """
+        return os.path.join(self.cache_dir, "claims", self.run_id, key)
+
+    def pytest_sessionstart(self, session: pytest.Session):
+        #pylint:disable=unused-argument
+        os.makedirs(os.path.join(self.cache_dir, "results"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "claims", self.run_id), exist_ok=True)
+        if not self.is_worker:
+            # Log in here, since workers cannot ask the user anything
+            self.get_client().get_auth_tokens()
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        node.workerinput["benchify_run_id"] = self.run_id
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        #pylint:disable=unused-argument
+        self.targets.extend(getattr(node, "workeroutput", {}).get("benchify_targets", []))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item: pytest.Item):
+        self.marked.update(get_marker_targets(item))
+        called = self.called
+
+        def profile(frame, event, _arg):
+            if event == "call":
+                called.add(frame.f_code)
+
+        previous = sys.getprofile()
+        sys.setprofile(profile)
+        try:
+            yield
+        finally:
+            sys.setprofile(previous)
+
+    def get_targets(self) -> List[Tuple[str, str]]:
+        """
+        The (file, name) top-level functions of the project which the tests
+        called or marked, excluding test files and installed packages.
+        """
+        root = str(self.config.rootpath)
+        index = self.get_client().index
+        targets = set(self.marked)
+        for code in self.called:
+            file = os.path.abspath(code.co_filename)
+            if not file.startswith(root + os.sep) or is_test_file(file) or \
+                "site-packages" in file.split(os.sep):
+
+                continue
+            try:
+                module = index.get(file)
+            except (OSError, SyntaxError, UnicodeDecodeError):
+                continue
+            span = module.function_spans.get(code.co_name) if module else None
+            if span is not None and span[0] <= code.co_firstlineno <= span[1]:
+                targets.add((file, code.co_name))
+        return sorted(targets)
+
+    def analyze(self, file: str, name: str) -> Optional[List[str]]:
+        """
+        Analyzes one function unless its result is cached or another worker
+        claimed it, returning [file, name, key] (or None if the function
+        cannot be found).
+        """
+        client = self.get_client()
+        try:
+            name, function_str = client.select_function(file, name)
+        except (OSError, SyntaxError, AnalysisError):
+            return None
+        params = client.build_params(file, function_str, self.patch, name)
+        key = fingerprint_params(params)
+        result_path = self.get_result_path(key)
+        cached = read_result(result_path)
+        if (cached is None or cached.status != "ok") and claim(self.get_claim_path(key)):
+            write_result(result_path, client.submit(file, name, params))
+        return [file, name, key]
+
+    def pytest_sessionfinish(self, session: pytest.Session):
+        #pylint:disable=unused-argument
+        targets = self.get_targets()
+        if targets:
+            with ThreadPoolExecutor(max_workers=self.get_client().max_workers) as executor:
+                analyzed = executor.map(lambda target: self.analyze(*target), targets)
+                self.targets.extend(target for target in analyzed if target is not None)
+        if self.is_worker:
+            self.config.workeroutput["benchify_targets"] = self.targets
+        else:
+            # Every worker is done with this run's claims by now
+            shutil.rmtree(os.path.join(self.cache_dir, "claims", self.run_id), ignore_errors=True)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.is_worker:
+            return
+        terminalreporter.section("benchify")
+        if not self.targets:
+            terminalreporter.write_line("No functions of the project were exercised.")
+            return
+        seen = set()
+        for file, name, key in sorted(self.targets):
+            if key in seen:
+                continue
+            seen.add(key)
+            label = f"{os.path.relpath(file, self.config.rootpath)}::{name}"
+            result = read_result(self.get_result_path(key))
+            if result is None:
+                terminalreporter.write_line(f"{label}: no result (its worker may have crashed)")
+            elif result.status != "ok":
+                terminalreporter.write_line(f"{label}: {result.error}", red=True)
+            elif result.found_problems:
+                failed = [prop["name"] for prop in result.properties if not prop["passed"]]
+                terminalreporter.write_line(f"{label}: ❌ {', '.join(failed)}", red=True)
+                if result.patch is not None:
+                    terminalreporter.write_line(result.patch)
+            else:
+                terminalreporter.write_line(
+                    f"{label}: ✅ {len(result.properties)} properties hold", green=True)
@@ -0,0 +1,29 @@
+"""
+pytest plugin analyzing the functions the selected tests exercise
+
+pytest loads this module in every run (through its pytest11 entry point),
+so it only declares the options; the client is imported with --benchify.
+"""
+#pylint:disable=import-outside-toplevel
+import pytest
+
+def pytest_addoption(parser: pytest.Parser):
+    group = parser.getgroup("benchify")
+    group.addoption(
+        "--benchify", action="store_true", default=False,
+        help="Analyze the functions exercised by the selected tests with Benchify.")
+    group.addoption(
+        "--benchify-patch", action="store_true", default=False,
+        help="Ask for patches to the functions whose analysis finds problems.")
+    group.addoption(
+        "--benchify-cache-dir", default=None,
+        help="Where to keep analysis results between runs.")
+
+def pytest_configure(config: pytest.Config):
+    config.addinivalue_line(
+        "markers",
+        "benchify(*functions): with --benchify, also analyze these functions " + \
+        "(or 'file.py::name' strings).")
+    if config.getoption("benchify"):
+        from .pytest_analysis import BenchifyPlugin
+        config.pluginmanager.register(BenchifyPlugin(config), "benchify-session")
@@ -0,0 +1,156 @@
+"""
+outcomes of analyses, and the errors choosing what to analyze
+"""
+from typing import Any, Dict, List, Optional
+
+def get_code_blocks(text: str) -> List[str]:
+    """
+    The contents of the ```python code blocks of a report.
+    """
+    code_blocks = []
+    code_block = None
+    for line in text.split("\n"):
+        if line.strip() == "```python" and code_block is None:
+            code_block = []
+        elif line.strip() == "```" and code_block is not None:
+            code_blocks.append("\n".join(code_block))
+            code_block = None
+        elif code_block is not None:
+            code_block.append(line)
+    return code_blocks
+
+def get_properties(text: str) -> List[Dict[str, Any]]:
+    """
+    The properties a report lists, outside of its code blocks, as passed
+    (✅) or failed (❌).
+
+    Returns:
+        [{"name": ..., "passed": ...}, ...] in the order of the report.
+    """
+    properties = []
+    in_code_block = False
+    for line in text.split("\n"):
+        if line.strip() in ["```python", "```"]:
+            in_code_block = line.strip() == "```python"
+            continue
+        if in_code_block or ("✅" not in line and "❌" not in line):
+            continue
+        name = line.replace("✅", "").replace("❌", "").strip(" \t-*:")
+        properties.append({"name": name, "passed": "❌" not in line})
+    return properties
+
+class AnalysisError(Exception):
+    """
+    Raised when the function to analyze cannot be determined.
+    """
+
+class AmbiguousFunctionError(AnalysisError):
+    """
+    Raised when a file has several functions and none was chosen.
+    """
+    def __init__(self, file: str, function_names: List[str]):
+        super().__init__(
+            f"Since there is more than one function in {file}, please " + \
+            "specify which one you want to analyze.")
+        self.file = file
+        self.function_names = function_names
+
+#pylint:disable=too-few-public-methods
+#pylint:disable=too-many-instance-attributes
+class AnalysisResult:
+    """
+    The outcome of analyzing one function.  status is "ok" when the server
+    answered (see text for its report), and "timeout" or "error" otherwise
+    (see error).
+    """
+    def __init__(
+        self,
+        file: str,
+        function: Optional[str],
+        status: str,
+        text: str = "",
+        error: Optional[str] = None,
+        status_code: Optional[int] = None,
+        duration: float = 0.0,
+        cache_hit: bool = False,
+        patch_requested: bool = False,
+        prepare_duration: float = 0.0):
+        self.file = file
+        self.function = function
+        self.status = status
+        self.text = text
+        self.error = error
+        self.status_code = status_code
+        self.duration = duration
+        self.cache_hit = cache_hit
+        self.patch_requested = patch_requested
+        self.prepare_duration = prepare_duration
+
+    @property
+    def found_problems(self) -> bool:
+        """
+        Whether the analysis reported a failing property.
+        """
+        return "❌" in self.text
+
+    @property
+    def properties(self) -> List[Dict[str, Any]]:
+        """
+        The properties the report says were checked (see get_properties).
+        """
+        return get_properties(self.text)
+
+    @property
+    def patch(self) -> Optional[str]:
+        """
+        The suggested patch (the report's last python code block), if one was
+        requested.
+        """
+        code_blocks = get_code_blocks(self.text)
+        if not self.patch_requested or not code_blocks:
+            return None
+        return code_blocks[-1]
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        A structured summary of the result, e.g. for `--format jsonl`.
+        """
+        return {
+            "file": self.file,
+            "function": self.function,
+            "status": self.status,
+            "found_problems": self.found_problems,
+            "properties": self.properties,
+            "patch": self.patch,
+            "timings": {
+                "prepare": round(self.prepare_duration, 3),
+                "request": round(self.duration, 3),
+            },
+            "cache_hit": self.cache_hit,
+            "status_code": self.status_code,
+            "error": self.error,
+        }
+
+    def to_json(self) -> Dict[str, Any]:
+        """
+        The result as a JSON-serializable dict.
+        """
+        return {
+            "file": self.file,
+            "function": self.function,
+            "status": self.status,
+            "text": self.text,
+            "error": self.error,
+            "status_code": self.status_code,
+            "duration": self.duration,
+            "cache_hit": self.cache_hit,
+            "patch_requested": self.patch_requested,
+            "prepare_duration": self.prepare_duration,
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "AnalysisResult":
+        """
+        Rebuilds a result serialized with to_json.
+        """
+        return cls(**data)
@@ -0,0 +1,215 @@
+"""
+paces /analyze submissions to stay within the server's quota
+"""
+import email.utils
+import threading
+import time
+from typing import Callable, Optional
+
+import requests
+
+# Statuses which mean "slow down and try again later"
+THROTTLED_STATUSES = [429, 503]
+
+class BudgetExhaustedError(Exception):
+    """
+    Raised instead of sending a request which could only start after its
+    deadline (e.g. that of a --budget run).
+    """
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Parses a Retry-After header (either a number of seconds or an HTTP date)
+    into a number of seconds to wait, or None if it is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, retry_at.timestamp() - now)
+
+class TokenBucket:
+    """
+    Lets through at most rate requests per second on average, and at most
+    burst at once.  A rate of None means no limit (until the server asks us
+    to pause).
+    """
+    def __init__(self, rate: Optional[float] = None, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Lets nothing through for the next seconds (e.g. after a 429).
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        Waits until a request may be sent, and takes its token.  Given a
+        time.monotonic() deadline, gives up (returning False) without
+        waiting past it if the request could only be sent afterwards.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return True
+                    self.tokens = min(
+                        self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        return True
+                    wait = (1.0 - self.tokens) / self.rate
+                if deadline is not None and now + wait >= deadline:
+                    return False
+            time.sleep(wait)
+
+#pylint:disable=too-many-instance-attributes
+class AdaptiveLimiter:
+    """
+    Caps the number of requests in flight, adapting the cap AIMD-style:
+    each success adds about one slot per round of requests, while a
+    throttled, failed or unusually slow request halves it (at most once per
+    cooldown, so that a burst of failures only counts once).
+    """
+    def __init__(
+        self,
+        initial: float = 4.0,
+        minimum: float = 1.0,
+        maximum: float = 32.0,
+        slow_factor: float = 2.0,
+        cooldown: float = 1.0):
+        self.limit = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.slow_factor = slow_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.last_decrease = float("-inf")
+        self.condition = threading.Condition()
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        Waits for a free slot and takes it.  Given a time.monotonic()
+        deadline, gives up (returning False) if none is free by then.
+        """
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, congested: bool):
+        """
+        Frees a slot, adapting the limit to how the request went.
+
+        Args:
+            latency (float): How long the request took, in seconds.
+            congested (bool): Whether the request was throttled, failed on
+                the server's side or timed out.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            slow = self.baseline is not None and \
+                latency > self.slow_factor * self.baseline
+            if congested or slow:
+                now = time.monotonic()
+                if now - self.last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if not congested:
+                # Track typical latency with an exponentially weighted average
+                self.baseline = latency if self.baseline is None else \
+                    0.9 * self.baseline + 0.1 * latency
+            self.condition.notify_all()
+
+class SubmissionScheduler:
+    """
+    Sends requests through a shared TokenBucket and AdaptiveLimiter, so that
+    all the threads submitting through one client share its budget.
+    Throttled requests are retried after the server's Retry-After (or an
+    exponential backoff), pausing every other submission meanwhile.  None
+    of this waits past a request's deadline.
+    """
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        burst: float = 4.0,
+        max_concurrency: int = 4,
+        max_retries: int = 5,
+        backoff: float = 1.0):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(
+            initial=max_concurrency, maximum=max(max_concurrency, 1) * 4)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def call(
+        self,
+        send: Callable[[], requests.Response],
+        deadline: Optional[float] = None) -> requests.Response:
+        """
+        Sends a request (by calling send) once the budget allows it,
+        retrying while the server says it is throttled.  Returns the last
+        response; exceptions raised by send are passed on.
+
+        Raises:
+            BudgetExhaustedError: If, given a time.monotonic() deadline, the
+                next attempt could only start after it.
+        """
+        attempt = 0
+        while True:
+            if not self.bucket.acquire(deadline) or not self.limiter.acquire(deadline):
+                raise BudgetExhaustedError("Budget exhausted before the request could be sent")
+            start = time.monotonic()
+            congested = True
+            try:
+                response = send()
+                congested = response.status_code in THROTTLED_STATUSES or \
+                    response.status_code >= 500
+            finally:
+                self.limiter.release(time.monotonic() - start, congested)
+            if response.status_code not in THROTTLED_STATUSES or \
+                attempt >= self.max_retries:
+
+                return response
+            delay = parse_retry_after(response.headers.get("Retry-After"))
+            if delay is None:
+                if response.status_code != 429:
+                    # A 503 without Retry-After is a plain server error
+                    return response
+                delay = self.backoff * 2 ** attempt
+            self.bucket.pause(delay)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise BudgetExhaustedError(
+                    f"Budget exhausted: the server asked to retry in {delay:.0f}s")
+            attempt += 1
@@ -0,0 +1,113 @@
+"""
+splits analysis work across CI nodes, and merges their reports
+"""
+import heapq
+import json
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+from .latency import get_request_features
+
+SHARD = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+
+# Predicted cost, in arbitrary units, of each feature of a request
+FUNCTION_LINE_COST = 1.0
+CODE_BYTE_COST = 1.0 / 40
+PIP_IMPORT_COST = 20.0
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    Parses a shard such as "2/4" (the second of four, counting from 1) into
+    (index, count).
+
+    Raises:
+        ValueError: If text is not a shard.
+    """
+    match = SHARD.match(text)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"Not a shard: {text!r} (try e.g. 1/4)")
+    return int(match.group(1)), int(match.group(2))
+
+def predict_cost(params: Dict[str, Any]) -> float:
+    """
+    The predicted cost of an /analyze request, from the size of its function,
+    of the code it depends on, and of its environment.  It only depends on
+    the request, so that every node of a CI run predicts the same costs.
+    """
+    features = get_request_features(params)
+    return 1 + FUNCTION_LINE_COST * features["function_lines"] + \
+        CODE_BYTE_COST * features["test_code_bytes"] + \
+        PIP_IMPORT_COST * features["pip_imports"]
+
+def assign_shards(costs: Dict[str, float], count: int) -> Dict[str, int]:
+    """
+    Spreads the keyed costs over count shards so that their total costs are
+    balanced: the most costly first, each onto the shard with the least
+    total cost so far (the LPT heuristic).  Ties are broken by key and by
+    shard index, so that the assignment only depends on costs.
+
+    Returns:
+        Dict[str, int]: Maps each key to its shard, counting from 1.
+    """
+    loads = [(0.0, shard) for shard in range(1, count + 1)]
+    assignment = {}
+    for key in sorted(costs, key=lambda key: (-costs[key], key)):
+        load, shard = heapq.heappop(loads)
+        assignment[key] = shard
+        heapq.heappush(loads, (load + costs[key], shard))
+    return assignment
+
+def shard_requests(
+    requests_to_send: List[Tuple[str, str, Dict[str, Any]]],
+    shard: Tuple[int, int],
+    root: str) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    The (file, name, params) requests which fall to shard (index, count).
+    Requests are identified by their file relative to root and their
+    function name, so that nodes with checkouts in different places agree.
+    """
+    index, count = shard
+    keys = [f"{os.path.relpath(file, root)}::{name}" for file, name, _ in requests_to_send]
+    assignment = assign_shards(
+        {key: predict_cost(params) for key, (_, _, params) in zip(keys, requests_to_send)},
+        count)
+    return [
+        request for key, request in zip(keys, requests_to_send) if assignment[key] == index
+    ]
+
+def read_report(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads the records of a `--format jsonl` run, or of a report written by
+    merge_reports (so that merged reports can be merged again).
+    """
+    with open(path, "r", encoding="utf-8") as fr:
+        text = fr.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data["records"] if "records" in data else [data]
+
+def merge_reports(reports: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Merges the records of several shards' runs into one report, with one
+    record per function (a finished analysis wins over an unfinished one)
+    sorted by file and function, and a count of records by status.
+    """
+    merged: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for records in reports:
+        for record in records:
+            key = (record["file"], record["function"])
+            if key not in merged or \
+                (merged[key]["status"] != "ok" and record["status"] == "ok"):
+
+                merged[key] = record
+    records = [merged[key] for key in sorted(merged)]
+    summary: Dict[str, int] = {"functions": len(records), "found_problems": 0}
+    for record in records:
+        summary[record["status"]] = summary.get(record["status"], 0) + 1
+        summary["found_problems"] += int(bool(record.get("found_problems")))
+    shards = sorted({record["shard"] for record in records if "shard" in record},
+        key=parse_shard)
+    return {"shards": shards, "summary": summary, "records": records}
@@ -0,0 +1,112 @@
+"""
+read-only access to a python file by line, without splitting it into lines
+"""
+import mmap
+import os
+import tokenize
+from array import array
+from typing import Optional
+
+def build_line_offsets(data) -> "array[int]":
+    """
+    The byte offset at which each line of data (bytes or an mmap) starts,
+    followed by len(data), so that line n (1-indexed) spans
+    offsets[n - 1]:offsets[n].
+    """
+    offsets = array("Q", [0])
+    position = data.find(b"\n")
+    while position != -1:
+        offsets.append(position + 1)
+        position = data.find(b"\n", position + 1)
+    if offsets[-1] != len(data):
+        offsets.append(len(data))
+    return offsets
+
+class SourceFile:
+    """
+    A python file mapped into memory, with the offset of each of its lines,
+    so that a span of lines can be decoded without reading (or splitting)
+    the rest of the file.  Lines end in "\\n" or "\\r\\n".  Keep it open only
+    briefly: the mapping breaks if the file is truncated meanwhile.
+
+    Args:
+        path (str): The file to map.
+        line_offsets (array): The file's line offsets from an earlier
+            SourceFile, reused if the file's size and modification time
+            (as os.path.getmtime gives it) are still those of that one.
+        mtime (float): The modification time line_offsets were built at.
+    """
+    def __init__(
+        self,
+        path: str,
+        line_offsets: Optional["array[int]"] = None,
+        mtime: Optional[float] = None):
+        self.path = path
+        #pylint:disable=consider-using-with
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        # Empty files cannot be mapped, but behave the same as empty bytes
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if self.size else b""
+        self.encoding = "utf-8"
+        if self.size:
+            self.encoding, _ = tokenize.detect_encoding(self.data.readline)
+            self.data.seek(0)
+        # An edit keeping the size (e.g. moving a line break) still moves
+        # offsets, so the modification time must match too
+        if line_offsets is None or line_offsets[-1] != self.size or mtime != self.mtime:
+            line_offsets = build_line_offsets(self.data)
+        self.line_offsets = line_offsets
+
+    def __enter__(self) -> "SourceFile":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Unmaps and closes the file.
+        """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    @property
+    def line_count(self) -> int:
+        """
+        The number of lines in the file.
+        """
+        return len(self.line_offsets) - 1
+
+    def get_lines(self, start_line: int, end_line: int) -> str:
+        """
+        Decodes lines start_line to end_line (1-indexed, inclusive), joined
+        by "\\n" and without the last line's line ending.
+        """
+        start_line = max(1, start_line)
+        end_line = min(end_line, self.line_count)
+        if start_line > end_line:
+            return ""
+        start = self.line_offsets[start_line - 1]
+        end = self.line_offsets[end_line]
+        if self.data[end - 1:end] == b"\n":
+            end -= 1
+            if self.data[end - 1:end] == b"\r":
+                end -= 1
+        return self.data[start:end].decode(self.encoding).replace("\r\n", "\n")
+
+    def find(self, text: str, start: int = 0) -> int:
+        """
+        The byte offset of the first occurrence of text at or after start,
+        or -1.
+        """
+        return self.data.find(text.encode(self.encoding), start)
+
+    def text(self) -> str:
+        """
+        Decodes the whole file.
+        """
+        return str(self.data, self.encoding)
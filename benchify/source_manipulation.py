@@ -1,13 +1,14 @@
 """
 manipulation of the python file
 """
-import ast, astunparse, os, subprocess, sys, pytest, re, tokenize, io
-from typing import List, Optional, Set, Dict, Union, Tuple, Any
+import ast, astunparse, bisect, os, subprocess, sys, re, tokenize, io
+from typing import List, Optional, Set, Dict, Union, Tuple, Any, Iterator
 from stdlib_list import stdlib_list
-from pkg_resources import working_set
-import importlib.util
 import requests
 
+from .environment import is_installed_module
+from .source_file import SourceFile
+
 def replace_block_comments(code):
     def replacement(match):
         content = match.group(1).strip()
@@ -17,38 +18,56 @@ def replace_block_comments(code):
     pattern = r'"""((?:.|\n)*?)"""'
     return re.sub(pattern, replacement, code, flags=re.DOTALL)
 
+# Whether each name asked about so far is a PyPI project, shared by import
+# classification and pip import resolution so each name is looked up once
+PYPI_PROJECTS: Dict[str, bool] = {}
+
 def can_import_via_pip(module_name: str) -> bool:
+    if module_name in PYPI_PROJECTS:
+        return PYPI_PROJECTS[module_name]
     response = requests.get(f'https://pypi.org/pypi/{module_name}/json')
+    if response.status_code in [200, 404]:
+        # Other answers (e.g. a PyPI outage) are worth asking again
+        PYPI_PROJECTS[module_name] = response.status_code == 200
     return response.status_code == 200
 
-def get_function_source(ast_tree: ast.AST, function_name: str, code: str) -> Optional[str]:
+def get_source_lines(code: Union[str, SourceFile], start_line: int, end_line: int) -> str:
+    """
+    Lines start_line to end_line (1-indexed, inclusive) of code, joined by
+    newlines.  A SourceFile decodes just those lines.
+    """
+    if isinstance(code, SourceFile):
+        return code.get_lines(start_line, end_line)
+    return '\n'.join(code.splitlines()[start_line - 1:end_line])
+
+def get_function_source(
+    ast_tree: ast.AST,
+    function_name: str,
+    code: Union[str, SourceFile]) -> Optional[str]:
     """
     Pull out just this single function's source code.
 
     Args:
         ast_tree (ast.AST): The ast for the entire code string being analyzed.
         function_name (str): The name of the function we want to extract.
-        code (str): The actual code string which, when parsed with ast, yields ast_tree.
+        code (str | SourceFile): The actual code string which, when parsed
+            with ast, yields ast_tree, or the file it was read from.
 
     Returns:
         str: The string of the function being analyzed.
     """
     for node in ast.walk(ast_tree):
         if isinstance(node, ast.FunctionDef) and node.name == function_name:
-            start_line = node.lineno
-            end_line = node.end_lineno
-            function_source = '\n'.join(
-                code.splitlines()[start_line - 1:end_line])
-            return function_source
+            return get_source_lines(code, node.lineno, node.end_lineno)
         elif isinstance(node, ast.Lambda):
             # Handle lambdas by checking if the code matches the function_name
-            if function_name in code[node.col_offset:]:
+            if isinstance(code, SourceFile):
+                matches = code.find(function_name, node.col_offset) != -1
+            else:
+                matches = function_name in code[node.col_offset:]
+            if matches:
                 # Get the start and end line numbers of the lambda
-                start_line = node.lineno
-                end_line = node.end_lineno
-                function_source = '\n'.join(
-                    code.splitlines()[start_line - 1:end_line])
-                return function_source
+                return get_source_lines(code, node.lineno, node.end_lineno)
     # if the function was not found
     return None
 
@@ -89,7 +108,9 @@ def is_system_package(module_name: str) -> bool:
 
 def is_pip_installed_package(module_name: str) -> bool:
     """
-    Determines whether a given module name is pip-installable.
+    Determines whether a given module name is pip-installable, from the
+    files on sys.path and the installed distributions' metadata (see
+    is_installed_module), so that nothing is imported to find out.
 
     Args:
         module_name (str): The name of the module to check.
@@ -101,9 +122,7 @@ def is_pip_installed_package(module_name: str) -> bool:
         module_name = module_name.split(' as ')[0]
     if is_system_package(module_name):
         return False
-    if module_name in {pkg.key for pkg in working_set}:
-        return True
-    return importlib.util.find_spec(module_name) is not None
+    return is_installed_module(module_name)
 
 def find_local_module(module_name: str, file_path: str) -> Optional[str]:
     """
@@ -341,6 +360,17 @@ def get_top_level_lambda_function_names(ast_tree: ast.AST) -> List[str]:
                 lambda_function_names.append(node.targets[0].id)
     return lambda_function_names
 
+def get_top_level_function_names(ast_tree: ast.AST) -> List[str]:
+    """
+    Extracts all top-level function names (def'd or lambda'd) from the
+    provided AST tree.
+    """
+    function_names = []
+    for node in ast.iter_child_nodes(ast_tree):
+        if isinstance(node, ast.FunctionDef):
+            function_names.append(node.name)
+    return function_names + get_top_level_lambda_function_names(ast_tree)
+
 def get_all_function_names(code_str: str) -> List[str]:
     """
     Extracts all top-level function names from the provided AST tree.
@@ -352,12 +382,36 @@ def get_all_function_names(code_str: str) -> List[str]:
         List[str]: The list of top-level function names (def'd or lambda'd) in
         the code_str.
     """
-    ast_tree = ast.parse(code_str)
-    function_names = []
+    return get_top_level_function_names(ast.parse(code_str))
+
+def get_first_line(node: ast.stmt) -> int:
+    """
+    The first line of a statement, counting its decorators (if any).
+    """
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [dec.lineno for dec in decorators])
+
+def get_function_spans(ast_tree: ast.AST) -> Dict[str, Tuple[int, int]]:
+    """
+    Finds the line span of each top-level function (def'd or lambda'd).
+
+    Args:
+        ast_tree (ast.AST): The parsed file being studied.
+
+    Returns:
+        Dict[str, Tuple[int, int]]: Maps each function name to its first and
+        last line (1-indexed, inclusive), counting decorators as part of the
+        function.
+    """
+    spans = {}
     for node in ast.iter_child_nodes(ast_tree):
-        if isinstance(node, ast.FunctionDef):
-            function_names.append(node.name)
-    return function_names + get_top_level_lambda_function_names(ast_tree)
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            spans[node.name] = (get_first_line(node), node.end_lineno)
+        elif isinstance(node, ast.Assign) and isinstance(node.value, ast.Lambda) \
+            and isinstance(node.targets[0], ast.Name):
+
+            spans[node.targets[0].id] = (node.lineno, node.end_lineno)
+    return spans
 
 def classify(code: str, class_name: str) -> str:
     assert not " " in class_name
@@ -409,193 +463,745 @@ def get_indentation_level(line):
         # Assuming 4 spaces per indentation level
         return leading_spaces // 4, 'spaces'
 
-def remove_docstrings(code):
-    def remove_docstrings_node(node):
-        if isinstance(node, ast.Module):
-            # Remove module-level docstrings
-            if node.body and isinstance(node.body[0], ast.Expr) and \
-                isinstance(node.body[0].value, ast.Str):
+def is_string_statement(node: ast.AST) -> bool:
+    """
+    Whether node is a statement consisting of just a string literal, like a
+    docstring.
+    """
+    return isinstance(node, ast.Expr) and \
+        isinstance(node.value, ast.Constant) and \
+        isinstance(node.value.value, str)
 
-                node.body.pop(0)
-        
-        if isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)):
-            # Remove docstrings in functions and classes
-            if node.body and isinstance(node.body[0], ast.Expr) and \
-                isinstance(node.body[0].value, ast.Str):
+def strip_docstrings(tree: ast.Module) -> ast.Module:
+    """
+    Removes, in place, the docstrings of the module, of its classes and
+    functions, and any other top-level string literal.
+
+    Args:
+        tree (ast.Module): The parsed module (modified).
 
+    Returns:
+        ast.Module: tree.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)):
+            if node.body and is_string_statement(node.body[0]):
                 node.body.pop(0)
-        
-        # Recursively process all child nodes
-        for child in ast.iter_child_nodes(node):
-            remove_docstrings_node(child)
-        
-        return node
+    tree.body = [node for node in tree.body if not is_string_statement(node)]
+    return tree
 
-    tree = ast.parse(code)
-    tree = remove_docstrings_node(tree)
-    
-    # Remove any remaining top-level string literals (like in Test Case 1)
-    tree.body = [
-        node for node in tree.body \
-        if not (isinstance(node, ast.Expr) and \
-            isinstance(node.value, ast.Str))
+def remove_docstrings(code):
+    return ast.unparse(strip_docstrings(ast.parse(code)))
+
+# Nodes whose bodies run in a scope of their own
+SCOPE_NODES = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda,
+    ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+def iter_same_scope_nodes(node: ast.AST) -> Iterator[ast.AST]:
+    """
+    Yields node and every node nested in it, except those inside the nested
+    functions, classes, lambdas and comprehensions (which are yielded
+    themselves, but not descended into).
+    """
+    yield node
+    for child in ast.iter_child_nodes(node):
+        if isinstance(child, SCOPE_NODES):
+            yield child
+        else:
+            yield from iter_same_scope_nodes(child)
+
+def get_bound_names(node: ast.stmt) -> Set[str]:
+    """
+    Determines which names a top-level statement binds in its module,
+    including those bound anywhere inside it when it is a compound statement
+    (e.g. a function defined in an `if`, or an import in a `try`).
+
+    Args:
+        node (ast.stmt): A statement from the body of a module.
+
+    Returns:
+        Set[str]: The names the statement (re)defines when it runs.
+    """
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return {node.name}
+    names = set()
+    for sub in iter_same_scope_nodes(node):
+        if isinstance(sub, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(sub.name)
+        elif isinstance(sub, ast.Import):
+            names |= {alias.asname or alias.name.split(".")[0] for alias in sub.names}
+        elif isinstance(sub, ast.ImportFrom):
+            names |= {alias.asname or alias.name for alias in sub.names}
+        elif isinstance(sub, ast.Name) and isinstance(sub.ctx, ast.Store):
+            names.add(sub.id)
+        elif isinstance(sub, ast.ExceptHandler) and sub.name:
+            names.add(sub.name)
+    return names
+
+def get_mutated_names(node: ast.stmt) -> Set[str]:
+    """
+    Determines which names a top-level statement modifies without rebinding
+    them, by assigning to (or deleting) an item or attribute of them, e.g.
+    REGISTRY in `REGISTRY["a"] = 1` or obj in `obj.attr.x = 2`.
+
+    Args:
+        node (ast.stmt): A statement from the body of a module.
+
+    Returns:
+        Set[str]: The names at the root of the statement's item and
+        attribute targets.
+    """
+    names = set()
+    for sub in iter_same_scope_nodes(node):
+        if isinstance(sub, (ast.Subscript, ast.Attribute)) and \
+            isinstance(sub.ctx, (ast.Store, ast.Del)):
+
+            root = sub.value
+            while isinstance(root, (ast.Subscript, ast.Attribute)):
+                root = root.value
+            if isinstance(root, ast.Name):
+                names.add(root.id)
+    return names
+
+def get_referenced_names(node: ast.AST) -> Set[str]:
+    """
+    Collects every name read anywhere inside node, including inside nested
+    function bodies, decorators and default arguments.
+
+    Args:
+        node (ast.AST): The node to scan.
+
+    Returns:
+        Set[str]: The names loaded within node.
+    """
+    return {
+        sub.id for sub in ast.walk(node)
+        if isinstance(sub, ast.Name) and isinstance(sub.ctx, ast.Load)
+    }
+
+def get_reachable_statement_indices(
+    tree: ast.Module,
+    used_names: Set[str]) -> Tuple[Set[int], Set[str]]:
+    """
+    Finds the top-level statements needed to define used_names (and those
+    modifying their items or attributes), following references transitively
+    within the module.
+
+    Args:
+        tree (ast.Module): The parsed module.
+        used_names (Set[str]): The names some other module uses from this one.
+
+    Returns:
+        (Set[int], Set[str]): The indices (into tree.body) of the reachable
+        statements, and every name reached along the way.
+    """
+    # The statements defining each name, or modifying what it holds
+    bindings: Dict[str, List[int]] = {}
+    for index, node in enumerate(tree.body):
+        for name in get_bound_names(node) | get_mutated_names(node):
+            bindings.setdefault(name, []).append(index)
+
+    reached_names: Set[str] = set()
+    kept: Set[int] = set()
+    worklist = list(used_names)
+    for index, node in enumerate(tree.body):
+        # We cannot tell what a star import binds, so always keep it
+        if isinstance(node, ast.ImportFrom) and \
+            any(alias.name == "*" for alias in node.names):
+
+            kept.add(index)
+    while worklist:
+        name = worklist.pop()
+        if name in reached_names:
+            continue
+        reached_names.add(name)
+        for index in bindings.get(name, []):
+            if index not in kept:
+                kept.add(index)
+                worklist.extend(get_referenced_names(tree.body[index]))
+    return kept, reached_names
+
+def get_needed_aliases(
+    node: Union[ast.Import, ast.ImportFrom],
+    reached_names: Set[str]) -> List[ast.alias]:
+    """
+    The aliases of an import statement which bind one of reached_names.
+    """
+    if isinstance(node, ast.Import):
+        return [
+            alias for alias in node.names
+            if (alias.asname or alias.name.split(".")[0]) in reached_names
+        ]
+    return [
+        alias for alias in node.names
+        if (alias.asname or alias.name) in reached_names or alias.name == "*"
     ]
-    
-    return ast.unparse(tree)
 
-def remove_docstrings(code):
-    def remove_docstrings_node(node):
-        if isinstance(node, ast.Module):
-            # Remove module-level docstrings
-            if node.body and isinstance(node.body[0], ast.Expr) and \
-                isinstance(node.body[0].value, ast.Str):
+def get_reachable_statements(tree: ast.Module, used_names: Set[str]) -> List[ast.stmt]:
+    """
+    Tree-shakes a module down to the top-level statements needed to define
+    used_names, following references transitively within the module.  Import
+    statements are narrowed down to the aliases that are actually needed.
 
-                node.body.pop(0)
-        
+    Args:
+        tree (ast.Module): The parsed module.
+        used_names (Set[str]): The names some other module uses from this one.
+
+    Returns:
+        List[ast.stmt]: The reachable statements, in their original order.
+    """
+    kept, reached_names = get_reachable_statement_indices(tree, used_names)
+    reachable = []
+    for index, node in enumerate(tree.body):
+        if index not in kept:
+            continue
+        if isinstance(node, ast.Import):
+            node = ast.Import(names=get_needed_aliases(node, reached_names))
+        elif isinstance(node, ast.ImportFrom):
+            node = ast.ImportFrom(
+                module=node.module,
+                level=node.level,
+                names=get_needed_aliases(node, reached_names))
+        reachable.append(node)
+    return reachable
+
+def get_local_import_bindings(
+    tree: ast.Module,
+    file_path: str) -> Dict[str, Set[str]]:
+    """
+    Maps each local module imported at the top level of a file to the names
+    that import binds in the file.
+    """
+    bindings: Dict[str, Set[str]] = {}
+    for node in tree.body:
+        module_names = []
+        if isinstance(node, ast.Import):
+            module_names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            module_names = [node.module]
+        for module_name in module_names:
+            local_path = find_local_module(module_name, file_path)
+            if local_path is not None:
+                bindings.setdefault(os.path.normpath(local_path), set()).update(
+                    get_bound_names(node))
+    return bindings
+
+def get_used_attributes(tree: ast.AST, name: str) -> Optional[Set[str]]:
+    """
+    Finds the attributes accessed on name, e.g. {"bar"} for "foo.bar()".
+
+    Args:
+        tree (ast.AST): The code in which name is used.
+        name (str): The name of an imported module.
+
+    Returns:
+        Set[str]: The attributes used on name, or None if name is also used
+        on its own (in which case every attribute may be needed).
+    """
+    attributes = set()
+    attribute_bases = set()
+    for sub in ast.walk(tree):
+        if isinstance(sub, ast.Attribute) and isinstance(sub.value, ast.Name) \
+            and sub.value.id == name:
+
+            attributes.add(sub.attr)
+            attribute_bases.add(id(sub.value))
+    for sub in ast.walk(tree):
+        if isinstance(sub, ast.Name) and sub.id == name and \
+            isinstance(sub.ctx, ast.Load) and id(sub) not in attribute_bases:
+
+            return None
+    return attributes
+
+def iter_import_time_nodes(node: ast.AST) -> Iterator[ast.AST]:
+    """
+    Walks the parts of a statement which run when the statement itself runs,
+    i.e., everything but the bodies of the functions and lambdas it defines
+    (their decorators, default arguments and annotations do run).
+
+    Args:
+        node (ast.AST): A statement.
+
+    Returns:
+        Iterator[ast.AST]: The nodes executed along with node.
+    """
+    worklist = [node]
+    while worklist:
+        current = worklist.pop()
+        yield current
+        if isinstance(current, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            worklist.extend(current.decorator_list)
+            worklist.append(current.args)
+            if current.returns is not None:
+                worklist.append(current.returns)
+        elif isinstance(current, ast.Lambda):
+            worklist.append(current.args)
+        else:
+            worklist.extend(ast.iter_child_nodes(current))
+
+def get_needed_import_nodes(
+    tree: ast.Module,
+    used_names: Optional[Set[str]],
+    called_names: Set[str]) -> Tuple[List[Tuple[ast.stmt, List[ast.alias]]], ast.Module]:
+    """
+    Finds the imports of a module which can actually run: those that run
+    when the (tree-shaken) module is imported, and those inside the functions
+    reachable from called_names or from the module's import-time code.
+    Imports inside other functions are skipped.
+
+    Args:
+        tree (ast.Module): The parsed module.
+        used_names (Set[str]): The names used from the module by whoever
+            imports it, or None if the whole module is kept.
+        called_names (Set[str]): The names whose code may be called.
+
+    Returns:
+        The needed (import node, aliases) pairs, and the part of the module
+        that may run (for looking up how imported modules are used).
+    """
+    if used_names is None:
+        kept = set(range(len(tree.body)))
+        reached_names = None
+    else:
+        kept, reached_names = get_reachable_statement_indices(tree, used_names)
+
+    needed = []
+    roots = set(called_names)
+    for index in sorted(kept):
+        for node in iter_import_time_nodes(tree.body[index]):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                roots.add(node.id)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                aliases = node.names
+                if reached_names is not None and node is tree.body[index]:
+                    aliases = get_needed_aliases(node, reached_names)
+                needed.append((node, aliases))
+    import_time = {id(node) for node, _ in needed}
+
+    called, _ = get_reachable_statement_indices(tree, roots)
+    running = [tree.body[index] for index in sorted(kept & called)]
+    for statement in running:
+        for node in ast.walk(statement):
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and \
+                id(node) not in import_time:
+
+                needed.append((node, node.names))
+    return needed, ast.Module(body=running, type_ignores=[])
+
+def get_pip_imports_for_function(
+    the_file: str,
+    function_name: str,
+    classifications: Optional[Dict[Tuple[str, str], Tuple[str, str]]] = None) -> List[str]:
+    """
+    Like get_pip_imports_recursive, but only considering the imports which
+    can run when function_name is analyzed: every import that runs when the
+    (normalized) code is loaded, plus the imports inside the functions,
+    from the_file or from the local modules it uses, which function_name
+    can reach.  Each import is only classified (which may mean asking PyPI)
+    once it is known to be needed.
+
+    Args:
+        the_file (str): Path to the file being analyzed.
+        function_name (str): The function being analyzed.
+        classifications: Optional cache of get_import_info results, keyed by
+            (module name, directory of the importing file), to share
+            between calls.
+
+    Returns:
+        List[str]: The packages that need to be pip-installed, without
+            repetitions.
+    """
+    if classifications is None:
+        classifications = {}
+
+    def classify_import(module_name: str, file_path: str) -> Tuple[str, str]:
+        key = (module_name, os.path.dirname(os.path.abspath(file_path)))
+        if key not in classifications:
+            classifications[key] = get_import_info(
+                ast.Import(names=[ast.alias(name=module_name)]), file_path)
+        return classifications[key]
+
+    # For each module: the names used from it and the names of it that may
+    # be called (None meaning all of them)
+    states: Dict[str, List[Optional[Set[str]]]] = {
+        os.path.normpath(the_file): [None, {function_name}]}
+    trees: Dict[str, ast.Module] = {}
+    worklist = [os.path.normpath(the_file)]
+    pip_imports: List[str] = []
+
+    def union(old: Optional[Set[str]], new: Optional[Set[str]]) -> Optional[Set[str]]:
+        return None if old is None or new is None else old | new
+
+    def use(path: str, names: Optional[Set[str]], called: Optional[Set[str]]):
+        path = os.path.normpath(path)
+        old = states.get(path, [set(), set()])
+        states[path] = [union(old[0], names), union(old[1], called)]
+        if states[path] != old and path not in worklist:
+            worklist.append(path)
+
+    while worklist:
+        path = worklist.pop()
+        if path not in trees:
+            with open(path, "r") as fr:
+                trees[path] = ast.parse(fr.read())
+        used_names, called_names = states[path]
+        if called_names is None:
+            called_names = {
+                name for node in trees[path].body for name in get_bound_names(node)}
+        needed, running = get_needed_import_nodes(trees[path], used_names, called_names)
+        called_here = get_referenced_names(running)
+        for node, aliases in needed:
+            if isinstance(node, ast.Import):
+                for alias in aliases:
+                    import_type, name_or_path = classify_import(alias.name, path)
+                    if import_type == "pip" and name_or_path not in pip_imports:
+                        pip_imports.append(name_or_path)
+                    elif import_type == "local":
+                        binding = alias.asname or alias.name
+                        attributes = get_used_attributes(running, binding)
+                        use(name_or_path, attributes,
+                            attributes if binding in called_here else set())
+            elif node.module:
+                import_type, name_or_path = classify_import(node.module, path)
+                if import_type == "pip" and name_or_path not in pip_imports:
+                    pip_imports.append(name_or_path)
+                elif import_type == "local":
+                    names = {alias.name for alias in aliases}
+                    called = {
+                        alias.name for alias in aliases
+                        if (alias.asname or alias.name) in called_here}
+                    if "*" in names:
+                        use(name_or_path, None, None)
+                    else:
+                        use(name_or_path, names, called)
+    return pip_imports
+
+class SourceEditor:
+    """
+    Collects replacements of spans of a source string, where the spans come
+    from the positions of ast nodes parsed from that same string, and applies
+    them all in one pass.  Everything outside the replaced spans (formatting,
+    comments, line structure) is preserved.
+    """
+    def __init__(self, code: str):
+        self.code = code
+        self.line_starts = [0] + [
+            match.end() for match in re.finditer("\n", code)]
+        self.edits: List[Tuple[int, int, str, bool]] = []
+        self.string_line_starts: Optional[Set[int]] = None
+
+    def offset(self, lineno: int, col_offset: int) -> int:
+        """
+        Converts an ast position (1-indexed line, UTF-8 byte column) into an
+        index into the source string.
+        """
+        start = self.line_starts[lineno - 1]
+        end = self.line_starts[lineno] if lineno < len(self.line_starts) \
+            else len(self.code)
+        line_prefix = self.code[start:end].encode("utf-8")[:col_offset]
+        return start + len(line_prefix.decode("utf-8", errors="ignore"))
+
+    def span(self, node: ast.AST) -> Tuple[int, int]:
+        """
+        The [start, end) indices of node in the source string.
+        """
+        return (
+            self.offset(node.lineno, node.col_offset),
+            self.offset(node.end_lineno, node.end_col_offset))
+
+    def line_indentation(self, lineno: int) -> str:
+        """
+        The leading whitespace of the given line.
+        """
+        line = self.code[self.line_starts[lineno - 1]:].split("\n", 1)[0]
+        return line[:len(line) - len(line.lstrip())]
+
+    def get_string_line_starts(self) -> Set[int]:
+        """
+        The indices of the line starts which fall inside a string literal
+        (f-strings included), whose line breaks are part of its value and
+        must not be indented.
+        """
+        if self.string_line_starts is not None:
+            return self.string_line_starts
+        fstring_start = getattr(tokenize, "FSTRING_START", None)
+        fstring_end = getattr(tokenize, "FSTRING_END", None)
+        string_spans = []
+        # Python 3.12 splits f-strings into tokens, which may nest
+        open_fstrings: List[Tuple[int, int]] = []
+        try:
+            for token in tokenize.generate_tokens(io.StringIO(self.code).readline):
+                if token.type == fstring_start:
+                    open_fstrings.append(token.start)
+                elif token.type == fstring_end:
+                    start = open_fstrings.pop()
+                    if not open_fstrings:
+                        string_spans.append((start, token.end))
+                elif token.type == tokenize.STRING and not open_fstrings:
+                    string_spans.append((token.start, token.end))
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            pass
+        self.string_line_starts = set()
+        for (start_row, _), (end_row, _) in string_spans:
+            # Tokens count rows from 1; rows after the first start inside
+            self.string_line_starts.update(self.line_starts[start_row:end_row])
+        return self.string_line_starts
+
+    def indent_code(self, start: int, end: int, indentation: str) -> str:
+        """
+        The source between start and end, with indentation added at the start
+        of every line after the first, except inside string literals.
+        """
+        if not indentation:
+            return self.code[start:end]
+        string_line_starts = self.get_string_line_starts()
+        pieces = []
+        position = start
+        first = bisect.bisect_right(self.line_starts, start)
+        last = bisect.bisect_right(self.line_starts, end)
+        for line_start in self.line_starts[first:last]:
+            if line_start in string_line_starts:
+                continue
+            pieces.append(self.code[position:line_start])
+            pieces.append(indentation)
+            position = line_start
+        pieces.append(self.code[position:end])
+        return "".join(pieces)
+
+    def replace(self, node: ast.AST, text: str, indented: bool = False):
+        """
+        Replaces the source of node with text.  If indented, the lines of
+        text after the first already carry their final indentation.
+        """
+        start, end = self.span(node)
+        self.edits.append((start, end, text, indented))
+
+    def apply(
+        self,
+        start: int = 0,
+        end: Optional[int] = None,
+        indentation: str = "") -> str:
+        """
+        Returns the source between start and end with the edits applied,
+        adding indentation to every line after the first (except within
+        string literals and already indented edits).
+        """
+        end = len(self.code) if end is None else end
+        return self.apply_spans([(start, end)], indentation)[0]
+
+    def apply_spans(
+        self,
+        spans: List[Tuple[int, int]],
+        indentation: str = "") -> List[str]:
+        """
+        Like apply, for each of the [start, end) spans, but sorting the edits
+        only once: each span only visits the edits which start within it.
+        """
+        def indent(text: str) -> str:
+            return text.replace("\n", "\n" + indentation) if indentation else text
+
+        edits = sorted(self.edits)
+        edit_starts = [edit[0] for edit in edits]
+        results = []
+        for start, end in spans:
+            pieces = []
+            position = start
+            index = bisect.bisect_left(edit_starts, start)
+            while index < len(edits) and edit_starts[index] <= end:
+                edit_start, edit_end, text, indented = edits[index]
+                index += 1
+                if edit_start < position or edit_end > end:
+                    continue
+                pieces.append(self.indent_code(position, edit_start, indentation))
+                pieces.append(text if indented else indent(text))
+                position = edit_end
+            pieces.append(self.indent_code(position, end, indentation))
+            results.append("".join(pieces))
+        return results
+
+def get_docstring_nodes(tree: ast.Module) -> List[Tuple[ast.Expr, List[ast.stmt]]]:
+    """
+    Finds the docstrings remove_docstrings would remove: those of the module,
+    classes and functions, plus any other top-level string literal.
+
+    Returns:
+        List of (docstring statement, body containing it).
+    """
+    docstrings = [(node, tree.body) for node in tree.body if is_string_statement(node)]
+    for node in ast.walk(tree):
         if isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.AsyncFunctionDef)):
-            # Remove docstrings in functions and classes
-            if node.body and isinstance(node.body[0], ast.Expr) and \
-                isinstance(node.body[0].value, ast.Str):
+            if node.body and is_string_statement(node.body[0]):
+                docstrings.append((node.body[0], node.body))
+    return docstrings
 
-                node.body.pop(0)
-        
-        # Recursively process all child nodes
-        for child in ast.iter_child_nodes(node):
-            remove_docstrings_node(child)
-        
-        return node
+def classify_wrap_indented(body: str, class_name: str, indentation: str) -> str:
+    """
+    Like classify_wrap, but for a body whose lines after the first were
+    already indented to indentation plus one level, so that wrapping does not
+    have to re-indent (and nested wrapping stays linear in the code size).
+    Lines continuing a string literal must not have been indented (see
+    SourceEditor.indent_code): nothing here touches them.
 
-    tree = ast.parse(code)
-    tree = remove_docstrings_node(tree)
-    
-    # Remove any remaining top-level string literals (like in Test Case 1)
-    tree.body = [
-        node for node in tree.body \
-        if not (isinstance(node, ast.Expr) and \
-            isinstance(node.value, ast.Str))
-    ]
-    
-    return ast.unparse(tree)
+    Args:
+        body (str): The class body.
+        class_name (str): The name of the class (and of its instance).
+        indentation (str): The indentation of the class statement itself.
 
-def normalize_imported_modules_in_code(file_path: str) -> str:
+    Returns:
+        str: The class and instance definitions, without indenting the first
+        line.
     """
-    Normalizes a python code string so that it does not use any aliases in its
-    imports.  E.g., would turn "import numpy as np" into "import numpy".
-    
+    assert not " " in class_name
+    assert not "\t" in class_name
+    return f"class {class_name}:\n{indentation}    {body}\n" + \
+        f"{indentation}{class_name} = {class_name}()"
+
+def build_import_text(
+    node: Union[ast.Import, ast.ImportFrom],
+    aliases: List[ast.alias]) -> str:
+    """
+    Writes an import statement like node, but importing just aliases.
+    """
+    names = ", ".join(
+        alias.name + (f" as {alias.asname}" if alias.asname else "")
+        for alias in aliases)
+    if isinstance(node, ast.Import):
+        return f"import {names}"
+    return f"from {'.' * node.level}{node.module or ''} import {names}"
+
+def normalize_imported_modules_in_code(
+    file_path: str,
+    used_names: Optional[Set[str]] = None,
+    indentation: str = "") -> str:
+    """
+    Normalizes a python code string so that it does not use any aliases of
+    local modules in its imports.  Local modules are inlined as classes,
+    keeping only the symbols reachable from the names the importing module
+    actually uses, and uses of their aliases are rewritten accordingly.
+    Docstrings are removed.  Pip and system imports are left as they are.
+
+    The code is edited in place rather than regenerated from its ast, so the
+    formatting, comments and (apart from inlined modules) line numbers of
+    file_path are preserved.  Inlined modules are normalized directly at the
+    indentation they end up at, so each line is indented exactly once no
+    matter how deeply local imports nest, and lines inside string literals
+    never are, so that the literals keep their values at any depth.
+
     Args:
         file_path: The path to the file that needs to be normalized.
-    
+        used_names: The names used from this module by whoever imports it, or
+            None to keep the whole module (e.g., for the file being analyzed).
+        indentation: Prefix for every line of the result but the first.
+
     Returns:
         str: The normalized version of the code string.
     """
-    code_str = None
     with open(file_path, "r") as fr:
-        code_str = remove_docstrings(fr.read())
-        
-    # Parse the code string into an AST
-    tree = ast.parse(code_str)
-    
-    # Create a transformer to modify the AST
-    class ImportTransformer(ast.NodeTransformer):
-        def __init__(self) -> None:
-            self.alias_map: dict = {}
-
-        def visit_Import(self, node: ast.Import) -> ast.stmt:
-            new_names = []
-            for alias in node.names:
-                import_node = ast.Import(names=[alias])
-                import_type, import_name_or_path = get_import_info(import_node, file_path)
-                if import_type in ["pip", "system"]:
-                    # Strip the alias, e.g., "import numpy as np" -> "import numpy"
-                    new_names.append(ast.alias(name=alias.name, asname=alias.asname))
-                else:
-                    assert import_type == "local"
-                    # Recursively normalize the imported local file
-                    normalized_code = normalize_imported_modules_in_code(import_name_or_path)
-                    # Run classify_wrap on the normalized code, using the class_name
-                    # which is the name of the import (normalized)
-                    wrapped_code = classify_wrap(normalized_code, alias.name)
-                    # Parse the wrapped code into an AST
-                    wrapped_ast = ast.parse(wrapped_code)
-                    # Save the alias for the class
-                    if alias.asname:
-                        self.alias_map[alias.asname] = alias.name
-                    # Return the wrapped AST
-                    return wrapped_ast.body
-
-            if new_names:
-                # Create a new Import node with the stripped aliases
-                new_import_node = ast.Import(names=new_names)
-                return new_import_node
-            else:
-                # If no imports remain, return None to remove the import statement
-                return None
-
-        def visit_ImportFrom(self, node: ast.ImportFrom) -> ast.stmt:
-            new_names = []
-            for alias in node.names:
-                import_node = ast.ImportFrom(module=node.module, names=[alias], level=node.level)
-                import_type, import_name_or_path = get_import_info(import_node, file_path)
-                if import_type in ["pip", "system"]:
-                    # Keep the import as is for pip and system packages, removing aliases
-                    new_names.append(ast.alias(name=alias.name, asname=alias.asname))
-                else:
-                    assert import_type == "local"
-                    # Recursively normalize the imported local file
-                    normalized_code = normalize_imported_modules_in_code(import_name_or_path)
-                    # Run classify_wrap on the normalized code, using the class_name
-                    # which is the name of the import (normalized)
-                    class_name = node.module.split("/")[-1].split(".py")[0]
-                    wrapped_code = classify_wrap(normalized_code, class_name)
-                    # Parse the wrapped code into an AST
-                    wrapped_ast = ast.parse(wrapped_code)
-                    
-                    # Handle aliases for local imports
-                    for alias in node.names:
-                        if alias.asname:
-                            self.alias_map[alias.asname] = f"{class_name}.{alias.name}"
-                        else:
-                            self.alias_map[alias.name] = f"{class_name}.{alias.name}"
-                    
-                    # Return the wrapped AST
-                    return wrapped_ast.body
-
-            if new_names:
-                # Create a new ImportFrom node with the normalized names
-                new_import_node = ast.ImportFrom(module=node.module, names=new_names, level=node.level)
-                return new_import_node
+        code = fr.read()
+    tree = ast.parse(code)
+    editor = SourceEditor(code)
+
+    if used_names is None:
+        kept = set(range(len(tree.body)))
+        reached_names = None
+    else:
+        kept, reached_names = get_reachable_statement_indices(tree, used_names)
+    statements = [node for index, node in enumerate(tree.body) if index in kept]
+    statement_ids = {id(node) for node in statements}
+    kept_tree = ast.Module(body=statements, type_ignores=[])
+
+    for docstring, body in get_docstring_nodes(tree):
+        # Keep the line count; a body needs at least one statement, and a
+        # statement sharing the docstring's line needs a separator.
+        position = body.index(docstring)
+        shares_line = (
+            position > 0 and body[position - 1].end_lineno == docstring.lineno
+        ) or (
+            position + 1 < len(body) and
+            body[position + 1].lineno == docstring.end_lineno)
+        placeholder = "pass" if len(body) == 1 or shares_line else ""
+        editor.replace(
+            docstring,
+            placeholder + "\n" * (docstring.end_lineno - docstring.lineno))
+
+    # First classify every import, collecting the names used from each local
+    # module over all of its imports, so that every copy of an inlined module
+    # has everything any of them needs.
+    alias_map: Dict[str, str] = {}
+    imports = []
+    used_by_path: Dict[str, Optional[Set[str]]] = {}
+    def use(path: str, names: Optional[Set[str]]):
+        if path in used_by_path and used_by_path[path] is None:
+            return
+        if names is None:
+            used_by_path[path] = None
+        else:
+            used_by_path[path] = used_by_path.get(path, set()) | names
+
+    for node in ast.walk(kept_tree):
+        if not isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        aliases = node.names
+        if reached_names is not None and id(node) in statement_ids:
+            aliases = get_needed_aliases(node, reached_names)
+        kept_aliases = []
+        inlined = []
+        # Only local modules matter here, so don't ask PyPI about the rest
+        if isinstance(node, ast.Import):
+            for alias in aliases:
+                import_name_or_path = find_local_module(alias.name.strip(), file_path)
+                if import_name_or_path is None:
+                    kept_aliases.append(alias)
+                    continue
+                # Inline the local module, keeping only the attributes we use
+                use(import_name_or_path,
+                    get_used_attributes(kept_tree, alias.asname or alias.name))
+                inlined.append((import_name_or_path, alias.name))
+                if alias.asname:
+                    alias_map[alias.asname] = alias.name
+        else:
+            import_name_or_path = find_local_module(node.module, file_path)
+            if import_name_or_path is None:
+                kept_aliases = aliases
             else:
-                # If no imports remain or if the import type is local, return the original node
-                return node
-
-        def visit_Name(self, node: ast.Name) -> ast.expr:
-            # Replace the usage of aliases with the original module path
-            if node.id in self.alias_map:
-                module_path = self.alias_map[node.id]
-                attrs = module_path.split(".")
-                new_node = ast.Name(id=attrs[0], ctx=node.ctx)
-                for attr in attrs[1:]:
-                    new_node = ast.Attribute(value=new_node, attr=attr, ctx=node.ctx)
-                return new_node
-            return node
-        
-        def visit_Attribute(self, node: ast.Attribute) -> ast.expr:
-            # Replace the usage of aliases in attribute access
-            if isinstance(node.value, ast.Name) and node.value.id in self.alias_map:
-                module_path = self.alias_map[node.value.id]
-                attrs = module_path.split(".")
-                new_node = ast.Name(id=attrs[0], ctx=node.value.ctx)
-                for attr in attrs[1:] + [node.attr]:
-                    new_node = ast.Attribute(value=new_node, attr=attr, ctx=node.value.ctx)
-                return new_node
-            return node
-    
-    # Modify the AST using the transformer
-    transformer = ImportTransformer()
-    modified_tree = transformer.visit(tree)
-    
-    # Convert the modified AST back to code string
-    normalized_code = ast.unparse(modified_tree)
-        
-    return normalized_code
-    
\ No newline at end of file
+                # Inline the local module, keeping only the names imported from it
+                imported_names = {alias.name for alias in aliases}
+                use(import_name_or_path,
+                    None if "*" in imported_names else imported_names)
+                class_name = node.module.split(".")[-1]
+                inlined.append((import_name_or_path, class_name))
+                for alias in aliases:
+                    alias_map[alias.asname or alias.name] = f"{class_name}.{alias.name}"
+        imports.append((node, kept_aliases, inlined))
+
+    normalized_modules: Dict[Tuple[str, str], str] = {}
+    for node, kept_aliases, inlined in imports:
+        if not inlined and len(kept_aliases) == len(node.names):
+            continue
+        statement_indentation = indentation + editor.line_indentation(node.lineno)
+        pieces = [build_import_text(node, kept_aliases)] if kept_aliases else []
+        for path, class_name in inlined:
+            body_indentation = statement_indentation + "    "
+            if (path, body_indentation) not in normalized_modules:
+                normalized_modules[(path, body_indentation)] = \
+                    normalize_imported_modules_in_code(
+                        path, used_by_path[path], body_indentation)
+            body = normalized_modules[(path, body_indentation)].rstrip()
+            pieces.append(classify_wrap_indented(
+                body or "pass", class_name, statement_indentation))
+        text = ("\n" + statement_indentation).join(pieces) or "pass"
+        editor.replace(node, text, indented=True)
+
+    for node in ast.walk(kept_tree):
+        # Replace the usage of aliases with the original module path
+        if isinstance(node, ast.Name) and node.id in alias_map:
+            editor.replace(node, alias_map[node.id])
+
+    if used_names is None:
+        return editor.apply(indentation=indentation)
+    return ("\n" + indentation).join(editor.apply_spans([
+        (editor.offset(get_first_line(node), 0),
+         editor.offset(node.end_lineno, node.end_col_offset))
+        for node in statements
+    ], indentation))
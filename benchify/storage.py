@@ -0,0 +1,110 @@
+"""
+files shared safely between concurrent benchify processes
+"""
+import contextlib
+import os
+import time
+import uuid
+from typing import Optional
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+def atomic_write(path: str, data: bytes, mode: int = 0o644):
+    """
+    Writes data to path through a temporary file in the same directory,
+    renamed over path once complete, so that readers only ever see the old
+    or the new contents, never a partial write.
+    """
+    temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    descriptor = os.open(temporary_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, mode)
+    try:
+        with os.fdopen(descriptor, "wb") as fw:
+            fw.write(data)
+            fw.flush()
+            os.fsync(fw.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary_path)
+        raise
+
+class FileLock:
+    """
+    An exclusive lock shared by every process (and thread) using the same
+    path, held e.g. while one process refreshes a file the others read:
+    flock(2) on POSIX, msvcrt.locking on Windows.  The lock file itself is
+    left in place.  The lock is released if its process dies.
+
+    Args:
+        path (str): The lock file (created, with its directory, if needed).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.descriptor: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Takes the lock, waiting for it unless blocking is False.
+
+        Returns:
+            bool: Whether the lock was taken.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        descriptor = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            while not lock_descriptor(descriptor):
+                if not blocking:
+                    os.close(descriptor)
+                    return False
+                time.sleep(0.05)
+        except BaseException:
+            os.close(descriptor)
+            raise
+        self.descriptor = descriptor
+        return True
+
+    def release(self):
+        """
+        Releases the lock.
+        """
+        if self.descriptor is None:
+            return
+        unlock_descriptor(self.descriptor)
+        os.close(self.descriptor)
+        self.descriptor = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+def lock_descriptor(descriptor: int) -> bool:
+    """
+    Tries to lock the open file, without waiting.
+    """
+    if os.name == "nt":
+        try:
+            msvcrt.locking(descriptor, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def unlock_descriptor(descriptor: int):
+    """
+    Unlocks a file locked with lock_descriptor.
+    """
+    if os.name == "nt":
+        os.lseek(descriptor, 0, os.SEEK_SET)
+        msvcrt.locking(descriptor, msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(descriptor, fcntl.LOCK_UN)
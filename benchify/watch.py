@@ -0,0 +1,247 @@
+"""
+watches a project for saved python files and reports which functions changed
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from .function_index import FunctionIndex
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_ISDIR       = 0x40000000
+IN_NONBLOCK    = os.O_NONBLOCK
+WATCH_MASK     = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")
+
+SKIPPED_DIRS = {"__pycache__", "node_modules", "venv", "env"}
+
+def iter_project_dirs(root: str) -> List[str]:
+    """
+    Lists root and its subdirectories, skipping hidden and virtualenv-like
+    directories.
+    """
+    dirs = []
+    for dir_path, dir_names, _ in os.walk(root):
+        dir_names[:] = [
+            d for d in dir_names
+            if not d.startswith(".") and d not in SKIPPED_DIRS
+        ]
+        dirs.append(dir_path)
+    return dirs
+
+def iter_python_files(root: str) -> List[str]:
+    """
+    Lists the python files under root (or just root, if it is a file).
+    """
+    if os.path.isfile(root):
+        return [os.path.normpath(root)]
+    return [
+        os.path.normpath(os.path.join(dir_path, file_name))
+        for dir_path in iter_project_dirs(root)
+        for file_name in sorted(os.listdir(dir_path))
+        if file_name.endswith(".py")
+    ]
+
+class PollingWatcher:
+    """
+    Detects changed python files by comparing modification times.
+    """
+    def __init__(self, root: str, interval: float = 1.0):
+        self.root = root
+        self.interval = interval
+        self.mtimes = self.scan()
+
+    def scan(self) -> Dict[str, float]:
+        """
+        Returns the modification time of every python file under root.
+        """
+        mtimes = {}
+        for path in iter_python_files(self.root):
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                pass
+        return mtimes
+
+    def poll(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds and returns the files that were created,
+        modified or deleted.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            mtimes = self.scan()
+            changed = {
+                path for path in set(mtimes) | set(self.mtimes)
+                if mtimes.get(path) != self.mtimes.get(path)
+            }
+            self.mtimes = mtimes
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        """
+        Nothing to release for polling.
+        """
+
+class InotifyWatcher:
+    """
+    Detects changed python files using Linux inotify (through libc, so no
+    extra dependency is needed).  Raises OSError where inotify is unavailable.
+    """
+    def __init__(self, root: str):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self.watched_dirs: Dict[int, str] = {}
+        watch_root = root if os.path.isdir(root) else os.path.dirname(root) or "."
+        for dir_path in iter_project_dirs(watch_root):
+            self.add_dir(dir_path)
+
+    def add_dir(self, dir_path: str):
+        """
+        Starts watching dir_path (not recursively).
+        """
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd >= 0:
+            self.watched_dirs[wd] = dir_path
+
+    def poll(self, timeout: float) -> Set[str]:
+        """
+        Waits up to timeout seconds and returns the python files that were
+        created, written or deleted.
+        """
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            # Like os.listdir, keep names which are not valid UTF-8 (as surrogates)
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            dir_path = self.watched_dirs.get(wd)
+            if dir_path is None or not name:
+                continue
+            path = os.path.normpath(os.path.join(dir_path, name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and \
+                    not name.startswith(".") and name not in SKIPPED_DIRS:
+
+                    for sub_dir in iter_project_dirs(path):
+                        self.add_dir(sub_dir)
+                    changed.update(iter_python_files(path))
+            elif name.endswith(".py"):
+                changed.add(path)
+        if os.path.isfile(self.root):
+            changed &= {os.path.normpath(self.root)}
+        return changed
+
+    def close(self):
+        """
+        Releases the inotify file descriptor.
+        """
+        os.close(self.fd)
+
+def make_watcher(root: str, poll_interval: float = 1.0):
+    """
+    Returns an InotifyWatcher for root, or a PollingWatcher where inotify is
+    not available.
+    """
+    try:
+        return InotifyWatcher(root)
+    except (OSError, AttributeError):
+        return PollingWatcher(root, poll_interval)
+
+def wait_for_changes(watcher, debounce: float, timeout: Optional[float] = None) -> Set[str]:
+    """
+    Blocks until some files change, then keeps collecting changes until
+    nothing has changed for debounce seconds, so a burst of saves is
+    reported as a single batch.
+    """
+    changed = watcher.poll(3600 if timeout is None else timeout)
+    if not changed:
+        return changed
+    while True:
+        more = watcher.poll(debounce)
+        if not more:
+            return changed
+        changed |= more
+
+def watch_project(
+    root: str,
+    on_change: Callable[[str, List[str]], None],
+    debounce: float = 0.5,
+    poll_interval: float = 1.0,
+    index: Optional[FunctionIndex] = None,
+    watcher=None,
+    max_batches: Optional[int] = None):
+    """
+    Indexes every python file under root, then calls on_change(path, names)
+    for each saved file with the names of its functions whose source
+    actually changed.  The index (parsed modules and local import graph)
+    stays warm between saves, so only the saved files are re-parsed.
+
+    Args:
+        root (str): The file or directory to watch.
+        on_change: Called with a file path and its changed function names.
+        debounce (float): Seconds of quiet after which a burst of saves is
+            processed.
+        poll_interval (float): Seconds between scans when polling.
+        index (FunctionIndex): The index to keep warm, if shared.
+        watcher: The watcher to use; defaults to make_watcher(root).
+        max_batches (int): Stop after this many batches (None to run forever).
+    """
+    index = index if index is not None else FunctionIndex()
+    for path in iter_python_files(root):
+        if path in index.modules:
+            continue
+        try:
+            index.update(path)
+        except SyntaxError:
+            pass
+    watcher = watcher if watcher is not None else make_watcher(root, poll_interval)
+    batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            changed = wait_for_changes(watcher, debounce)
+            if not changed:
+                continue
+            batches += 1
+            for path in sorted(changed):
+                if not os.path.exists(path):
+                    index.forget(path)
+                    continue
+                try:
+                    changed_names = index.update(path)
+                except SyntaxError:
+                    # Probably saved mid-edit; wait for the next save
+                    continue
+                if changed_names:
+                    on_change(path, changed_names)
+    finally:
+        watcher.close()
@@ -0,0 +1,60 @@
+from benchify.budget import \
+    Candidate, \
+    get_churn, \
+    get_complexity, \
+    make_candidate, \
+    parse_duration, \
+    plan_budget
+from benchify.function_index import FunctionIndex
+
+import ast
+
+import pytest
+
+def test_parse_duration():
+    assert parse_duration("90") == 90
+    assert parse_duration("90s") == 90
+    assert parse_duration("10m") == 600
+    assert parse_duration("1.5h") == 5400
+    with pytest.raises(ValueError):
+        parse_duration("soon")
+
+def test_complexity_and_churn():
+    tree = ast.parse("""
+def f(x):
+    if x and x > 1 or x < -1:
+        return [y for y in range(x) if y]
+    for i in range(3):
+        pass
+    return x
+""")
+    # if, 2 boolean operators, comprehension, for
+    assert get_complexity(tree.body[0]) == 6
+    assert get_complexity(ast.parse("def g(): return 1").body[0]) == 1
+    assert get_churn((2, 7), [(1, 3), (6, 6), (9, 10)]) == 3
+
+def test_make_candidate(tmp_path):
+    path = tmp_path / "funcs.py"
+    path.write_text("import os\n\ndef f(x):\n    if x:\n        return 1\n    return 2\n")
+    module = FunctionIndex().get(str(path))
+    candidate = make_candidate(str(path), "f", {}, 10.0, module, [(4, 5)])
+    assert (candidate.lines, candidate.complexity, candidate.churn) == (4, 2, 2)
+    assert candidate.to_record()["predicted_cost"] == 10.0
+
+def test_plan_budget_prefers_valuable_cheap_uncached_functions():
+    candidates = [
+        Candidate("a.py", "big", {}, expected=100, lines=50, complexity=10, churn=5),
+        Candidate("a.py", "cheap", {}, expected=10, lines=10, complexity=3, churn=5),
+        Candidate("a.py", "dull", {}, expected=30, lines=3, complexity=1),
+        Candidate("a.py", "cached", {}, expected=500, lines=50, cached=True),
+    ]
+    plan = plan_budget(candidates, budget=60, concurrency=2)
+    assert [c.name for c in plan.selected] == ["cheap", "dull"]
+    assert [c.name for c in plan.deferred] == ["big"]
+    assert [c.name for c in plan.cached] == ["cached"]
+    assert plan.expected == 30
+    assert "deferring 1" in plan.summary()
+
+    plan = plan_budget(candidates, budget=200, concurrency=2)
+    assert [c.name for c in plan.selected] == ["cheap", "big", "dull"]
+    assert plan.deferred == []
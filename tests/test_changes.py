@@ -0,0 +1,92 @@
+from benchify.changes import \
+    get_changed_functions, \
+    list_python_files, \
+    parse_diff_hunks, \
+    run_git
+
+import os
+
+def test_parse_diff_hunks():
+    diff_text = """diff --git a/pkg/a.py b/pkg/a.py
+index 1111111..2222222 100644
+--- a/pkg/a.py
++++ b/pkg/a.py
+@@ -3 +3 @@ def foo():
+-    return 1
++    return 2
+@@ -10,2 +10,0 @@ def bar():
+-    x = 1
+-    y = 2
+@@ -20,0 +19,3 @@ def baz():
++    a = 1
++    b = 2
++    c = 3
+diff --git a/gone.py b/gone.py
+deleted file mode 100644
+--- a/gone.py
++++ /dev/null
+@@ -1 +0,0 @@
+-x = 1
+"""
+    assert parse_diff_hunks(diff_text) == {
+        "pkg/a.py": [(3, 3), (10, 11), (19, 21)],
+    }
+
+def write(path, code):
+    with open(path, "w") as fw:
+        fw.write(code)
+
+def test_get_changed_functions(tmp_path):
+    root = str(tmp_path)
+    run_git(["init", "-q"], root)
+    run_git(["config", "user.email", "test@example.com"], root)
+    run_git(["config", "user.name", "test"], root)
+    write(os.path.join(root, "helpers.py"), "SCALE = 2\n\ndef double(x):\n    return x * SCALE\n")
+    write(os.path.join(root, "app.py"), """from .helpers import double
+
+def uses_helper(x):
+    return double(x)
+
+def standalone(y):
+    return y + 1
+
+def also_standalone(z):
+    return z - 1
+""")
+    run_git(["add", "-A"], root)
+    run_git(["commit", "-q", "-m", "init"], root)
+
+    write(os.path.join(root, "helpers.py"), "SCALE = 3\n\ndef double(x):\n    return x * SCALE\n")
+    write(os.path.join(root, "app.py"), """from .helpers import double
+
+def uses_helper(x):
+    return double(x)
+
+def standalone(y):
+    return y + 2
+
+def also_standalone(z):
+    return z - 1
+""")
+    files = list_python_files(root)
+    assert sorted(os.path.basename(f) for f in files) == ["app.py", "helpers.py"]
+    assert get_changed_functions("HEAD", root, files) == {
+        os.path.join(root, "app.py"): ["standalone", "uses_helper"],
+        os.path.join(root, "helpers.py"): ["double"],
+    }
+
+def test_untracked_files_are_changed(tmp_path):
+    root = str(tmp_path)
+    run_git(["init", "-q"], root)
+    run_git(["config", "user.email", "test@example.com"], root)
+    run_git(["config", "user.name", "test"], root)
+    write(os.path.join(root, ".gitignore"), "ignored.py\n")
+    run_git(["add", "-A"], root)
+    run_git(["commit", "-q", "-m", "init"], root)
+
+    write(os.path.join(root, "new.py"), "def f(x):\n    return x\n\ndef g():\n    return 1\n")
+    write(os.path.join(root, "ignored.py"), "def h():\n    return 1\n")
+    files = list_python_files(root)
+    assert get_changed_functions("HEAD", root, files) == {
+        os.path.join(root, "new.py"): ["f", "g"],
+    }
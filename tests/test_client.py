@@ -0,0 +1,259 @@
+from benchify import client as client_module
+from benchify import source_manipulation
+from benchify.auth import AuthTokens
+from benchify.job_queue import DONE, FAILED, JobQueue
+from benchify.latency import LatencyStore
+from benchify.main import make_job_worker
+from benchify.client import \
+    AmbiguousFunctionError, \
+    AnalysisError, \
+    AnalysisResult, \
+    BenchifyClient, \
+    resolve_pip_imports
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pytest
+
+class EchoHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.path.endswith("/batch"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        EchoHandler.requests_seen.append((self.headers["Authorization"], body))
+        status = 500 if "explode" in body["test_func"] else 200
+        if "reject" in body["test_func"]:
+            status = 413
+        if self.headers["Authorization"] == "Bearer expired":
+            status = 401
+        text = f"✅ analyzed {body['file_name']}"
+        if "bad" in body["test_func"]:
+            text = "❌ property failed"
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(text.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    EchoHandler.requests_seen = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/analyze"
+    httpd.shutdown()
+
+def make_client(url):
+    return BenchifyClient(url=url, auth_tokens=AuthTokens("id-token", "access-token"))
+
+def write(tmp_path, code):
+    path = tmp_path / "funcs.py"
+    path.write_text(code)
+    return str(path)
+
+def test_select_function(tmp_path):
+    client = make_client("http://unused")
+    path = write(tmp_path, "def good(x):\n    return x\n\ndef bad(y):\n    return y\n")
+    with pytest.raises(AmbiguousFunctionError) as ambiguous:
+        client.select_function(path)
+    assert ambiguous.value.function_names == ["good", "bad"]
+    with pytest.raises(AnalysisError):
+        client.select_function(path, "missing")
+    assert client.select_function(path, "bad") == ("bad", "def bad(y):\n    return y")
+
+def test_analyze_function_and_cache(tmp_path, server):
+    client = make_client(server)
+    path = write(tmp_path, "def good(x):\n    return x\n\ndef bad(y):\n    return y\n")
+
+    result = client.analyze_function(path, "bad")
+    assert result.status == "ok"
+    assert result.found_problems
+    assert not result.cache_hit
+    authorization, body = EchoHandler.requests_seen[0]
+    assert authorization == "Bearer id-token"
+    assert body["test_func"] == "def bad(y):\n    return y"
+    assert body["file_name"] == "funcs.py"
+    assert body["pip_imports"] == []
+
+    again = client.analyze_function(path, "bad")
+    assert again.cache_hit
+    assert again.text == result.text
+    assert len(EchoHandler.requests_seen) == 1
+
+def test_analyze_many(tmp_path, server):
+    client = make_client(server)
+    path = write(tmp_path, "def good(x):\n    return x\n\ndef explode(y):\n    return y\n")
+    results = client.analyze_many([(path, "good"), (path, "explode"), (path, "missing")])
+    assert [r.function for r in results] == ["good", "explode", "missing"]
+    assert [r.status for r in results] == ["ok", "error", "error"]
+    assert results[1].status_code == 500
+    assert "not found" in results[2].error
+
+def test_batch_falls_back_to_single_requests(tmp_path, server):
+    client = make_client(server)
+    path = write(tmp_path, "def good(x):\n    return x\n\ndef bad(y):\n    return y\n")
+    results = list(client.iter_analyze_file(path))
+    assert sorted((r.function, r.status, r.found_problems) for r in results) == [
+        ("bad", "ok", True), ("good", "ok", False)]
+    assert sorted(body["test_func"] for _, body in EchoHandler.requests_seen) == [
+        "def bad(y):\n    return y", "def good(x):\n    return x"]
+
+def test_result_record():
+    text = """Checked 2 properties:
+✅ output is sorted
+❌ - output has the same length
+```python
+assert f("❌") == 1
+```
+Suggested patch:
+```python
+def f(x):
+    return 1
+```
+"""
+    result = AnalysisResult(
+        "funcs.py", "f", "ok", text=text, duration=1.23456, patch_requested=True)
+    record = result.to_record()
+    assert record["properties"] == [
+        {"name": "output is sorted", "passed": True},
+        {"name": "output has the same length", "passed": False},
+    ]
+    assert record["found_problems"]
+    assert record["patch"] == "def f(x):\n    return 1"
+    assert record["timings"]["request"] == 1.235
+    assert AnalysisResult("funcs.py", "f", "ok", text=text).to_record()["patch"] is None
+    assert AnalysisResult.from_json(result.to_json()).to_record() == record
+
+def test_job_worker_fails_rejected_requests_and_logs_in_again(tmp_path, server, monkeypatch):
+    path = write(tmp_path, "def f(x):\n    return x\n\ndef reject(x):\n    return x\n")
+    client = BenchifyClient(url=server, auth_tokens=AuthTokens("expired", "expired"))
+    logins = []
+    def fresh_login():
+        logins.append(1)
+        return AuthTokens("id-token", "access-token")
+    monkeypatch.setattr(client_module, "login", fresh_login)
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    job_ids = [
+        queue.submit(path, name, client.build_params(path, source, False, name))
+        for name, source in [client.select_function(path, name) for name in ["f", "reject"]]
+    ]
+    queue.drain(make_job_worker(client), concurrency=1)
+    done, rejected = [queue.get(job_id) for job_id in job_ids]
+    # The expired token was renewed once, and the request resubmitted
+    assert logins == [1]
+    assert done.status == DONE and done.attempts == 1
+    # A rejected request fails at once, rather than becoming the job's result
+    assert rejected.status == FAILED and rejected.attempts == 1
+    assert "413" in rejected.error
+
+def test_latency_history(tmp_path, server):
+    store = LatencyStore(str(tmp_path / "latency.sqlite"), min_samples=1)
+    client = BenchifyClient(
+        url=server,
+        auth_tokens=AuthTokens("id-token", "access-token"),
+        latency_store=store)
+    path = write(tmp_path, "def good(x):\n    return x\n")
+    assert client.estimate_function(path).samples == 0
+    assert client.analyze_function(path).status == "ok"
+    estimate = client.estimate_function(path)
+    assert estimate.samples == 1
+    assert estimate.timeout == store.min_timeout
+
+class StreamingBatchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for function in body["functions"]:
+            time.sleep(0.2)
+            record = {"name": function["name"], "status": 200, "text": "✅ all good"}
+            line = json.dumps(record).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+def test_batch_records_each_function_latency(tmp_path):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StreamingBatchHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    store = LatencyStore(str(tmp_path / "latency.sqlite"), min_samples=1)
+    client = BenchifyClient(
+        url=f"http://127.0.0.1:{httpd.server_address[1]}/analyze",
+        auth_tokens=AuthTokens("id-token", "access-token"),
+        latency_store=store)
+    path = write(tmp_path, "".join(f"def f{i}(x):\n    return x\n\n" for i in range(3)))
+    results = list(client.iter_analyze_file(path))
+    httpd.shutdown()
+    assert [result.status for result in results] == ["ok"] * 3
+    assert results[-1].duration > 0.5
+    durations = [row[0] for row in store.connection.execute("SELECT duration FROM samples")]
+    assert len(durations) == 3
+    # Each function took about 0.2s, not the time since the batch was sent
+    assert all(0.1 < duration < 0.45 for duration in durations)
+
+def test_prepare_overlaps_login(tmp_path, server, monkeypatch):
+    logged_in = threading.Event()
+    def slow_login():
+        logged_in.wait(5)
+        return AuthTokens("id-token", "access-token")
+    monkeypatch.setattr(client_module, "login", slow_login)
+    client = BenchifyClient(url=server)
+    path = write(tmp_path, "import os\n\ndef good(x):\n    return os.sep + x\n")
+
+    # The request is built while the login is still pending
+    name, params = client.prepare(path)
+    assert name == "good"
+    assert "def good" in params["test_code"]
+    assert client.auth_tokens is None
+    logged_in.set()
+    assert client.analyze_function(path).status == "ok"
+    assert EchoHandler.requests_seen[0][0] == "Bearer id-token"
+
+def test_interactive_prepare_logs_in_before_asking(tmp_path, server, monkeypatch):
+    events = []
+    def device_login():
+        time.sleep(0.2)
+        events.append("login")
+        return AuthTokens("id-token", "access-token")
+    def ask(prompt):
+        events.append("ask")
+        return "psf-requests"
+    monkeypatch.setattr(client_module, "load_valid_tokens", lambda report=True: None)
+    monkeypatch.setattr(client_module, "login", device_login)
+    monkeypatch.setattr(client_module, "can_import_via_pip", lambda name: name == "psf-requests")
+    monkeypatch.setattr("builtins.input", ask)
+    client = BenchifyClient(url=server, interactive=True)
+    path = write(tmp_path, "import requests\n\ndef good(x):\n    return requests.get(x)\n")
+
+    _, params = client.prepare(path)
+    assert events == ["login", "ask"]
+    assert params["pip_imports"] == ["psf-requests"]
+    assert client.auth_tokens.id_token == "id-token"
+
+def test_pypi_answers_are_shared(monkeypatch):
+    asked = []
+    class Response:
+        def __init__(self, status_code):
+            self.status_code = status_code
+    def get(url):
+        asked.append(url)
+        return Response(200 if "requests" in url else 404)
+    monkeypatch.setattr(source_manipulation, "PYPI_PROJECTS", {})
+    monkeypatch.setattr(source_manipulation.requests, "get", get)
+    assert resolve_pip_imports("unused.py", False, ["requests", "not-on-pypi"]) == ["requests"]
+    assert resolve_pip_imports("unused.py", False, ["requests", "not-on-pypi"]) == ["requests"]
+    assert len(asked) == 2
@@ -0,0 +1,117 @@
+from benchify.auth import AuthTokens
+from benchify.client import AmbiguousFunctionError, AnalysisError, BenchifyClient
+from benchify import daemon_client as daemon_client_module
+from benchify.daemon import DaemonClient, make_daemon_server
+from benchify.function_index import FunctionIndex
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import types
+
+import pytest
+
+class OkHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write("✅ all good".encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def daemon(tmp_path):
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    client = BenchifyClient(
+        url=f"http://127.0.0.1:{upstream.server_address[1]}/analyze",
+        auth_tokens=AuthTokens("id-token", "access-token"))
+    socket_path = str(tmp_path / "daemon.sock")
+    server = make_daemon_server(socket_path, client)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield socket_path, client
+    DaemonClient(socket_path).stop()
+    thread.join(5)
+    server.server_close()
+    upstream.shutdown()
+
+def test_daemon_round_trip(tmp_path, daemon):
+    socket_path, client = daemon
+    path = tmp_path / "funcs.py"
+    path.write_text("def a(x):\n    return x\n\ndef b(y):\n    return y\n")
+
+    daemon_client = DaemonClient.connect(socket_path)
+    assert daemon_client is not None
+    assert oct(os.stat(socket_path).st_mode & 0o777) == oct(0o600)
+    with pytest.raises(AmbiguousFunctionError) as ambiguous:
+        daemon_client.select_function(str(path))
+    assert ambiguous.value.function_names == ["a", "b"]
+    with pytest.raises(AnalysisError):
+        daemon_client.select_function(str(path), "missing")
+    assert daemon_client.select_function(str(path), "b") == ("b", "def b(y):\n    return y")
+
+    estimates = []
+    result = daemon_client.analyze_function(str(path), "a", on_estimate=estimates.append)
+    assert (result.status, result.text, result.cache_hit) == ("ok", "✅ all good", False)
+    # The estimate is sent ahead of the result, on the same connection
+    assert [estimate.samples for estimate in estimates] == [0]
+    assert daemon_client.analyze_function(str(path), "a").cache_hit
+    assert os.path.normpath(str(path)) in client.index.modules
+
+def test_daemon_answers_unexpected_errors(tmp_path, daemon, monkeypatch):
+    socket_path, client = daemon
+    path = tmp_path / "funcs.py"
+    path.write_text("def a(x):\n    return x\n")
+
+    def broken_build_params(*args):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(client, "build_params", broken_build_params)
+    daemon_client = DaemonClient(socket_path)
+    result = daemon_client.analyze_function(str(path), "a")
+    assert (result.status, result.error) == ("error", "RuntimeError: broken")
+    assert daemon_client.request({"command": "analyze"}, 5)["error_type"] == "request"
+    assert daemon_client.request(["ping"], 5)["error_type"] == "request"
+    # The daemon keeps serving
+    monkeypatch.undo()
+    assert daemon_client.analyze_function(str(path), "a").status == "ok"
+
+def test_daemon_forgets_the_environment_when_it_changes(tmp_path, daemon, monkeypatch):
+    socket_path, client = daemon
+    client.manifests[("stale",)] = {"hash": "stale"}
+    client.index.import_classifications[("a.py", "stale")] = ("stale", "stale")
+    daemon_client = DaemonClient(socket_path)
+    assert daemon_client.ping()
+    assert ("stale",) in client.manifests
+
+    # e.g. a package installed into a new sys.path entry
+    site_packages = tmp_path / "site-packages"
+    site_packages.mkdir()
+    monkeypatch.syspath_prepend(str(site_packages))
+    assert daemon_client.ping()
+    assert not client.manifests and not client.index.import_classifications
+
+def test_connect_only_to_a_daemon_of_this_environment(daemon, monkeypatch):
+    socket_path, _ = daemon
+    assert DaemonClient.connect(socket_path) is not None
+    monkeypatch.setattr(daemon_client_module, "sys", types.SimpleNamespace(prefix="/other/venv"))
+    assert DaemonClient.connect(socket_path) is None
+
+def test_connect_without_daemon(tmp_path):
+    assert DaemonClient.connect(str(tmp_path / "missing.sock")) is None
+
+def test_function_index_lru(tmp_path):
+    index = FunctionIndex(max_modules=2)
+    paths = []
+    for name in ["a", "b", "c"]:
+        path = tmp_path / f"{name}.py"
+        path.write_text(f"def {name}():\n    return 1\n")
+        paths.append(os.path.normpath(str(path)))
+    index.get(paths[0])
+    index.get(paths[1])
+    index.get(paths[0])
+    index.get(paths[2])
+    assert list(index.modules) == [paths[0], paths[2]]
@@ -0,0 +1,68 @@
+from benchify.environment import \
+    build_environment_manifest, \
+    canonicalize_name, \
+    find_module_directory, \
+    get_import_distributions, \
+    hash_manifest, \
+    invalidate_caches, \
+    is_installed_module, \
+    list_modules
+
+import platform
+import sys
+import zipfile
+
+import pytest
+
+import requests
+
+def test_build_environment_manifest():
+    manifest = build_environment_manifest(
+        ["requests", "yaml_alias", "definitely_not_installed_pkg"],
+        import_distributions={"yaml_alias": ["Requests"]})
+    assert manifest["python"] == platform.python_version()
+    assert manifest["distributions"] == [
+        {"name": "requests", "version": requests.__version__}]
+    assert manifest["unresolved"] == ["definitely_not_installed_pkg"]
+    assert manifest["hash"] == hash_manifest(manifest)
+
+    reordered = build_environment_manifest(
+        ["definitely_not_installed_pkg", "requests"], import_distributions={})
+    assert reordered["hash"] == manifest["hash"]
+    assert build_environment_manifest(["requests"])["hash"] != manifest["hash"]
+
+def test_import_distributions():
+    assert "requests" in [canonicalize_name(name) for name in get_import_distributions()["requests"]]
+    assert canonicalize_name("Typing_Extensions") == "typing-extensions"
+
+def test_modules_are_found_without_importing_them(tmp_path, monkeypatch):
+    package = tmp_path / "heavy_pkg"
+    (package / "sub").mkdir(parents=True)
+    (package / "__init__.py").write_text("raise RuntimeError('imported!')\n")
+    (package / "sub" / "__init__.py").write_text("")
+    (package / "linalg.cpython-311-x86_64-linux-gnu.so").write_text("")
+    (tmp_path / "single_module.py").write_text("raise RuntimeError('imported!')\n")
+    (tmp_path / "LICENSE").write_text("")
+    with zipfile.ZipFile(tmp_path / "bundle.zip", "w") as archive:
+        archive.writestr("zipped/__init__.py", "")
+    monkeypatch.setattr(sys, "path", [str(tmp_path), str(tmp_path / "bundle.zip")] + sys.path)
+
+    assert {"heavy_pkg", "single_module"} <= list_modules(str(tmp_path))
+    assert "LICENSE" not in list_modules(str(tmp_path))
+    assert find_module_directory("heavy_pkg.sub") == str(tmp_path)
+    assert find_module_directory("heavy_pkg.linalg") == str(tmp_path)
+    assert find_module_directory("heavy_pkg.missing") is None
+    assert find_module_directory("zipped") == str(tmp_path / "bundle.zip")
+    assert is_installed_module("single_module")
+    assert not is_installed_module("heavy_pkg.missing")
+    assert "heavy_pkg" not in sys.modules and "single_module" not in sys.modules
+    # Distribution names count too
+    assert is_installed_module("PyJWT")
+    with pytest.raises(ValueError):
+        is_installed_module("")
+
+    # Listings are cached until invalidated
+    (tmp_path / "late_module.py").write_text("")
+    assert not is_installed_module("late_module")
+    invalidate_caches()
+    assert is_installed_module("late_module")
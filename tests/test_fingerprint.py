@@ -0,0 +1,72 @@
+from benchify.fingerprint import fingerprint_code, fingerprint_params
+from benchify.main import dedupe_requests
+from benchify.source_manipulation import remove_docstrings
+
+CODE = """import math
+
+SCALE = 2
+
+def helper(x):
+    return x * SCALE
+
+def unrelated():
+    return 0
+
+def foo(x):
+    \"\"\"Takes the root of the scaled x.\"\"\"
+    return math.sqrt(helper(x))
+"""
+
+FUNC = """def foo(x):
+    \"\"\"Takes the root of the scaled x.\"\"\"
+    return math.sqrt(helper(x))"""
+
+def make_params(test_code=CODE, test_func=FUNC, file_name="funcs.py"):
+    return {
+        "test_code": test_code,
+        "test_func": test_func,
+        "file_name": file_name,
+        "pip_imports": [],
+        "patch": False,
+    }
+
+def test_cosmetic_changes_keep_the_fingerprint():
+    reformatted = """def foo(x):   # the root
+    return math.sqrt(
+        helper(x)
+    )"""
+    assert fingerprint_code(FUNC) == fingerprint_code(reformatted)
+    assert fingerprint_code(FUNC) != fingerprint_code(FUNC.replace("sqrt", "log"))
+    assert fingerprint_code("    def method(self):\n        return 1") == \
+        fingerprint_code("def method(self):\n    return 1")
+
+def test_params_fingerprint_depends_on_the_slice():
+    key = fingerprint_params(make_params())
+    # Docstrings, comments, unrelated code and the file name do not matter
+    assert fingerprint_params(make_params(
+        test_code=remove_docstrings(CODE), test_func=remove_docstrings(FUNC))) == key
+    assert fingerprint_params(make_params(
+        test_code=CODE.replace("return 0", "return 1  # changed"))) == key
+    assert fingerprint_params(make_params(file_name="copy.py")) == key
+    # What foo depends on, and the other settings, do
+    assert fingerprint_params(make_params(
+        test_code=CODE.replace("SCALE = 2", "SCALE = 3"))) != key
+    assert fingerprint_params(make_params(
+        test_code=CODE.replace("x * SCALE", "x + SCALE"))) != key
+    assert fingerprint_params(dict(make_params(), patch=True)) != key
+
+def test_unparsable_code_is_hashed_as_is():
+    params = make_params(test_code="def foo(:\n", test_func="def foo(:")
+    assert fingerprint_params(params) == fingerprint_params(dict(params))
+    assert fingerprint_params(params) != \
+        fingerprint_params(make_params(test_code="def foo(: \n", test_func="def foo(:"))
+
+def test_dedupe_requests():
+    requests = [
+        ("a.py", "foo", make_params(file_name="a.py")),
+        ("b.py", "foo", make_params(file_name="b.py")),
+        ("a.py", "bar", make_params(test_func="def bar():\n    return 1")),
+    ]
+    unique, duplicates = dedupe_requests(requests)
+    assert [(file, name) for file, name, _ in unique] == [("a.py", "foo"), ("a.py", "bar")]
+    assert duplicates == {("a.py", "foo"): [("b.py", "foo")]}
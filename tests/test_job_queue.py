@@ -0,0 +1,127 @@
+from benchify.job_queue import \
+    DONE, \
+    FAILED, \
+    PENDING, \
+    RUNNING, \
+    JobQueue, \
+    PermanentJobError
+
+import socket
+import threading
+import time
+
+def test_submit_deduplicates(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    first = queue.submit("a.py", "foo", {"test_func": "def foo(): pass"})
+    assert queue.submit("a.py", "foo", {"test_func": "def foo(): pass"}) == first
+    assert queue.submit("a.py", "foo", {"test_func": "def foo(): return 1"}) != first
+    assert queue.counts() == {PENDING: 2}
+
+def test_drain_records_results_and_retries(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=2, retry_backoff=0.05)
+    ok_id = queue.submit("a.py", "ok", {"n": 1})
+    flaky_id = queue.submit("a.py", "flaky", {"n": 2})
+    broken_id = queue.submit("a.py", "broken", {"n": 3})
+
+    calls = {"flaky": 0}
+    lock = threading.Lock()
+    def worker(job):
+        if job.function == "broken":
+            raise RuntimeError("nope")
+        if job.function == "flaky":
+            with lock:
+                calls["flaky"] += 1
+                if calls["flaky"] == 1:
+                    raise TimeoutError("blip")
+        return "result " + job.function
+
+    finished = []
+    queue.drain(worker, concurrency=3, on_finished=finished.append)
+    assert queue.get(ok_id).result == "result ok"
+    assert queue.get(flaky_id).status == DONE
+    assert queue.get(flaky_id).attempts == 2
+    assert queue.get(broken_id).status == FAILED
+    assert queue.get(broken_id).error == "RuntimeError: nope"
+    assert len(finished) == 5
+
+    # Done work is not redone, failed work is requeued on resubmission
+    assert queue.submit("a.py", "ok", {"n": 1}) == ok_id
+    assert queue.get(ok_id).status == DONE
+    assert queue.submit("a.py", "broken", {"n": 3}) == broken_id
+    assert queue.get(broken_id).status == PENDING
+
+def test_retries_wait_out_a_backoff(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=3, retry_backoff=0.4)
+    job_id = queue.submit("a.py", "flaky", {"n": 1})
+    attempts = []
+    def worker(job):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise ConnectionError("blip")
+        return "result"
+
+    queue.drain(worker, concurrency=2)
+    job = queue.get(job_id)
+    assert (job.status, job.attempts, job.result) == (DONE, 2, "result")
+    # The retry waited for at least half the backoff, rather than
+    # using up the attempts while the network was down
+    assert attempts[1] - attempts[0] >= 0.2
+
+    # A failed job is not claimed again before its backoff is over
+    queue.submit("a.py", "flaky", {"n": 2})
+    failed = queue.claim()
+    queue.fail(failed.id, "blip")
+    assert queue.claim() is None
+    assert queue.get_next_retry_at() > time.time()
+
+def test_permanent_errors_are_not_retried(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"), max_attempts=3)
+    job_id = queue.submit("a.py", "rejected", {"n": 1})
+    def worker(job):
+        raise PermanentJobError("Server responded with 400")
+    queue.drain(worker)
+    assert queue.get(job_id).status == FAILED
+    assert queue.get(job_id).attempts == 1
+    assert queue.get(job_id).error == "Server responded with 400"
+
+def test_drain_only_the_given_jobs(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    leftover_id = queue.submit("other/repo.py", "old", {"n": 0})
+    run_ids = [queue.submit("a.py", f"f{n}", {"n": n}) for n in range(1, 4)]
+    assert queue.counts(run_ids) == {PENDING: 3}
+    assert queue.counts() == {PENDING: 4}
+    queue.drain(lambda job: "done", job_ids=run_ids)
+    assert queue.counts(run_ids) == {DONE: 3}
+    assert queue.get(leftover_id).status == PENDING
+    assert queue.claim([]) is None
+
+def test_recover_interrupted_jobs(tmp_path):
+    db_path = str(tmp_path / "jobs.sqlite")
+    queue = JobQueue(db_path)
+    job_id = queue.submit("a.py", "foo", {"n": 1})
+    assert queue.claim().id == job_id
+    # A live owner (us) keeps its job
+    assert queue.recover() == 0
+    # Pretend we were a process on this host that has since died
+    queue.execute(
+        "UPDATE jobs SET owner = ? WHERE id = ?",
+        (f"{socket.gethostname()}:999999999", job_id))
+    queue.close()
+
+    queue = JobQueue(db_path)
+    assert queue.get(job_id).status == RUNNING
+    assert queue.recover() == 1
+    assert queue.claim().id == job_id
+
+def test_find_and_drain_until_deadline(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite"))
+    assert queue.find("a.py", "foo", {"n": 0}) is None
+    job_ids = [queue.submit("a.py", "foo", {"n": n}) for n in range(5)]
+    assert queue.find("a.py", "foo", {"n": 3}).id == job_ids[3]
+
+    def worker(job):
+        time.sleep(0.2)
+        return "done"
+
+    queue.drain(worker, concurrency=1, deadline=time.monotonic() + 0.3)
+    assert queue.counts() == {DONE: 2, PENDING: 3}
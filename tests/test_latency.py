@@ -0,0 +1,45 @@
+from benchify.latency import \
+    FALLBACK_TIMEOUT, \
+    LatencyStore, \
+    estimate_batch, \
+    format_duration, \
+    percentile
+
+def make_params(lines, patch=False):
+    return {
+        "test_func": "\n".join(["x = 1"] * lines),
+        "test_code": "y = 2\n" * lines,
+        "pip_imports": [],
+        "patch_requested": patch,
+    }
+
+def test_percentile_and_format():
+    assert percentile([5, 1, 3, 2, 4], 0.5) == 3
+    assert percentile([5, 1, 3, 2, 4], 0.99) == 5
+    assert format_duration(1) == "1 second"
+    assert format_duration(40.4) == "40 seconds"
+    assert format_duration(180) == "3 minutes"
+    assert estimate_batch([10, 10, 10, 10], 2) == 20
+    assert estimate_batch([50, 1, 1], 4) == 50
+
+def test_estimates_from_similar_requests(tmp_path):
+    store = LatencyStore(str(tmp_path / "latency.sqlite"), neighbors=5, min_samples=3)
+    assert store.estimate(make_params(3)).timeout == FALLBACK_TIMEOUT
+
+    for duration in [10, 11, 12, 13, 14]:
+        store.record(make_params(3), duration, "ok")
+    for duration in [100, 110, 120, 130, 140]:
+        store.record(make_params(300), duration, "ok")
+
+    small = store.estimate(make_params(4))
+    assert small.expected == 12
+    assert small.timeout == 30
+    big = store.estimate(make_params(250))
+    assert big.expected == 120
+    assert big.timeout == 280
+    assert store.estimate(make_params(4, patch=True)).samples == 0
+
+    for _ in range(5):
+        store.record(make_params(300), 280, "timeout")
+    assert store.estimate(make_params(300)).timeout == 560
+    store.close()
@@ -0,0 +1,125 @@
+from benchify import auth
+from benchify.auth import AuthTokens, login
+from benchify.client import BenchifyClient
+from benchify.load_test import run_load_test
+from benchify.mock_server import MockServer
+from benchify.storage import FileLock
+
+import threading
+
+import pytest
+import requests
+
+def start(**options):
+    server = MockServer(("127.0.0.1", 0), seed=0, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+@pytest.fixture
+def mock_server():
+    server, base_url = start(failure_rate=0.5)
+    yield server, base_url
+    server.shutdown()
+    server.server_close()
+
+def test_login_against_mock_server(tmp_path, monkeypatch, mock_server):
+    _, base_url = mock_server
+    monkeypatch.setenv("BENCHIFY_AUTH_URL", base_url)
+    monkeypatch.setattr(auth, "get_token_file_path", lambda: str(tmp_path / "token.pickle"))
+    monkeypatch.setattr(auth.webbrowser, "open", lambda *args, **kwargs: True)
+    tokens = login()
+    assert tokens.user["name"] == "Mock User"
+    assert (tmp_path / "token.pickle").exists()
+    # The saved token is now valid, so it is reused, without waiting for
+    # the lock another process renewing the token would hold
+    with FileLock(str(tmp_path / "token.pickle.lock")):
+        reused = []
+        thread = threading.Thread(target=lambda: reused.append(login()), daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+    assert [token.id_token for token in reused] == [tokens.id_token]
+
+def test_concurrent_logins_share_one_device_flow(tmp_path, monkeypatch, mock_server):
+    _, base_url = mock_server
+    monkeypatch.setenv("BENCHIFY_AUTH_URL", base_url)
+    monkeypatch.setattr(auth, "get_token_file_path", lambda: str(tmp_path / "token.pickle"))
+    monkeypatch.setattr(auth.webbrowser, "open", lambda *args, **kwargs: True)
+    # A token left truncated (by an older version) counts as no token
+    (tmp_path / "token.pickle").write_bytes(b"\x80\x04\x95")
+    assert auth.load_token() is None
+    device_flows = []
+    post = requests.post
+
+    def counting_post(url, *args, **kwargs):
+        if url.endswith("/oauth/device/code"):
+            device_flows.append(url)
+        return post(url, *args, **kwargs)
+
+    monkeypatch.setattr(auth.requests, "post", counting_post)
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(login())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(device_flows) == 1
+    assert len({token.id_token for token in tokens}) == 1
+
+def test_analyze_against_mock_server(tmp_path, mock_server):
+    server, base_url = mock_server
+    client = BenchifyClient(
+        url=f"{base_url}/analyze", auth_tokens=AuthTokens("token", "token"))
+    path = tmp_path / "funcs.py"
+    path.write_text("def f(x):\n    return x\n")
+    result = client.analyze_function(str(path), patch=True)
+    assert result.status == "ok"
+    assert [p["name"] for p in result.properties] == [
+        "f does not crash on valid inputs",
+        "f is deterministic",
+        "f preserves its input",
+    ]
+    assert server.stats == {200: 1}
+    assert requests.post(f"{base_url}/analyze", json={}, timeout=5).status_code == 401
+
+def test_streaming_errors_and_throttling():
+    server, base_url = start(stream=True, latency=0.05)
+    response = requests.post(
+        f"{base_url}/analyze", json={"test_func": "def g():\n    pass"},
+        headers={"Authorization": "Bearer x"}, stream=True, timeout=5)
+    lines = [line for line in response.iter_lines(decode_unicode=True) if line]
+    assert lines[0] == "Analyzed g from unknown.py."
+    assert len(lines) == 4
+    server.shutdown()
+
+    server, base_url = start(error_rate=0.5, throttle_rate=0.2)
+    client = BenchifyClient(
+        url=f"{base_url}/analyze", auth_tokens=AuthTokens("token", "token"), max_workers=8)
+    client.scheduler.backoff = 0.01
+    report = run_load_test(client, requests=40, concurrency=8)
+    assert report.requests == 40
+    assert set(report.statuses) <= {"ok (200)", "error (500)", "error (429)"}
+    assert report.statuses["error (500)"] > 0
+    assert report.latencies["p50"] <= report.latencies["p99"] <= report.latencies["max"]
+    assert server.stats.get(429, 0) > 0
+    server.shutdown()
+
+def test_batched_analysis(tmp_path):
+    server, base_url = start(failure_rate=0.5, latency=0.05, jitter=0.9)
+    client = BenchifyClient(
+        url=f"{base_url}/analyze", auth_tokens=AuthTokens("token", "token"))
+    path = tmp_path / "funcs.py"
+    path.write_text("def f(x):\n    return x\n\ndef g(y):\n    return y\n\nh = lambda z : z\n")
+    results = list(client.iter_analyze_file(str(path)))
+    assert sorted(result.function for result in results) == ["f", "g", "h"]
+    assert all(result.status == "ok" and not result.cache_hit for result in results)
+    for result in results:
+        assert result.text.startswith(f"Analyzed {result.function} from funcs.py.")
+    # One request carried all three functions
+    assert server.stats == {200: 3}
+
+    # Already analyzed functions are answered from the cache
+    results = list(client.iter_analyze_file(str(path), ["f", "missing"]))
+    assert [(result.function, result.status, result.cache_hit) for result in results] == [
+        ("missing", "error", False), ("f", "ok", True)]
+    assert server.stats == {200: 3}
+    server.shutdown()
@@ -0,0 +1,71 @@
+from benchify.module_graph import ModuleGraph, load_module_graph
+
+import os
+import time
+
+def write(path, code):
+    with open(path, "w") as fw:
+        fw.write(code)
+
+def make_project(root):
+    write(os.path.join(root, "base.py"), "SCALE = 2\n\ndef scale(x):\n    return x * SCALE\n")
+    write(os.path.join(root, "mid.py"), """from .base import scale
+
+def double_scale(x):
+    return scale(scale(x))
+
+def unrelated(y):
+    return y
+""")
+    write(os.path.join(root, "top.py"), """from .mid import double_scale
+
+def run(x):
+    return double_scale(x)
+""")
+    write(os.path.join(root, "alone.py"), "def alone():\n    return 1\n")
+    return [os.path.join(root, name) for name in ["alone.py", "base.py", "mid.py", "top.py"]]
+
+def test_dependents_and_impacted_functions(tmp_path):
+    root = str(tmp_path)
+    files = make_project(root)
+    graph = ModuleGraph(root)
+    assert graph.refresh(files) == set(files)
+
+    base, mid, top = files[1], files[2], files[3]
+    assert graph.dependents(base) == {base, mid, top}
+    assert graph.dependents(top) == {top}
+    assert graph.impacted_functions(base) == {
+        base: ["scale"],
+        mid: ["double_scale"],
+        top: ["run"],
+    }
+
+def test_refresh_is_incremental(tmp_path):
+    root = str(tmp_path)
+    files = make_project(root)
+    graph = ModuleGraph(root)
+    graph.refresh(files)
+    assert graph.refresh(files) == set()
+
+    mid, top = files[2], files[3]
+    time.sleep(0.01)
+    write(top, "def run(x):\n    return x\n")
+    os.utime(top, (time.time() + 5, time.time() + 5))
+    assert graph.refresh(files) == {top}
+    assert graph.dependents(mid) == {mid}
+
+def test_json_round_trip_and_dot(tmp_path):
+    root = str(tmp_path)
+    files = make_project(root)
+    graph_path = os.path.join(root, "cache", "graph.json")
+    graph = load_module_graph(root, files, graph_path=graph_path)
+    assert os.path.exists(graph_path)
+
+    loaded = load_module_graph(root, files, graph_path=graph_path)
+    assert loaded.to_json() == graph.to_json()
+    assert loaded.dependents(files[1]) == graph.dependents(files[1])
+
+    dot = graph.to_dot()
+    assert dot.startswith("digraph modules {")
+    assert 'label="top.py"' in dot
+    assert dot.count("->") == 2
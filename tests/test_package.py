@@ -0,0 +1,29 @@
+import benchify
+from benchify import source_manipulation
+
+import subprocess
+import sys
+
+def test_all_lists_the_public_names():
+    defined = {
+        name for name, value in vars(source_manipulation).items()
+        if not name.startswith("_") and (
+            getattr(value, "__module__", None) == source_manipulation.__name__ or name.isupper())
+    }
+    assert defined <= set(benchify.__all__)
+    assert {"AnalysisResult", "BenchifyClient"} <= set(benchify.__all__)
+    assert set(benchify.__all__) <= set(dir(benchify))
+    for name in benchify.__all__:
+        assert getattr(benchify, name) is not None
+
+def test_star_import():
+    namespace = {}
+    exec("from benchify import *", namespace)
+    assert set(namespace) - {"__builtins__"} == set(benchify.__all__)
+
+def test_import_is_lazy():
+    code = "import sys, benchify; " + \
+        "print(sorted(name for name in sys.modules if name.startswith('benchify')))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "['benchify']"
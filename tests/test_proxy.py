@@ -0,0 +1,93 @@
+from benchify.auth import AuthTokens
+from benchify.client import BenchifyClient
+from benchify.latency import LatencyStore
+from benchify.proxy import AnalysisProxy, make_proxy_server
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+import requests
+
+class SlowHandler(BaseHTTPRequestHandler):
+    requests_seen = 0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        SlowHandler.requests_seen += 1
+        time.sleep(0.3)
+        status = 500 if b"explode" in body else 200
+        if b"throttle" in body:
+            status = 429
+        text = f"analyzed for {self.headers['Authorization']}".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain")
+        if status == 429:
+            self.send_header("Retry-After", "7")
+        self.end_headers()
+        self.wfile.write(text)
+
+    def log_message(self, *args):
+        pass
+
+def serve(httpd):
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return f"http://127.0.0.1:{httpd.server_address[1]}/analyze"
+
+@pytest.fixture
+def proxy_url():
+    SlowHandler.requests_seen = 0
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    proxy = make_proxy_server(port=0, proxy=AnalysisProxy(upstream=serve(upstream)))
+    yield serve(proxy), proxy.proxy
+    proxy.shutdown()
+    upstream.shutdown()
+
+def post(url, body, token="a"):
+    return requests.post(
+        url, data=body, headers={"Authorization": f"Bearer {token}"}, timeout=10)
+
+def test_identical_requests_are_coalesced(proxy_url):
+    url, proxy = proxy_url
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        responses = list(executor.map(lambda _: post(url, b'{"x": 1}'), range(6)))
+    assert SlowHandler.requests_seen == 1
+    assert {response.text for response in responses} == {"analyzed for Bearer a"}
+    assert all(response.headers["Content-Type"] == "text/plain" for response in responses)
+    assert sorted(response.headers["X-Benchify-Proxy"] for response in responses).count("miss") == 1
+
+    assert post(url, b'{"x": 1}').headers["X-Benchify-Proxy"] == "hit"
+    assert post(url, b'{"x": 1}', token="b").text == "analyzed for Bearer b"
+    assert SlowHandler.requests_seen == 2
+    assert proxy.stats["upstream"] == 2
+
+def test_errors_are_not_cached(proxy_url):
+    url, _ = proxy_url
+    assert post(url, b"explode").status_code == 500
+    assert post(url, b"explode").headers["X-Benchify-Proxy"] == "miss"
+    assert SlowHandler.requests_seen == 2
+    assert requests.post(url.replace("/analyze", "/other"), data=b"", timeout=10).status_code == 404
+
+def test_retry_after_is_forwarded(proxy_url):
+    url, _ = proxy_url
+    response = post(url, b"throttle")
+    assert (response.status_code, response.headers["Retry-After"]) == (429, "7")
+
+def test_cache_eviction():
+    proxy = AnalysisProxy(upstream="http://unused", cache_size=2)
+    for key in ["a", "b", "c"]:
+        proxy.store(key, None)
+    assert list(proxy.cache) == ["b", "c"]
+
+def test_proxy_waits_as_long_as_clients(tmp_path):
+    store = LatencyStore(str(tmp_path / "latency.sqlite"))
+    assert AnalysisProxy(upstream="http://unused").timeout >= store.max_timeout
+
+def test_client_uses_benchify_url(monkeypatch, proxy_url):
+    url, _ = proxy_url
+    monkeypatch.setenv("BENCHIFY_URL", url)
+    client = BenchifyClient(auth_tokens=AuthTokens("id-token", "access-token"))
+    assert client.url == url
@@ -0,0 +1,75 @@
+from benchify import client as client_module
+from benchify.auth import AuthTokens
+from benchify.mock_server import MockServer
+from benchify.pytest_analysis import claim
+
+import subprocess
+import sys
+import threading
+
+pytest_plugins = ["pytester"]
+
+def test_claim(tmp_path):
+    path = str(tmp_path / "claim")
+    assert claim(path)
+    assert not claim(path)
+
+def test_plugin_is_light_without_benchify():
+    # pytest loads the plugin in every run, so it must not import the client
+    code = "import sys, benchify.pytest_plugin; " + \
+        "print(sorted(name for name in sys.modules if name.startswith(('benchify.', 'requests'))))"
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "['benchify.pytest_plugin']"
+
+def test_plugin_analyzes_exercised_and_marked_functions(pytester, monkeypatch, tmp_path):
+    server = MockServer(("127.0.0.1", 0), seed=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("BENCHIFY_URL", f"http://127.0.0.1:{server.server_address[1]}/analyze")
+    monkeypatch.setattr(client_module, "login", lambda: AuthTokens("token", "token"))
+    monkeypatch.setattr(
+        "benchify.pytest_analysis.get_default_cache_dir", lambda: str(tmp_path / "cache"))
+
+    pytester.makepyfile(
+        mylib="""
+def double(x):
+    return helper(x) * 2
+
+def helper(x):
+    return x
+
+def marked(x):
+    return x
+
+def unused(x):
+    return x
+""",
+        test_mylib="""
+import pytest
+from mylib import double
+
+@pytest.mark.benchify("mylib.py::marked")
+def test_double():
+    assert double(2) == 4
+""")
+    args = ["-p", "benchify.pytest_plugin", "--benchify", "-p", "no:cacheprovider"]
+    result = pytester.runpytest(*args)
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines([
+        "*benchify*",
+        "mylib.py::double: ✅ 3 properties hold",
+        "mylib.py::helper: ✅ 3 properties hold",
+        "mylib.py::marked: ✅ 3 properties hold",
+    ])
+    assert "unused" not in result.stdout.str()
+    assert server.stats == {200: 3}
+
+    # The next run reuses the cached results
+    result = pytester.runpytest(*args)
+    result.stdout.fnmatch_lines(["mylib.py::double: ✅ 3 properties hold"])
+    assert server.stats == {200: 3}
+
+    # Without --benchify, nothing happens
+    result = pytester.runpytest("-p", "benchify.pytest_plugin", "-p", "no:cacheprovider")
+    assert "properties hold" not in result.stdout.str()
+    server.shutdown()
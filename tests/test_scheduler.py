@@ -0,0 +1,96 @@
+from benchify.scheduler import \
+    AdaptiveLimiter, \
+    BudgetExhaustedError, \
+    SubmissionScheduler, \
+    TokenBucket, \
+    parse_retry_after
+
+import threading
+import time
+
+import pytest
+
+class FakeResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {"Retry-After": retry_after} if retry_after else {}
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:10 GMT", now=1445412480.0) == 10.0
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(initial=4, maximum=8, cooldown=0)
+    for _ in range(8):
+        limiter.acquire()
+        limiter.release(0.1, congested=False)
+    assert 5 < limiter.limit < 6
+    limiter.acquire()
+    limiter.release(0.1, congested=True)
+    assert 2.5 < limiter.limit < 3
+    limiter.acquire()
+    limiter.release(10.0, congested=False)
+    assert 1 < limiter.limit < 1.5
+
+def test_scheduler_honors_retry_after():
+    scheduler = SubmissionScheduler(max_concurrency=2, backoff=0.01)
+    responses = [FakeResponse(429, "0.2"), FakeResponse(429), FakeResponse(200)]
+    start = time.monotonic()
+    assert scheduler.call(lambda: responses.pop(0)).status_code == 200
+    assert time.monotonic() - start >= 0.2
+    assert not responses
+
+    scheduler.max_retries = 1
+    assert scheduler.call(lambda: FakeResponse(429)).status_code == 429
+    assert scheduler.call(lambda: FakeResponse(503)).status_code == 503
+
+def test_scheduler_gives_up_at_the_deadline():
+    scheduler = SubmissionScheduler(max_concurrency=2)
+    start = time.monotonic()
+    # The server asks for a retry only after the deadline
+    with pytest.raises(BudgetExhaustedError):
+        scheduler.call(lambda: FakeResponse(429, "30"), deadline=start + 1)
+    assert time.monotonic() - start < 0.5
+    # Every other request is paused too, and waits no longer than its deadline
+    with pytest.raises(BudgetExhaustedError):
+        scheduler.call(lambda: FakeResponse(200), deadline=time.monotonic() + 0.2)
+    assert time.monotonic() - start < 0.5
+
+    bucket = TokenBucket(rate=1, burst=1)
+    assert bucket.acquire(deadline=time.monotonic() + 0.1)
+    assert not bucket.acquire(deadline=time.monotonic() + 0.1)
+    limiter = AdaptiveLimiter(initial=1)
+    assert limiter.acquire(deadline=time.monotonic() + 0.1)
+    assert not limiter.acquire(deadline=time.monotonic() + 0.1)
+
+def test_scheduler_caps_concurrency():
+    scheduler = SubmissionScheduler(max_concurrency=2)
+    lock = threading.Lock()
+    in_flight = [0, 0]
+
+    def send():
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.05)
+        with lock:
+            in_flight[0] -= 1
+        return FakeResponse(500)
+
+    threads = [
+        threading.Thread(target=scheduler.call, args=(send,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert in_flight[1] <= 2
+    assert scheduler.limiter.limit == 1
@@ -0,0 +1,80 @@
+from benchify.sharding import \
+    assign_shards, \
+    merge_reports, \
+    parse_shard, \
+    predict_cost, \
+    read_report, \
+    shard_requests
+
+import json
+import random
+
+import pytest
+
+def make_params(lines, code_bytes=0, pip_imports=0):
+    return {
+        "test_func": "\n".join(["x = 1"] * lines),
+        "test_code": "#" * code_bytes,
+        "pip_imports": [f"package{i}" for i in range(pip_imports)],
+    }
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    assert parse_shard(" 1 / 1 ") == (1, 1)
+    for text in ["0/4", "5/4", "2", "a/b"]:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+def test_predict_cost_grows_with_the_request():
+    assert predict_cost(make_params(10)) < predict_cost(make_params(20))
+    assert predict_cost(make_params(10)) < predict_cost(make_params(10, code_bytes=4000))
+    assert predict_cost(make_params(10)) < predict_cost(make_params(10, pip_imports=1))
+
+def test_assign_shards_balances_costs():
+    costs = {"a": 8, "b": 7, "c": 6, "d": 5, "e": 4, "f": 1, "g": 1}
+    assignment = assign_shards(costs, 3)
+    loads = [sum(costs[key] for key in costs if assignment[key] == shard) for shard in [1, 2, 3]]
+    assert sorted(loads) == [10, 11, 11]
+    # One huge function gets a shard to itself
+    assignment = assign_shards({"huge": 100, "a": 1, "b": 1, "c": 1}, 2)
+    assert [key for key, shard in assignment.items() if shard == assignment["huge"]] == ["huge"]
+
+def test_shards_partition_requests_deterministically(tmp_path):
+    sizes = random.Random(0)
+    requests = [
+        (str(tmp_path / f"module{i % 3}.py"), f"f{i}", make_params(sizes.randint(1, 50)))
+        for i in range(40)
+    ]
+    shards = [shard_requests(requests, (index, 4), str(tmp_path)) for index in range(1, 5)]
+    assert sorted(name for shard in shards for _, name, _ in shard) == \
+        sorted(name for _, name, _ in requests)
+    # Other nodes, with their checkout elsewhere and another discovery order,
+    # compute the same split
+    moved = [
+        (file.replace(str(tmp_path), "/elsewhere"), name, params)
+        for file, name, params in reversed(requests)
+    ]
+    for index, shard in enumerate(shards, 1):
+        assert sorted(name for _, name, _ in shard_requests(moved, (index, 4), "/elsewhere")) == \
+            sorted(name for _, name, _ in shard)
+
+def test_merge_reports(tmp_path):
+    shard_1 = tmp_path / "shard-1.jsonl"
+    shard_1.write_text("\n".join(json.dumps(record) for record in [
+        {"file": "b.py", "function": "g", "status": "ok", "found_problems": True, "shard": "1/2"},
+        {"file": "a.py", "function": "f", "status": "queued", "shard": "1/2"},
+    ]) + "\n")
+    shard_2 = tmp_path / "shard-2.jsonl"
+    shard_2.write_text(json.dumps(
+        {"file": "a.py", "function": "f", "status": "ok", "found_problems": False,
+         "shard": "2/2"}) + "\n")
+    report = merge_reports([read_report(str(shard_1)), read_report(str(shard_2))])
+    assert report["shards"] == ["1/2", "2/2"]
+    assert report["summary"] == {"functions": 2, "found_problems": 1, "ok": 2}
+    assert [(record["file"], record["status"]) for record in report["records"]] == \
+        [("a.py", "ok"), ("b.py", "ok")]
+
+    # Merged reports can be merged again
+    merged = tmp_path / "report.json"
+    merged.write_text(json.dumps(report, indent=2))
+    assert merge_reports([read_report(str(merged))]) == report
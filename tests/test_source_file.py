@@ -0,0 +1,76 @@
+from benchify.function_index import FunctionIndex
+from benchify.source_file import SourceFile, build_line_offsets
+from benchify.source_manipulation import get_function_source_from_source
+
+import os
+
+CODE = """import math
+
+def foo(x):
+    return math.sqrt(x)
+
+class Thing:
+    def method(self):
+        return 1
+
+bar = lambda y : y * 2
+"""
+
+def test_build_line_offsets():
+    assert list(build_line_offsets(b"")) == [0]
+    assert list(build_line_offsets(b"a\nbc\n")) == [0, 2, 5]
+    assert list(build_line_offsets(b"a\nbc")) == [0, 2, 4]
+
+def test_get_lines_matches_splitlines(tmp_path):
+    path = tmp_path / "funcs.py"
+    path.write_text(CODE)
+    lines = CODE.splitlines()
+    with SourceFile(str(path)) as source_file:
+        assert source_file.line_count == len(lines)
+        assert source_file.text() == CODE
+        for start in range(1, len(lines) + 1):
+            for end in range(start, len(lines) + 2):
+                assert source_file.get_lines(start, end) == "\n".join(lines[start - 1:end])
+
+def test_get_lines_handles_crlf_and_encodings(tmp_path):
+    path = tmp_path / "crlf.py"
+    path.write_bytes(b"def foo():\r\n    return 1\r\n")
+    with SourceFile(str(path)) as source_file:
+        assert source_file.get_lines(1, 2) == "def foo():\n    return 1"
+
+    path = tmp_path / "latin.py"
+    path.write_bytes("# -*- coding: latin-1 -*-\nname = 'café'\n".encode("latin-1"))
+    with SourceFile(str(path)) as source_file:
+        assert source_file.get_lines(2, 2) == "name = 'café'"
+
+def test_empty_file(tmp_path):
+    path = tmp_path / "empty.py"
+    path.write_text("")
+    with SourceFile(str(path)) as source_file:
+        assert source_file.line_count == 0
+        assert source_file.text() == ""
+        assert source_file.get_lines(1, 3) == ""
+
+def test_line_offsets_are_reused_only_for_the_same_file(tmp_path):
+    path = tmp_path / "funcs.py"
+    path.write_text("a = 1\nbb = 2\n")
+    with SourceFile(str(path)) as source_file:
+        line_offsets, mtime = source_file.line_offsets, source_file.mtime
+    with SourceFile(str(path), line_offsets, mtime) as source_file:
+        assert source_file.line_offsets is line_offsets
+
+    # Same size, different lines
+    path.write_text("aa = 1\nb = 2\n")
+    os.utime(path, (mtime + 10, mtime + 10))
+    with SourceFile(str(path), line_offsets, mtime) as source_file:
+        assert list(source_file.line_offsets) == [0, 7, 13]
+        assert source_file.get_lines(2, 2) == "b = 2"
+
+def test_indexed_module_reads_functions_by_span(tmp_path):
+    path = tmp_path / "funcs.py"
+    path.write_text(CODE)
+    module = FunctionIndex().get(str(path))
+    assert module.function_names == ["foo", "bar"]
+    for name in ["foo", "method", "bar"]:
+        assert module.get_function_source(name) == get_function_source_from_source(CODE, name)
+    assert module.get_function_source("missing") is None
@@ -10,11 +10,15 @@ from benchify.source_manipulation import \
     normalize_imported_modules_in_code, \
     classify, \
     classify_wrap, \
+    classify_wrap_indented, \
     find_local_module, \
     get_pip_imports_recursive, \
+    get_pip_imports_for_function, \
     extract_pip_imports, \
     can_import_via_pip, \
-    replace_block_comments
+    replace_block_comments, \
+    get_reachable_statements, \
+    SourceEditor
 
 import ast
 
@@ -249,6 +253,47 @@ class mango_time:
     rhs += "\nmango_time = mango_time()\n"
     assert classify_wrap(lhs, "mango_time") == rhs
 
+def test_classify_wrap_indented():
+    body = "x = 1\n        def f():\n            return x"
+    assert classify_wrap_indented(body, "inner", "    ") == """class inner:
+        x = 1
+        def f():
+            return x
+    inner = inner()"""
+
+def test_normalize_deeply_nested_local_imports(tmp_path):
+    depth = 6
+    for level in range(depth):
+        code = f"VALUE_{level} = {level}\n"
+        if level + 1 < depth:
+            code = f"from .mod{level + 1} import VALUE_{level + 1}\n" + \
+                f"VALUE_{level} = VALUE_{level + 1} + {level}\n"
+        (tmp_path / f"mod{level}.py").write_text(code)
+    normalized_code = normalize_imported_modules_in_code(str(tmp_path / "mod0.py"))
+    namespace = {}
+    exec(compile(normalized_code, "mod0", "exec"), namespace)
+    assert namespace["VALUE_0"] == sum(range(depth))
+    assert f"{' ' * 4 * (depth - 1)}VALUE_{depth - 1} = {depth - 1}" in normalized_code
+
+def test_normalize_nested_local_imports_keep_multiline_literals(tmp_path):
+    text = "\n  indented\nnot indented\n"
+    depth = 4
+    for level in range(depth):
+        code = f'TEXT_{level} = """{text}"""\n'
+        if level + 1 < depth:
+            # Each literal needs the next module's, so every level is kept
+            code = f"from .mod{level + 1} import TEXT_{level + 1}\n" + \
+                f'TEXT_{level} = """{text}""" + TEXT_{level + 1}[:0]\n'
+        (tmp_path / f"mod{level}.py").write_text(code)
+    normalized_code = normalize_imported_modules_in_code(str(tmp_path / "mod0.py"))
+    namespace = {}
+    exec(compile(normalized_code, "mod0", "exec"), namespace)
+    assert namespace["TEXT_0"] == text
+    module = namespace["mod1"]
+    for level in range(1, depth):
+        assert getattr(module, f"TEXT_{level}") == text
+        module = getattr(module, f"mod{level + 1}", None)
+
 def test_find_local_module():
     for module1 in ["demo1", "demo2", "demo3"]:
         for module2 in ["demo1", "demo2", "demo3"]:
@@ -265,17 +310,13 @@ def test_find_local_module():
 def test_normalize_imported_modules_in_code():
     normalized_code = normalize_imported_modules_in_code("tests/fixtures/demo1.py")
     assert normalized_code.strip() == """
-PURPOSE_OF_THIS_FILE = 'just for testing'
+PURPOSE_OF_THIS_FILE = "just for testing"
 
 class demo2:
-
     class demo3:
-        import os
-        import pandas
         banana = 99
-        orange = lambda x: x + 2
+        orange = lambda x : x + 2
     demo3 = demo3()
-
     def blarg(lst):
         return ((lst, lst), demo3.orange(demo3.banana))
 demo2 = demo2()
@@ -283,19 +324,179 @@ import platform as banana_mango
 from sys import platform
 import os
 import numpy
+
 a = 44
 
 def arbitrary_test_function(foo):
     print(a)
-    return (demo2.blarg(2 * [PURPOSE_OF_THIS_FILE] + [str(foo)]), banana_mango.system(), platform(), os.name())
+    return (
+        demo2.blarg(2 * [PURPOSE_OF_THIS_FILE] + [str(foo)]), 
+        banana_mango.system(),
+        platform(),
+        os.name()
+    )
 """.strip()
 
+def test_normalize_preserves_lines_and_formatting(tmp_path):
+    path = tmp_path / "docs.py"
+    path.write_text('''"""
+Module docstring.
+"""
+import os  # keep this comment
+
+def only_doc():
+    """Nothing else."""
+
+def spaced( x ):
+    """
+    Multi-line.
+    """
+    return os.path.join( x, "y" )
+''')
+    normalized_code = normalize_imported_modules_in_code(str(path))
+    ast.parse(normalized_code)
+    lines = normalized_code.split("\n")
+    assert lines[3] == "import os  # keep this comment"
+    assert lines[6].strip() == "pass"
+    assert lines[12] == '    return os.path.join( x, "y" )'
+
+def test_get_reachable_statements():
+    code = """
+import os
+import json, sys as system
+from collections import OrderedDict, defaultdict
+
+UNUSED = 1
+BASE = 10
+
+def helper(x):
+    return json.dumps(x) + str(BASE)
+
+def unused_helper():
+    return os.getcwd()
+
+def entry(y):
+    return helper(defaultdict(list, y))
+
+print("side effect")
+"""
+    reachable = get_reachable_statements(ast.parse(code), {"entry"})
+    assert ast.unparse(ast.Module(body=reachable, type_ignores=[])) == """
+import json
+from collections import defaultdict
+BASE = 10
+
+def helper(x):
+    return json.dumps(x) + str(BASE)
+
+def entry(y):
+    return helper(defaultdict(list, y))""".strip()
+
+def test_get_reachable_statements_keeps_nested_definitions_and_mutations():
+    def reachable(code, names):
+        statements = get_reachable_statements(ast.parse(code), names)
+        return ast.unparse(ast.Module(body=statements, type_ignores=[]))
+
+    # Imports in a try, definitions in an if
+    code = """
+try:
+    import simplejson as json
+except ImportError:
+    import json
+if True:
+    def helper(x):
+        return json.dumps(x)
+else:
+    helper = None
+"""
+    assert reachable(code, {"helper"}) == ast.unparse(ast.parse(code))
+    assert reachable(code, {"json"}) == ast.unparse(ast.parse(code.split("if True")[0]))
+
+    # Items and attributes set on a kept name
+    code = """
+REGISTRY = {}
+REGISTRY["a"] = 1
+OTHER = {}
+OTHER["b"] = 2
+class Box:
+    pass
+box = Box()
+box.value.inner = 3
+del REGISTRY["missing"]
+"""
+    assert reachable(code, {"REGISTRY"}) == \
+        "REGISTRY = {}\nREGISTRY['a'] = 1\ndel REGISTRY['missing']"
+    assert reachable(code, {"box"}) == \
+        "class Box:\n    pass\nbox = Box()\nbox.value.inner = 3"
+
+def test_normalize_keeps_nested_definitions_and_mutations(tmp_path):
+    (tmp_path / "lib.py").write_text("""
+try:
+    import json
+except ImportError:
+    json = None
+
+if True:
+    def helper(x):
+        return json.dumps(x)
+
+REGISTRY = {}
+REGISTRY["a"] = 1
+
+def get(key):
+    return REGISTRY[key]
+
+def unused():
+    return 0
+""")
+    (tmp_path / "main.py").write_text(
+        "from .lib import helper, get\n\ndef f(key):\n    return helper(get(key))\n")
+    normalized_code = normalize_imported_modules_in_code(str(tmp_path / "main.py"))
+    assert "unused" not in normalized_code
+    namespace = {}
+    exec(compile(normalized_code, "main", "exec"), namespace)
+    lib = namespace["lib"]
+    assert callable(lib.helper) and callable(lib.get)
+    assert lib.json.dumps(1) == "1"
+    assert lib.REGISTRY == {"a": 1}
+
 def test_get_pip_imports_recursive():
     assert sorted(get_pip_imports_recursive("tests/fixtures/demo1.py")) == sorted([
         "numpy",
         "pandas"
     ])
 
+def test_get_pip_imports_for_function(tmp_path):
+    (tmp_path / "helpers.py").write_text("""import typer
+import json
+
+def used_helper(x):
+    import jwt
+    return json.dumps(x)
+
+def other():
+    import auth0
+    return typer
+""")
+    (tmp_path / "main.py").write_text("""import appdirs
+from .helpers import used_helper
+
+def target(x):
+    import requests
+    return used_helper(x)
+
+def unrelated():
+    import rich
+    return rich
+""")
+    classifications = {}
+    pip_imports = get_pip_imports_for_function(
+        str(tmp_path / "main.py"), "target", classifications)
+    assert sorted(pip_imports) == ["appdirs", "jwt", "requests"]
+    assert not any(name in ["rich", "typer", "auth0"] for name, _ in classifications)
+    assert get_pip_imports_for_function(
+        str(tmp_path / "main.py"), "unrelated", classifications) == ["appdirs", "rich"]
+
 def test_extract_pip_imports():
     assert ["pandas"] == extract_pip_imports({
         ('local', 'tests/fixtures/demo3.py'): {
@@ -306,4 +507,34 @@ def test_extract_pip_imports():
 def test_can_import_via_pip():
     assert can_import_via_pip("appdirs")
     assert can_import_via_pip("requests")
-    assert not can_import_via_pip("this is definitely absolutely not a pip package")
\ No newline at end of file
+    assert not can_import_via_pip("this is definitely absolutely not a pip package")
+
+def test_source_editor_applies_spans_like_apply():
+    code = "a = x\nb = x; c = x\n\ndef f():\n    return x\n"
+    tree = ast.parse(code)
+    editor = SourceEditor(code)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "x":
+            editor.replace(node, "y\nz")
+    spans = [
+        (editor.offset(node.lineno, 0), editor.offset(node.end_lineno, node.end_col_offset))
+        for node in tree.body
+    ]
+    assert editor.apply_spans(spans, "    ") == \
+        [editor.apply(start, end, "    ") for start, end in spans]
+    assert editor.apply_spans(spans)[1:3] == ["b = y\nz", "b = y\nz; c = y\nz"]
+
+def test_normalize_keeps_multiline_string_literals(tmp_path):
+    (tmp_path / "helper.py").write_text(
+        'QUERY = """\nSELECT *\nFROM t\n"""\n'
+        'TEMPLATE = f"""\n{QUERY}\nLIMIT {1 + 1}\n"""\n'
+        'JOINED = "a\\\nb"\n')
+    (tmp_path / "main.py").write_text(
+        "from .helper import QUERY, TEMPLATE, JOINED\n\ndef f():\n    return QUERY\n")
+    normalized_code = normalize_imported_modules_in_code(str(tmp_path / "main.py"))
+    namespace = {}
+    exec(compile(normalized_code, "main", "exec"), namespace)
+    helper = namespace["helper"]
+    assert helper.QUERY == "\nSELECT *\nFROM t\n"
+    assert helper.TEMPLATE == "\n\nSELECT *\nFROM t\n\nLIMIT 2\n"
+    assert helper.JOINED == "ab"
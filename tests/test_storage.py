@@ -0,0 +1,50 @@
+from benchify.storage import FileLock, atomic_write
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+TRY_LOCK = "import sys; from benchify.storage import FileLock; " + \
+    "print(FileLock(sys.argv[1]).acquire(blocking=False))"
+
+def try_lock_from_another_process(path):
+    output = subprocess.run(
+        [sys.executable, "-c", TRY_LOCK, path], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return output.stdout.strip() == "True"
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / "data.json"
+    atomic_write(str(path), b"old")
+    atomic_write(str(path), b"new", mode=0o600)
+    assert path.read_bytes() == b"new"
+    assert os.listdir(tmp_path) == ["data.json"]
+    if os.name != "nt":
+        assert path.stat().st_mode & 0o777 == 0o600
+
+def test_file_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / "locks" / "token.lock")
+    with FileLock(path):
+        assert not try_lock_from_another_process(path)
+    assert try_lock_from_another_process(path)
+
+def test_file_lock_excludes_other_threads(tmp_path):
+    path = str(tmp_path / "cache.lock")
+    holders = []
+    overlaps = []
+
+    def work():
+        with FileLock(path):
+            holders.append(1)
+            overlaps.append(len(holders))
+            time.sleep(0.02)
+            holders.pop()
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == [1] * 5
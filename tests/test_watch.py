@@ -0,0 +1,100 @@
+from benchify.function_index import FunctionIndex
+from benchify.watch import \
+    InotifyWatcher, \
+    PollingWatcher, \
+    wait_for_changes, \
+    watch_project
+
+import os
+
+def write(path, code):
+    with open(path, "w") as fw:
+        fw.write(code)
+    # make sure the mtime moves even on coarse-grained filesystems
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 1))
+
+def test_function_index_reports_only_changed_functions(tmp_path):
+    path = str(tmp_path / "funcs.py")
+    write(path, """
+def foo(x):
+    return x + 1
+
+def bar(y):
+    return y * 2
+""")
+    index = FunctionIndex()
+    assert sorted(index.update(path)) == ["bar", "foo"]
+    assert index.update(path) == []
+
+    write(path, """
+def foo(x):
+    return x + 1
+
+def bar(y):
+    return y * 3
+
+baz = lambda z : z
+""")
+    assert sorted(index.update(path)) == ["bar", "baz"]
+    assert index.get(path).function_spans["bar"] == (5, 6)
+
+def test_function_index_invalidates_dependents(tmp_path):
+    write(str(tmp_path / "helper.py"), "HELP = 1\n")
+    write(str(tmp_path / "user.py"), "from .helper import HELP\n\ndef f():\n    return HELP\n")
+    index = FunctionIndex()
+    index.update(str(tmp_path / "helper.py"))
+    index.update(str(tmp_path / "user.py"))
+    index.pip_imports[os.path.normpath(str(tmp_path / "user.py"))] = ["cached"]
+
+    write(str(tmp_path / "helper.py"), "HELP = 2\n")
+    index.update(str(tmp_path / "helper.py"))
+    assert os.path.normpath(str(tmp_path / "user.py")) not in index.pip_imports
+
+def test_polling_watcher_debounces(tmp_path):
+    path = str(tmp_path / "a.py")
+    write(path, "x = 1\n")
+    watcher = PollingWatcher(str(tmp_path), interval=0.01)
+    assert wait_for_changes(watcher, debounce=0.05, timeout=0.05) == set()
+    write(path, "x = 2\n")
+    write(str(tmp_path / "b.py"), "y = 1\n")
+    assert wait_for_changes(watcher, debounce=0.05, timeout=1) == {
+        os.path.normpath(path),
+        os.path.normpath(str(tmp_path / "b.py")),
+    }
+
+def test_inotify_watcher(tmp_path):
+    try:
+        watcher = InotifyWatcher(str(tmp_path))
+    except OSError:
+        return
+    path = str(tmp_path / "a.py")
+    write(path, "x = 1\n")
+    write(str(tmp_path / "notes.txt"), "hi\n")
+    assert wait_for_changes(watcher, debounce=0.05, timeout=1) == {os.path.normpath(path)}
+    # Names which are not valid UTF-8 (e.g. editor temporary files) are
+    # decoded as os.listdir decodes them
+    write(os.path.join(os.fsencode(tmp_path), b"tmp\xff.txt"), "hi\n")
+    latin_path = os.path.join(os.fsencode(tmp_path), b"caf\xe9.py")
+    write(latin_path, "x = 1\n")
+    assert wait_for_changes(watcher, debounce=0.05, timeout=1) == \
+        {os.path.normpath(os.fsdecode(latin_path))}
+    watcher.close()
+
+def test_watch_project(tmp_path):
+    path = str(tmp_path / "funcs.py")
+    write(path, "def foo():\n    return 1\n\ndef bar():\n    return 2\n")
+    index = FunctionIndex()
+    index.update(path)
+    watcher = PollingWatcher(str(tmp_path), interval=0.01)
+    calls = []
+
+    write(path, "def foo():\n    return 1\n\ndef bar():\n    return 3\n")
+    watch_project(
+        str(tmp_path),
+        lambda changed_path, names: calls.append((changed_path, names)),
+        debounce=0.05,
+        index=index,
+        watcher=watcher,
+        max_batches=1)
+    assert calls == [(os.path.normpath(path), ["bar"])]